@@ -0,0 +1,115 @@
+import os
+import time
+import wave
+import queue
+import threading
+import subprocess
+import numpy as np
+import sounddevice as sd
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_wav(path):
+    """Decodes a PCM WAV file into a float32 (frames, channels) array."""
+    with wave.open(path, 'rb') as wav_file:
+        params = wav_file.getparams()
+        frames = wav_file.readframes(params.nframes)
+    dtype = {1: np.uint8, 2: np.int16, 4: np.int32}[params.sampwidth]
+    data = np.frombuffer(frames, dtype=dtype).astype(np.float32)
+    if params.sampwidth == 1:
+        data = (data - 128) / 128.0
+    else:
+        data /= float(2 ** (8 * params.sampwidth - 1))
+    return data.reshape(-1, params.nchannels), params.framerate
+
+class AudioControl:
+    """
+    Plays the cue sounds from memory and mutes the default sink over a persistent
+    PulseAudio/PipeWire connection (pulsectl), instead of spawning pw-play and pactl
+    for every utterance. Mute changes and queued cues run on a background worker,
+    in order, so the recording loop never blocks on them.
+    """
+
+    def __init__(self):
+        self.cues = {}
+        self.tasks = queue.Queue()
+        self.pulse = None
+        self.connect()
+        threading.Thread(target=self._worker, daemon=True).start()
+
+    def connect(self):
+        try:
+            import pulsectl
+            self.pulse = pulsectl.Pulse("wtako-asr-ime")
+        except Exception as e:
+            print(f"pulsectl unavailable ({e}), falling back to pactl")
+            self.pulse = None
+
+    def load_cue(self, path):
+        if not path:
+            return None
+        if path not in self.cues:
+            # Resolve path relative to project root (one level up from client/)
+            full_path = os.path.join(PROJECT_ROOT, path)
+            if not os.path.exists(full_path):
+                print(f"Warning: Sound file not found: {full_path}")
+                self.cues[path] = None
+            else:
+                self.cues[path] = load_wav(full_path)
+        return self.cues[path]
+
+    def play_cue(self, path):
+        """Starts playing a cue and returns the monotonic time at which it will have finished."""
+        cue = self.load_cue(path)
+        if cue is None:
+            return time.monotonic()
+        data, rate = cue
+        try:
+            sd.play(data, rate)
+            latency = sd.get_stream().latency
+        except Exception as e:
+            print(f"Error playing cue in-process: {e}")
+            subprocess.Popen(["pw-play", os.path.join(PROJECT_ROOT, path)], stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+            latency = 0.1
+        return time.monotonic() + len(data) / rate + latency
+
+    def queue_cue(self, path):
+        """Plays a cue after all previously queued mute changes have been applied."""
+        self.tasks.put((None, lambda: self.play_cue(path), threading.Event()))
+
+    def set_mute(self, mute=True, at=None):
+        """Mutes or unmutes the default sink, no earlier than the monotonic time `at`. Returns an Event set when done."""
+        done = threading.Event()
+        self.tasks.put((at, lambda: self._apply_mute(mute), done))
+        return done
+
+    def _apply_mute(self, mute):
+        for attempt in range(2):
+            if self.pulse is None:
+                break
+            try:
+                sink = self.pulse.get_sink_by_name(self.pulse.server_info().default_sink_name)
+                self.pulse.mute(sink, mute)
+                return
+            except Exception as e:
+                # The audio server may have restarted, reconnect once before falling back
+                print(f"pulsectl mute failed: {e}")
+                self.connect()
+        try:
+            subprocess.run(["pactl", "set-sink-mute", "@DEFAULT_SINK@", "1" if mute else "0"], check=False)
+        except Exception as e:
+            print(f"Error setting mute: {e}")
+
+    def _worker(self):
+        while True:
+            at, task, done = self.tasks.get()
+            if at is not None:
+                delay = at - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            try:
+                task()
+            except Exception as e:
+                print(f"Audio control error: {e}")
+            finally:
+                done.set()
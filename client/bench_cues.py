@@ -0,0 +1,64 @@
+import os
+import time
+import argparse
+import subprocess
+import numpy as np
+
+from main import CONFIG
+from audio_control import AudioControl, PROJECT_ROOT
+
+def play_sound(path, wait=False):
+    """The original cue playback: one pw-play process per cue."""
+    if path:
+        command = ["pw-play", os.path.join(PROJECT_ROOT, path)]
+        if wait:
+            subprocess.run(command, stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+        else:
+            subprocess.Popen(command, stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+
+def set_mute(mute=True):
+    """The original mute: one pactl process per change."""
+    subprocess.run(["pactl", "set-sink-mute", "@DEFAULT_SINK@", "1" if mute else "0"], check=False)
+
+def report(name, samples):
+    samples_ms = np.array(samples) * 1000
+    print(f"{name:>11}: mean {samples_ms.mean():7.1f} ms  p50 {np.percentile(samples_ms, 50):7.1f} ms  p95 {np.percentile(samples_ms, 95):7.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the time from trigger until capture can start (cue played and sink muted)")
+    parser.add_argument("--iterations", type=int, default=10)
+    args = parser.parse_args()
+
+    sound_up = CONFIG.get("sound_up")
+    sound_down = CONFIG.get("sound_down")
+
+    subprocess_ready = []
+    for _ in range(args.iterations):
+        start = time.monotonic()
+        # The original sequence: blocking pw-play, pactl, then a fixed 100 ms settle
+        play_sound(sound_up, wait=True)
+        set_mute(True)
+        time.sleep(0.1)
+        subprocess_ready.append(time.monotonic() - start)
+        play_sound(sound_down)
+        set_mute(False)
+        time.sleep(0.5)
+
+    control = AudioControl()
+    in_process_ready = []
+    for _ in range(args.iterations):
+        start = time.monotonic()
+        cue_end = control.play_cue(sound_up)
+        control.set_mute(True, at=cue_end).wait()
+        in_process_ready.append(time.monotonic() - start)
+        control.set_mute(False)
+        control.queue_cue(sound_down)
+        time.sleep(0.5)
+
+    cue, rate = control.load_cue(sound_up)
+    print(f"Cue length: {len(cue) / rate * 1000:.1f} ms")
+    report("subprocess", subprocess_ready)
+    report("in-process", in_process_ready)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import os
+import sys
+import time
+import argparse
+import subprocess
+import json
+import numpy as np
+import psutil
+
+from main import CONFIG
+import local_transport
+from embedded import EmbeddedBackend
+
+def rss_mb(process):
+    """Resident memory of a process and all of its children."""
+    total = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try:
+            total += child.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    return total / (1024 * 1024)
+
+def run_requests(transcribe, audio, sample_rate, iterations):
+    transcribe(audio, sample_rate)
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        transcribe(audio, sample_rate)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the embedded backend with the local server subprocess")
+    parser.add_argument("--backend", type=str, default=CONFIG.get("asr_backend", "glm"))
+    parser.add_argument("--duration", type=float, default=5.0, help="Utterance length in seconds")
+    parser.add_argument("--sample-rate", type=int, default=48000)
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--unix-socket", type=str, default="/tmp/glm_asr_bench_modes.sock")
+    args = parser.parse_args()
+
+    audio = (np.random.default_rng(0).standard_normal(int(args.duration * args.sample_rate)) * 0.05).astype(np.float32)
+    this_process = psutil.Process()
+    baseline_mb = rss_mb(this_process)
+    results = {}
+
+    # Subprocess mode: server.py with the local Unix socket transport
+    server_script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server", "server.py")
+    start = time.perf_counter()
+    server_proc = subprocess.Popen([sys.executable, server_script, "--backend", args.backend, "--port", "8766",
+                                    "--unix-socket", args.unix_socket, "--config-json", json.dumps(CONFIG)])
+    try:
+        while not os.path.exists(args.unix_socket):
+            if server_proc.poll() is not None:
+                raise RuntimeError("Local server exited")
+            time.sleep(0.1)
+        startup = time.perf_counter() - start
+        samples = run_requests(lambda a, sr: local_transport.request(args.unix_socket, a, sr), audio, args.sample_rate, args.iterations)
+        results["subprocess"] = (startup, rss_mb(this_process) - baseline_mb, samples)
+    finally:
+        server_proc.terminate()
+        server_proc.wait()
+
+    # Embedded mode: same backend on an inference thread in this process
+    start = time.perf_counter()
+    embedded = EmbeddedBackend(args.backend, CONFIG)
+    embedded.ready.wait()
+    startup = time.perf_counter() - start
+    samples = run_requests(lambda a, sr: embedded.transcribe(a, sr).result(), audio, args.sample_rate, args.iterations)
+    results["embedded"] = (startup, rss_mb(this_process) - baseline_mb, samples)
+    embedded.stop()
+
+    print(f"Backend {args.backend}, {args.duration:.1f}s utterances")
+    for mode, (startup, memory, samples) in results.items():
+        print(f"{mode:>10}: startup {startup:6.2f} s  memory +{memory:8.1f} MB  latency mean {np.mean(samples):7.1f} ms  p95 {np.percentile(samples, 95):7.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import queue
+import threading
+from concurrent.futures import Future
+
+from backends.registry import create_backend
+
+class EmbeddedBackend:
+    """
+    Hosts an ASRBackend inside the client process instead of a local server.
+
+    The model is loaded and run on one dedicated inference thread, so the
+    recording loop and the GUI never block on model loading, and requests are
+    served one at a time.
+    """
+
+    def __init__(self, backend_type, config):
+        self.requests = queue.Queue()
+        self.ready = threading.Event()
+        self.error = None
+        self.backend = None
+        self.thread = threading.Thread(target=self._worker, args=(backend_type, config), daemon=True)
+        self.thread.start()
+
+    def _worker(self, backend_type, config):
+        try:
+            self.backend = create_backend(backend_type, config=config)
+        except Exception as e:
+            print(f"Error loading embedded backend: {e}")
+            self.error = e
+            return
+        self.ready.set()
+        print(f"Embedded {backend_type} backend ready")
+
+        while True:
+            item = self.requests.get()
+            if item is None:
+                break
+            future, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self.backend.transcribe(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
+    def transcribe(self, audio_data, sample_rate, system_prompt=None, **kwargs):
+        """Queues a request for the inference thread and returns a Future of the text."""
+        future = Future()
+        if self.error is not None:
+            future.set_exception(self.error)
+        else:
+            self.requests.put((future, (audio_data, sample_rate, system_prompt), kwargs))
+        return future
+
+    def stop(self):
+        self.requests.put(None)
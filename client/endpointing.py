@@ -0,0 +1,131 @@
+import collections
+from enum import Enum, auto
+
+FRAME_DURATION_MS = 32
+SPEECH_THRESHOLD = 0.5
+
+class Endpoint(Enum):
+    SPEECH = auto()
+    SILENCE = auto()
+    PAUSE = auto()  # Silence just reached the speculative point, speech may still resume
+    END = auto()
+
+class FixedEndpointer:
+    """Ends an utterance after a fixed run of silent frames (the original 640 ms rule)."""
+
+    def __init__(self, silence_ms=640, speculative_ms=None, frame_ms=FRAME_DURATION_MS, threshold=SPEECH_THRESHOLD):
+        self.silence_ms = silence_ms
+        self.frame_ms = frame_ms
+        self.threshold = threshold
+        self.speculative_frames = int(speculative_ms / frame_ms) if speculative_ms else None
+        self.reset()
+
+    def reset(self):
+        """Clears per-utterance state. Called at the start of every utterance."""
+        self.silent_frames = 0
+
+    def timeout_frames(self):
+        return int(self.silence_ms / self.frame_ms)
+
+    def on_speech(self, speech_prob):
+        pass
+
+    def on_silence(self, speech_prob):
+        pass
+
+    def update(self, speech_prob):
+        """Feeds the VAD probability of one frame after speech has started."""
+        if speech_prob > self.threshold:
+            self.on_speech(speech_prob)
+            self.silent_frames = 0
+            return Endpoint.SPEECH
+
+        self.silent_frames += 1
+        self.on_silence(speech_prob)
+        if self.silent_frames > self.timeout_frames():
+            return Endpoint.END
+        if self.speculative_frames and self.silent_frames == self.speculative_frames:
+            return Endpoint.PAUSE
+        return Endpoint.SILENCE
+
+class AdaptiveEndpointer(FixedEndpointer):
+    """
+    Adapts the silence timeout to the speaker instead of always waiting 640 ms.
+
+    - Pause statistics: the lengths of pauses after which speech resumed are kept
+      across utterances, the timeout follows their 90th percentile.
+    - Speech rate: frequent short speech bursts (fast talkers) shorten the timeout.
+    - VAD trend: probabilities that decay to near zero end early, probabilities
+      hovering just under the threshold (trailing syllables, breath) extend it.
+    """
+
+    def __init__(self, silence_ms=640, min_silence_ms=256, max_silence_ms=1200, pause_margin=1.3,
+                 reference_rate=2.0, history=50, speculative_ms=None, frame_ms=FRAME_DURATION_MS,
+                 threshold=SPEECH_THRESHOLD):
+        self.min_silence_ms = min_silence_ms
+        self.max_silence_ms = max_silence_ms
+        self.pause_margin = pause_margin
+        self.reference_rate = reference_rate
+        # Learned across utterances, so it is not cleared by reset()
+        self.pauses = collections.deque(maxlen=history)
+        super().__init__(silence_ms=silence_ms, speculative_ms=speculative_ms, frame_ms=frame_ms, threshold=threshold)
+
+    def reset(self):
+        super().reset()
+        self.total_frames = 0
+        self.bursts = 0
+        self.in_speech = False
+        self.silence_probs = collections.deque(maxlen=6)
+
+    def on_speech(self, speech_prob):
+        self.total_frames += 1
+        if not self.in_speech:
+            self.bursts += 1
+            self.in_speech = True
+        # Speech resumed, so the silence run that just ended was an intra-utterance pause
+        if self.silent_frames >= 2:
+            self.pauses.append(self.silent_frames)
+        self.silence_probs.clear()
+
+    def on_silence(self, speech_prob):
+        self.total_frames += 1
+        self.in_speech = False
+        self.silence_probs.append(speech_prob)
+
+    def timeout_ms(self):
+        timeout = self.silence_ms
+        if len(self.pauses) >= 5:
+            ordered = sorted(self.pauses)
+            p90 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))]
+            timeout = (p90 + 2) * self.frame_ms * self.pause_margin
+
+        elapsed_s = self.total_frames * self.frame_ms / 1000
+        if elapsed_s >= 1.0 and self.bursts > 0:
+            rate = self.bursts / elapsed_s
+            timeout *= min(1.25, max(0.75, self.reference_rate / rate))
+
+        if len(self.silence_probs) >= 3:
+            probs = list(self.silence_probs)
+            mean = sum(probs) / len(probs)
+            if mean < 0.1 and probs[-1] <= probs[0]:
+                timeout *= 0.75
+            elif mean > 0.3:
+                timeout *= 1.25
+
+        return min(self.max_silence_ms, max(self.min_silence_ms, timeout))
+
+    def timeout_frames(self):
+        return int(self.timeout_ms() / self.frame_ms)
+
+def create_endpointer(config):
+    """Builds the endpointer described by the "endpointing" section of the client config."""
+    ep_config = dict(config.get("endpointing", {}))
+    mode = ep_config.pop("mode", "fixed")
+    speculative = ep_config.pop("speculative", False)
+    speculative_ms = ep_config.pop("speculative_ms", 256)
+    ep_config["speculative_ms"] = speculative_ms if speculative else None
+    if mode == "adaptive":
+        return AdaptiveEndpointer(**ep_config)
+    elif mode == "fixed":
+        return FixedEndpointer(silence_ms=ep_config.get("silence_ms", 640), speculative_ms=ep_config["speculative_ms"])
+    raise ValueError(f"Unknown endpointing mode: {mode}")
@@ -0,0 +1,127 @@
+import os
+import sys
+import json
+import wave
+import argparse
+import numpy as np
+
+from endpointing import FRAME_DURATION_MS, SPEECH_THRESHOLD, Endpoint, FixedEndpointer, create_endpointer
+
+VAD_SAMPLE_RATE = 16000
+VAD_FRAME_SAMPLES = 512
+
+def load_probs(path, vad_model=None):
+    """Returns per-frame VAD probabilities for a recorded session (.wav or .json)."""
+    if path.endswith(".json"):
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    import torch
+    import torchaudio
+    with wave.open(path, 'rb') as wav_file:
+        params = wav_file.getparams()
+        frames = wav_file.readframes(params.nframes)
+    audio = np.frombuffer(frames, dtype=np.int16).astype(np.float32) / 32768.0
+    if params.nchannels > 1:
+        audio = audio.reshape(-1, params.nchannels).mean(axis=1)
+    audio_tensor = torch.from_numpy(audio)
+    if params.framerate != VAD_SAMPLE_RATE:
+        audio_tensor = torchaudio.transforms.Resample(params.framerate, VAD_SAMPLE_RATE)(audio_tensor.unsqueeze(0)).squeeze(0)
+
+    probs = []
+    vad_model.reset_states()
+    with torch.no_grad():
+        for i in range(0, audio_tensor.shape[0] - VAD_FRAME_SAMPLES + 1, VAD_FRAME_SAMPLES):
+            probs.append(vad_model(audio_tensor[i:i + VAD_FRAME_SAMPLES], VAD_SAMPLE_RATE).item())
+    return probs
+
+def reference_utterances(probs, gap_ms):
+    """Splits a session into (first, last) speech frame pairs separated by long silences."""
+    gap_frames = int(gap_ms / FRAME_DURATION_MS)
+    utterances = []
+    start = last = None
+    for i, p in enumerate(probs):
+        if p <= SPEECH_THRESHOLD:
+            continue
+        if start is None:
+            start = last = i
+        elif i - last > gap_frames:
+            utterances.append((start, last))
+            start = last = i
+        else:
+            last = i
+    if start is not None:
+        utterances.append((start, last))
+    return utterances
+
+def simulate(endpointer, probs, utterances):
+    """Runs the endpointer from each utterance onset, returns (latencies_ms, premature count)."""
+    latencies = []
+    premature = 0
+    for start, last in utterances:
+        endpointer.reset()
+        cut = len(probs)
+        for i in range(start, len(probs)):
+            if endpointer.update(probs[i]) == Endpoint.END:
+                cut = i
+                break
+        if cut < last:
+            premature += 1
+        else:
+            latencies.append((cut - last) * FRAME_DURATION_MS)
+    return latencies, premature
+
+def summarize(name, latencies, premature, total):
+    if latencies:
+        p50, p95 = np.percentile(latencies, [50, 95])
+        mean = float(np.mean(latencies))
+    else:
+        p50 = p95 = mean = float("nan")
+    print(f"{name:>10}: mean {mean:7.1f} ms  p50 {p50:7.1f} ms  p95 {p95:7.1f} ms  premature {premature}/{total}")
+    return mean
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline endpointing evaluation over recorded sessions")
+    parser.add_argument("sessions", nargs="+", help="Session recordings (.wav) or VAD probability traces (.json)")
+    parser.add_argument("--config", type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json"), help="Client config with an endpointing section")
+    parser.add_argument("--reference-gap-ms", type=int, default=1500, help="Silence that separates reference utterances")
+    parser.add_argument("--dump-probs", action="store_true", help="Write a .json probability trace next to each .wav")
+    args = parser.parse_args()
+
+    config = {}
+    if os.path.exists(args.config):
+        with open(args.config, 'r') as f:
+            config = json.load(f)
+
+    vad_model = None
+    if any(path.endswith(".wav") for path in args.sessions):
+        from silero_vad import load_silero_vad
+        vad_model = load_silero_vad()
+
+    fixed = FixedEndpointer(silence_ms=config.get("endpointing", {}).get("silence_ms", 640))
+    candidate = create_endpointer(config)
+    results = {"fixed": ([], 0), "candidate": ([], 0)}
+    total = 0
+
+    for path in args.sessions:
+        probs = load_probs(path, vad_model)
+        if args.dump_probs and path.endswith(".wav"):
+            with open(os.path.splitext(path)[0] + ".json", 'w') as f:
+                json.dump(probs, f)
+        utterances = reference_utterances(probs, args.reference_gap_ms)
+        total += len(utterances)
+        for name, endpointer in (("fixed", fixed), ("candidate", candidate)):
+            latencies, premature = simulate(endpointer, probs, utterances)
+            results[name] = (results[name][0] + latencies, results[name][1] + premature)
+
+    if total == 0:
+        print("No speech found in the given sessions.")
+        sys.exit(1)
+
+    print(f"{total} reference utterances, candidate: {type(candidate).__name__}")
+    fixed_mean = summarize("fixed", *results["fixed"], total)
+    candidate_mean = summarize("candidate", *results["candidate"], total)
+    print(f"Mean endpointing latency saved: {fixed_mean - candidate_mean:.1f} ms per utterance")
+
+if __name__ == "__main__":
+    main()
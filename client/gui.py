@@ -14,10 +14,10 @@ import sounddevice as sd
 
 # Import the existing ASRClient logic
 try:
-    from main import ASRClient, CONFIG, play_sound, save_config
+    from main import ASRClient, CONFIG, save_config
 except ImportError:
     sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-    from main import ASRClient, CONFIG, play_sound, save_config
+    from main import ASRClient, CONFIG, save_config
 
 # i18n helper
 def get_i18n(config):
@@ -139,6 +139,10 @@ class ASRGui(ctk.CTk):
         self.clear_button = ctk.CTkButton(self.status_frame, text=self.i18n.get("clear_log", "Clear Log"), width=80, command=self.clear_log)
         self.clear_button.grid(row=0, column=1, sticky="e")
 
+        # Phase breakdown of the last utterance, in milliseconds
+        self.latency_label = ctk.CTkLabel(self.status_frame, text="", font=ctk.CTkFont(size=12), text_color="grey", anchor="w")
+        self.latency_label.grid(row=1, column=0, columnspan=2, sticky="w")
+
         # Transcription Area
         self.textbox = ctk.CTkTextbox(self.main_frame, width=400, height=200)
         self.textbox.grid(row=1, column=0, padx=20, pady=10, sticky="nsew")
@@ -333,6 +337,10 @@ class ASRGui(ctk.CTk):
         self.start_volume_monitor()
 
     def on_backend_change(self, backend):
+        if self.is_running and self.client:
+            # Start loading it now, requests carry the selected backend from here on
+            self.client.preload_backend(backend)
+
         if self.use_custom_url.get():
             self.system_prompt_label.grid_remove()
             self.system_prompt_entry.grid_remove()
@@ -385,7 +393,9 @@ class ASRGui(ctk.CTk):
             self.device_option.configure(state="disabled" if is_running else "normal")
             self.hotkey_option.configure(state="disabled" if is_running else "normal")
             self.record_button.configure(state="disabled" if is_running else "normal")
-            self.backend_option.configure(state="disabled" if is_running else "normal")
+            # The server loads other backends on demand, only an embedded backend is fixed once started
+            embedded = self.config.get("use_local_server", True) and self.config.get("local_mode", "subprocess") == "embedded"
+            self.backend_option.configure(state="disabled" if is_running and embedded else "normal")
             
             # These settings can be changed while running
             self.system_prompt_entry.configure(state=state)
@@ -612,6 +622,10 @@ class ASRGui(ctk.CTk):
         else:
             self.status_label.configure(text_color=ctk.ThemeManager.theme["CTkLabel"]["text_color"])
 
+    def show_latency(self, breakdown):
+        phases = " · ".join(f"{name} {ms:.0f}" for name, ms in breakdown.items())
+        self.latency_label.configure(text=f"{self.i18n.get('last_latency', 'Last utterance (ms):')} {phases}")
+
     def log_transcription(self, text):
         if self.disable_log_var.get() and "Config saved" not in text:
             return
@@ -795,7 +809,7 @@ class ASRGui(ctk.CTk):
 
             # Monkey patch the client to update UI
             original_send_to_asr = self.client.send_to_asr
-            def patched_send_to_asr(audio_data, sample_rate):
+            def patched_send_to_asr(audio_data, sample_rate, speculative=None):
                 self.transition_to(AppState.PROCESSING)
                 
                 # Get current UI settings to "try" them without saving to file
@@ -811,13 +825,17 @@ class ASRGui(ctk.CTk):
                         self.config[k] = v
                 
                 try:
-                    res = original_send_to_asr(audio_data, sample_rate)
+                    res = original_send_to_asr(audio_data, sample_rate, speculative=speculative)
                 finally:
                     pass
 
                 if res:
                     self.after(0, lambda r=res: self.log_transcription(r))
-                self.transition_to(AppState.LISTENING)
+                # Continuous mode keeps capturing while earlier utterances are transcribed
+                if self.config.get("continuous_mode") and self.client and self.client.is_recording_dict.get("active"):
+                    self.transition_to(AppState.RECORDING)
+                else:
+                    self.transition_to(AppState.LISTENING)
                 return res
             
             self.client.send_to_asr = patched_send_to_asr
@@ -829,12 +847,13 @@ class ASRGui(ctk.CTk):
                 original_audio_callback(indata, frames, time_info, status)
             
             self.client.audio_callback = patched_audio_callback
+            self.client.latency_log.on_finish = lambda breakdown: self.after(0, lambda: self.show_latency(breakdown))
 
             # Stop the standalone volume monitor before starting ASR stream
             self.stop_volume_monitor()
 
             # Start local server if needed
-            if self.config.get("use_local_server", True):
+            if self.config.get("use_local_server", True) or self.client.hybrid is not None:
                 self.local_server_proc = self.client.start_local_server()
             
             # Start threads
@@ -876,6 +895,7 @@ class ASRGui(ctk.CTk):
                                           channels=self.client.input_channels, 
                                           callback=self.client.audio_callback, 
                                           blocksize=CHUNK_SIZE):
+                            self.client.mark_stream_open()
                             while self.is_running and self.client and not self.client.stop_event.is_set() and \
                                   (self.client.is_recording_dict.get("active") or self.client.is_recording_dict.get("internal_active")):
                                 time.sleep(0.1)
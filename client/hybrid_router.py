@@ -0,0 +1,104 @@
+"""
+Routing of utterances between a lightweight local backend and the remote servers.
+
+Short commands are often transcribed sooner on the local CPU than after a round
+trip to a remote GPU, long dictation the other way round. Each utterance goes
+where it is expected to finish first:
+
+    local  = local seconds per audio second x duration + local_bias_ms
+    remote = network and server overhead + reported queue wait + remote RTF x duration
+
+Every term is learned from finished utterances: the local time per audio second,
+and from the server's JSON timing the round trip not spent in its queue or model,
+its RTF, and its queue depth and expected wait when it answered (the wait counts
+down as time passes without a newer report). Until both sides were measured,
+utterances up to prior_local_seconds go local. Longer than max_local_seconds
+always goes remote, for accuracy, unless no remote server is available.
+"""
+import time
+import threading
+
+# Weight of the newest measurement in each estimate
+SMOOTHING = 0.2
+
+def ewma(previous, value):
+    return value if previous is None else (1 - SMOOTHING) * previous + SMOOTHING * value
+
+class HybridRouter:
+    def __init__(self, config):
+        self.local_backend = config.get("local_backend", "sensevoice")
+        self.max_local_seconds = config.get("max_local_seconds", 10.0)
+        self.prior_local_seconds = config.get("prior_local_seconds", 2.0)
+        # Positive values favour the (usually more accurate) remote backend
+        self.local_bias = config.get("local_bias_ms", 100) / 1000
+        self.lock = threading.Lock()
+        self.local_spa = None  # local seconds per audio second (at least one second)
+        self.remote_overhead = None  # round trip minus queue wait and inference
+        self.remote_rtf = None
+        self.queue_depth = 0
+        self.expected_wait = 0.0
+        self.reported_at = None
+        self.decisions = {"local": 0, "remote": 0}
+
+    def estimates(self, audio_seconds):
+        """(local, remote) expected seconds, None where not measured yet."""
+        with self.lock:
+            local = None
+            if self.local_spa is not None:
+                local = self.local_spa * max(1.0, audio_seconds) + self.local_bias
+            remote = None
+            if self.remote_overhead is not None and self.remote_rtf is not None:
+                wait = 0.0
+                if self.reported_at is not None:
+                    wait = max(0.0, self.expected_wait - (time.monotonic() - self.reported_at))
+                remote = self.remote_overhead + wait + self.remote_rtf * audio_seconds
+            return local, remote
+
+    def choose(self, audio_seconds, local_ready=True, remote_available=True):
+        """Returns (route, reason, local estimate, remote estimate)."""
+        local, remote = self.estimates(audio_seconds)
+        if not local_ready:
+            route, reason = "remote", "local backend not ready"
+        elif not remote_available:
+            route, reason = "local", "no remote server available"
+        elif audio_seconds > self.max_local_seconds:
+            route, reason = "remote", f"longer than {self.max_local_seconds:g}s"
+        elif local is None or remote is None:
+            route = "local" if audio_seconds <= self.prior_local_seconds else "remote"
+            reason = f"not measured yet, {'up to' if route == 'local' else 'over'} {self.prior_local_seconds:g}s"
+        elif local <= remote:
+            route, reason = "local", "expected sooner"
+        else:
+            route, reason = "remote", "expected sooner"
+        with self.lock:
+            self.decisions[route] += 1
+        return route, reason, local, remote
+
+    def record_local(self, seconds, audio_seconds):
+        with self.lock:
+            self.local_spa = ewma(self.local_spa, seconds / max(1.0, audio_seconds))
+
+    def record_remote(self, rtt, result):
+        """Learns from a remote round trip and the server's timing JSON."""
+        stages = result.get("stages_ms", {})
+        inference = stages.get("inference")
+        audio_seconds = result.get("audio_seconds")
+        with self.lock:
+            if inference is not None:
+                self.remote_overhead = ewma(self.remote_overhead, max(0.0, rtt - (inference + stages.get("queue", 0.0)) / 1000))
+                if audio_seconds:
+                    self.remote_rtf = ewma(self.remote_rtf, inference / 1000 / audio_seconds)
+            if "expected_wait_ms" in result:
+                self.queue_depth = result.get("queue_depth", 0)
+                self.expected_wait = result["expected_wait_ms"] / 1000
+                self.reported_at = time.monotonic()
+
+    def status(self):
+        with self.lock:
+            return {
+                "local_seconds_per_audio_second": self.local_spa,
+                "remote_overhead": self.remote_overhead,
+                "remote_rtf": self.remote_rtf,
+                "remote_queue_depth": self.queue_depth,
+                "decisions": dict(self.decisions),
+            }
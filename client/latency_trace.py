@@ -0,0 +1,169 @@
+"""
+Per-utterance latency trace of the client.
+
+Every utterance gets monotonic timestamps for the moments it passes through
+(hotkey, stream open, cue and mute done, first speech, end of speech, silence
+timeout, pasted) and durations for the work done on it (WAV encode, round trip,
+OpenCC and replace, paste). Finished traces are appended as JSON lines to a
+rolling log. Running this file summarises that log:
+
+    uv run client/latency_trace.py                # all phases, p50/p90/p99
+    uv run client/latency_trace.py --last 50
+    uv run client/latency_trace.py --group route  # separately per hybrid route
+"""
+import os
+import json
+import time
+import argparse
+import threading
+from contextlib import contextmanager
+
+DEFAULT_LOG = os.path.join(os.path.expanduser("~"), ".cache", "wtako-asr-ime", "latency.jsonl")
+
+# Phase name -> (start mark, end mark). Each is the time between the two
+# timestamps, skipped when either was not reached.
+SPANS = {
+    "trigger": ("hotkey", "triggered"),
+    "stream_open": ("hotkey", "stream_open"),
+    "cue_and_mute": ("triggered", "muted"),
+    "first_speech": ("muted", "first_speech"),
+    "silence_timeout": ("last_speech", "endpoint"),
+}
+# Phases timed directly, in the order they happen
+DURATIONS = ("wav_encode", "round_trip", "postprocess", "paste")
+PHASES = tuple(SPANS) + DURATIONS + ("total",)
+
+class UtteranceTrace:
+    def __init__(self, start=None):
+        self.marks = {"hotkey": start if start is not None else time.monotonic()}
+        self.durations = {}
+        self.info = {}
+
+    def mark(self, name, at=None):
+        """Records the time of a moment (now by default), the latest call wins."""
+        self.marks[name] = at if at is not None else time.monotonic()
+
+    def mark_once(self, name):
+        if name not in self.marks:
+            self.mark(name)
+
+    @contextmanager
+    def phase(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.durations[name] = self.durations.get(name, 0.0) + time.monotonic() - start
+
+    def note(self, **info):
+        self.info.update(info)
+
+    def breakdown(self):
+        """Phase -> milliseconds."""
+        result = {}
+        for name, (start, end) in SPANS.items():
+            if start in self.marks and end in self.marks:
+                result[name] = round((self.marks[end] - self.marks[start]) * 1000, 1)
+        for name in DURATIONS:
+            if name in self.durations:
+                result[name] = round(self.durations[name] * 1000, 1)
+        if "done" in self.marks:
+            result["total"] = round((self.marks["done"] - self.marks["hotkey"]) * 1000, 1)
+        return result
+
+_local = threading.local()
+
+def current_trace():
+    """Trace of the utterance handled by the calling thread, a throwaway one outside an utterance."""
+    trace = getattr(_local, "trace", None)
+    return trace if trace is not None else UtteranceTrace()
+
+@contextmanager
+def tracing(trace):
+    """Makes trace the calling thread's current trace."""
+    previous = getattr(_local, "trace", None)
+    _local.trace = trace
+    try:
+        yield trace
+    finally:
+        _local.trace = previous
+
+class LatencyLog:
+    """Appends finished traces to path, keeping one rotated file once it grows past max_kb."""
+
+    def __init__(self, path=None, max_kb=1024, enabled=True):
+        self.path = path or DEFAULT_LOG
+        self.max_bytes = max_kb * 1024
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.last = None
+        # Called with the breakdown of every finished utterance (the GUI shows it)
+        self.on_finish = None
+
+    def finish(self, trace):
+        trace.mark("done")
+        breakdown = trace.breakdown()
+        self.last = breakdown
+        print("Latency: " + ", ".join(f"{name} {ms:.0f}" for name, ms in breakdown.items()) + " ms")
+        if self.enabled:
+            record = {"time": time.time(), "phases": breakdown}
+            record.update(trace.info)
+            try:
+                self.write(json.dumps(record, ensure_ascii=False))
+            except OSError as e:
+                print(f"Could not write latency log {self.path}: {e}")
+        if self.on_finish:
+            self.on_finish(breakdown)
+        return breakdown
+
+    def write(self, line):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                os.replace(self.path, self.path + ".1")
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+def read_log(path):
+    records = []
+    for p in (path + ".1", path):
+        if not os.path.exists(p):
+            continue
+        with open(p, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    pass
+    return records
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def summarize(records):
+    print(f"{len(records)} utterances")
+    print(f"{'phase':>16} {'count':>6} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}")
+    for name in PHASES:
+        values = [r["phases"][name] for r in records if name in r.get("phases", {})]
+        if values:
+            print(f"{name:>16} {len(values):6d} {percentile(values, 50):8.0f} {percentile(values, 90):8.0f} {percentile(values, 99):8.0f} {max(values):8.0f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarise the client latency log (milliseconds per phase)")
+    parser.add_argument("log", nargs="?", default=DEFAULT_LOG, help="Latency log (default: %(default)s)")
+    parser.add_argument("--last", type=int, default=0, help="Only the most recent N utterances")
+    parser.add_argument("--group", type=str, help="Summarise separately per value of this logged field (e.g. route, server)")
+    args = parser.parse_args()
+
+    records = read_log(args.log)
+    if args.last:
+        records = records[-args.last:]
+    if not records:
+        print(f"No utterances in {args.log}")
+    elif args.group:
+        for value in sorted({str(r.get(args.group)) for r in records}):
+            print(f"\n{args.group} = {value}")
+            summarize([r for r in records if str(r.get(args.group)) == value])
+    else:
+        summarize(records)
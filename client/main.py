@@ -1,6 +1,7 @@
 import os
 import sys
 import time
+import collections
 import threading
 import queue
 import numpy as np
@@ -17,7 +18,28 @@ import wave
 import requests
 import argparse
 import json
-import opencc
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from endpointing import Endpoint, create_endpointer
+from audio_control import AudioControl
+
+# Modules shared with the server live in server/
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server"))
+import local_transport
+from embedded import EmbeddedBackend
+from backends.registry import BACKEND_TYPES
+from latency_trace import LatencyLog, UtteranceTrace, current_trace, tracing
+from server_pool import ServerPool
+from hybrid_router import HybridRouter
+from postprocess import Pipeline, Transcript, compile_replacements
+from speech_gate import SpeechGate
+
+# Extra seconds to wait past the request deadline, for the server's answer (or 503) to arrive
+REPLY_GRACE_SECONDS = 2.0
+# An unreachable server fails over after this long instead of after the whole request timeout
+CONNECT_TIMEOUT_SECONDS = 2.0
+# Sent with every utterance, everything else of the backend config goes into the profile
+UTTERANCE_FIELDS = ("history", "deadline_ms", "request_id")
 
 def load_config():
     config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
@@ -41,46 +63,83 @@ def save_config(config):
     with open(config_path, 'w') as f:
         json.dump(config, f, indent=4)
 
-def play_sound(path, wait=False):
-    if path:
-        # Resolve path relative to project root (one level up from client/)
-        project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        full_path = os.path.join(project_root, path)
-        if os.path.exists(full_path):
-            if wait:
-                subprocess.run(["pw-play", full_path], stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+def form_fields(values):
+    """Settings as form fields: dicts and lists as JSON strings, None values left out."""
+    data = {}
+    for k, v in values.items():
+        if v is not None:
+            # If the value is a dict or list, send it as a JSON string
+            if isinstance(v, (dict, list)):
+                data[k] = json.dumps(v)
             else:
-                subprocess.Popen(["pw-play", full_path], stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
-        else:
-            print(f"Warning: Sound file not found: {full_path}")
+                data[k] = str(v)
+    return data
 
-def set_mute(mute=True):
-    """Mute or unmute the default sink using pactl."""
-    try:
-        state = "1" if mute else "0"
-        subprocess.run(["pactl", "set-sink-mute", "@DEFAULT_SINK@", state], check=False)
-    except Exception as e:
-        print(f"Error setting mute: {e}")
+def profile_key(settings):
+    return json.dumps(settings, sort_keys=True)
 
 class ASRClient:
     def __init__(self, config=None):
         self.config = config if config is not None else CONFIG
         
         # Determine ASR server URL from config
+        self.local_socket = None
+        self.embedded = None
         if self.config.get("use_local_server"):
             self.asr_server_url = "http://localhost:8000"
+            # A local server also gets the raw float32 Unix socket transport, HTTP stays for health checks
+            if self.config.get("local_transport", "unix") == "unix":
+                self.local_socket = self.config.get("local_server_socket", "/tmp/glm_asr_server.sock")
         else:
             self.asr_server_url = self.config.get("default_asr_server", "http://localhost:8000")
-            
-        print(f"Using ASR server: {self.asr_server_url}")
+        # Further servers to fail over and hedge to, default_asr_server stays the first choice
+        urls = [self.asr_server_url]
+        if not self.config.get("use_local_server"):
+            urls += [url for url in self.config.get("asr_servers", []) if url not in urls]
+        self.server_pool = ServerPool(urls)
+        self.http_executor = ThreadPoolExecutor(max_workers=2 * len(urls) + 2)
+
+        print(f"Using ASR server{'s' if len(urls) > 1 else ''}: {', '.join(urls)}")
+        # Hybrid routing: a lightweight local backend next to the remote servers, started by start_local_server
+        hybrid = self.config.get("hybrid", {})
+        self.hybrid = HybridRouter(hybrid) if hybrid.get("enabled") and not self.config.get("use_local_server") else None
+        self.hybrid_embedded = None
+        self.hybrid_socket = None
         
         print("Loading Silero VAD model...")
         self.vad_model = load_silero_vad()
         
         self.uinput_device = self.setup_uinput()
+        self.audio_control = AudioControl()
         self.is_recording_dict = {"active": False, "internal_active": False, "cancel": False}
         self.stop_event = threading.Event()
         self.audio_queue = queue.Queue()
+        self.endpointer = create_endpointer(self.config)
+        # Speculative request sent at the first pause of an utterance: (audio, future)
+        self.speculation = None
+        self.speculation_executor = ThreadPoolExecutor(max_workers=1)
+        # Continuous mode: utterances are transcribed concurrently and typed in submission order
+        self.transcribe_executor = ThreadPoolExecutor(max_workers=self.config.get("continuous_max_inflight", 2))
+        self.pending_results = queue.Queue()
+        # Raw transcripts of recent utterances, sent as history when history_turns is set
+        self.history = collections.deque(maxlen=20)
+        # Stage timings of the last server response (server_timing), with the measured round trip
+        self.last_server_timing = None
+        # (server URL, settings) -> id of the config profile registered there, and servers without profiles
+        self.server_profiles = {}
+        self.profiles_unsupported = set()
+        # Text post-processing, minus the stages a server reports it ran
+        self.pipeline = Pipeline()
+        # Request id -> server URL of requests waiting for a server, cancelled when the hotkey is pressed again
+        self.inflight_requests = {}
+        # Utterances the server rejected because it was overloaded
+        self.shed_count = 0
+        # Drops captures that are not speech (coughs, clicks) before they are uploaded
+        self.speech_gate = SpeechGate(self.config.get("speech_gate"))
+        # Latency trace of the utterance started by the last hotkey press
+        self.session_trace = None
+        self.latency_log = LatencyLog(self.config.get("latency_log"), self.config.get("latency_log_max_kb", 1024),
+                                      enabled=self.config.get("latency_trace", True))
         
         self.input_device, self.input_sample_rate, self.input_channels = self.find_device(self.config.get("audio_devices", []))
         if self.input_device is None:
@@ -124,22 +183,158 @@ class ASRClient:
             except: pass
 
     def check_server_ready(self):
+        if self.embedded is not None:
+            return self.embedded.ready.is_set()
         try:
-            # Simple GET request to check if server is up
-            response = requests.get(self.asr_server_url, timeout=1)
-            # Even if it returns 405 (Method Not Allowed) for GET, it means the server is listening
-            return True
+            # Simple GET request to check if server is up, any of them will do
+            for url in self.server_pool.ranked():
+                try:
+                    requests.get(url, timeout=1)
+                    # Even if it returns 405 (Method Not Allowed) for GET, it means the server is listening
+                    return True
+                except:
+                    pass
+            return False
         except:
             return False
 
-    def send_to_asr(self, audio_data, sample_rate):
-        # Get system prompt from config
-        backend = self.config.get("asr_backend", "glm")
+    def request_transcription(self, audio_data, sample_rate, request_id=None):
+        """Posts audio to the ASR server and returns the raw text, or "" on failure."""
+        # Lets the request be cancelled on the server while it runs
+        request_id = request_id or uuid.uuid4().hex
+        self.inflight_requests[request_id] = self.asr_server_url
+        try:
+            if self.hybrid is not None:
+                return self.route_transcription(audio_data, sample_rate, request_id)
+            return self.post_transcription(audio_data, sample_rate, request_id)
+        finally:
+            self.inflight_requests.pop(request_id, None)
+
+    def route_transcription(self, audio_data, sample_rate, request_id):
+        """Hybrid routing: transcribes locally or remotely, whichever is expected to answer first."""
+        audio_seconds = len(audio_data) / sample_rate
+        if self.hybrid_embedded is not None:
+            local_ready = self.hybrid_embedded.ready.is_set()
+        else:
+            local_ready = bool(self.hybrid_socket and os.path.exists(self.hybrid_socket))
+        route, reason, local, remote = self.hybrid.choose(audio_seconds, local_ready, self.server_pool.any_available())
+        estimate = lambda seconds: None if seconds is None else round(seconds * 1000)
+        print(f"Routing {audio_seconds:.1f}s utterance {route} ({reason}): local ~{estimate(local)} ms, remote ~{estimate(remote)} ms")
+        # Logged with the utterance's latency, `latency_trace.py --group route` compares the outcomes
+        current_trace().note(route=route, route_reason=reason, route_local_ms=estimate(local), route_remote_ms=estimate(remote))
+        if route == "local":
+            start = time.perf_counter()
+            try:
+                text = self.transcribe_local(audio_data, sample_rate, request_id)
+                self.hybrid.record_local(time.perf_counter() - start, audio_seconds)
+                return text
+            except local_transport.TransportError as e:
+                if e.status == 499:
+                    print("ASR request cancelled")
+                    return ""
+                print(f"Local ASR failed, sending the utterance to the remote server: {e}")
+            except Exception as e:
+                print(f"Local ASR failed, sending the utterance to the remote server: {e}")
+            current_trace().note(route="remote", route_reason="local failed")
+            self.inflight_requests[request_id] = self.asr_server_url
+        return self.post_transcription(audio_data, sample_rate, request_id)
+
+    def transcribe_local(self, audio_data, sample_rate, request_id):
+        """Transcribes with the hybrid local backend. Raises on failure."""
+        backend_config, timeout = self.request_params(self.hybrid.local_backend, len(audio_data) / sample_rate, request_id)
+        params = {k: (v if isinstance(v, (dict, list)) else str(v)) for k, v in backend_config.items() if v is not None}
+        if self.hybrid_embedded is not None:
+            return self.embedded_transcribe(self.hybrid_embedded, audio_data, sample_rate, params, timeout)
+        self.inflight_requests[request_id] = f"http://localhost:{self.config['hybrid'].get('local_port', 8001)}"
+        return self.local_socket_transcribe(self.hybrid_socket, audio_data, sample_rate, params, timeout)
+
+    def request_params(self, backend, audio_seconds, request_id):
+        """Settings sent with an utterance to backend, and the seconds its text is worth waiting for."""
         if backend == "sherpa-onnx/sense-voice":
             backend = "sensevoice"
+        backend_config = dict(self.config.get(backend, {}))
+
+        # Recent transcripts as conversation context, lets the server reuse its prefix cache
+        history_turns = int(backend_config.pop("history_turns", 0))
+        if history_turns > 0 and self.history:
+            backend_config["history"] = [{"role": "assistant", "content": text} for text in list(self.history)[-history_turns:]]
+        # Servers hosting several backends route on this, so switching needs no restart
+        backend_config["backend"] = backend
+        # Text arriving later than this is stale: the server sheds the request instead
+        timeout = self.request_timeout(audio_seconds)
+        backend_config["deadline_ms"] = int(timeout * 1000)
+        backend_config["request_id"] = request_id
+        # Dictation goes ahead of long uploads, and the server shares its time fairly per client
+        backend_config["priority"] = self.config.get("request_priority", "interactive")
+        backend_config["client_id"] = self.config.get("client_id") or socket.gethostname()
+        # A server that converts does it with this mode, empty for none (see postprocess.py)
+        backend_config["opencc_convert"] = self.config.get("opencc_convert") or ""
+        return backend_config, timeout
+
+    def embedded_transcribe(self, embedded, audio_data, sample_rate, params, timeout):
+        system_prompt = params.pop("system_prompt", None)
+        # Only meaningful to a server
+        for key in ("backend", "deadline_ms", "request_id", "priority", "client_id", "opencc_convert"):
+            params.pop(key, None)
+        with current_trace().phase("round_trip"):
+            return embedded.transcribe(audio_data, sample_rate, system_prompt=system_prompt, **params).result(timeout=timeout)
+
+    def local_socket_transcribe(self, path, audio_data, sample_rate, params, timeout):
+        """Raw float32 request over a local server's Unix socket. Raises on failure."""
+        server_timing = self.config.get("server_timing", True)
+        if server_timing:
+            params["response_format"] = "json"
+        start = time.perf_counter()
+        payload = local_transport.request(path, audio_data, sample_rate, params, timeout=timeout + REPLY_GRACE_SECONDS)
+        rtt = time.perf_counter() - start
+        current_trace().durations["round_trip"] = rtt
+        # The stages the server applied come with every response, in its header
+        if not server_timing:
+            return payload
+        try:
+            result = json.loads(payload)
+        except ValueError:
+            # Server that ignores response_format
+            result = None
+        if isinstance(result, dict) and "text" in result:
+            self.log_server_timing(rtt, result, remote=False)
+            return Transcript(result["text"], payload.postprocessed)
+        return payload
+
+    def post_transcription(self, audio_data, sample_rate, request_id):
+        backend_config, timeout = self.request_params(self.config.get("asr_backend", "glm"), len(audio_data) / sample_rate, request_id)
+
+        # Same values the HTTP form carries, but without the WAV and JSON round trip
+        params = {k: (v if isinstance(v, (dict, list)) else str(v)) for k, v in backend_config.items() if v is not None}
+        if self.embedded is not None:
+            try:
+                return self.embedded_transcribe(self.embedded, audio_data, sample_rate, params, timeout)
+            except Exception as e:
+                print(f"Embedded ASR failed: {e}")
+                return ""
+
+        server_timing = self.config.get("server_timing", True)
+        if self.local_socket and os.path.exists(self.local_socket):
+            try:
+                return self.local_socket_transcribe(self.local_socket, audio_data, sample_rate, params, timeout)
+            except local_transport.TransportError as e:
+                if e.status == 503:
+                    # Same server behind HTTP, retrying there would only add load
+                    self.on_shed(str(e))
+                    return ""
+                if e.status == 499:
+                    print("ASR request cancelled")
+                    return ""
+                print(f"Local transport failed, falling back to HTTP: {e}")
+            except TimeoutError:
+                print(f"ASR request timed out after {timeout + REPLY_GRACE_SECONDS:.0f}s")
+                self.cancel_request(request_id)
+                return ""
+            except Exception as e:
+                print(f"Local transport failed, falling back to HTTP: {e}")
         
         # Convert to WAV in memory
-        with io.BytesIO() as bio:
+        with current_trace().phase("wav_encode"), io.BytesIO() as bio:
             with wave.open(bio, 'wb') as wav_file:
                 wav_file.setnchannels(1)
                 wav_file.setsampwidth(2) # 16-bit
@@ -150,48 +345,329 @@ class ASRClient:
             
             wav_data = bio.getvalue()
         
+        # Settings that are the same for every utterance are registered once as a profile (see profile_fields)
+        # Scalars as strings, the way the server parses them from form fields
+        settings = {k: (v if isinstance(v, (dict, list)) else str(v)) for k, v in backend_config.items() if k not in UTTERANCE_FIELDS and v is not None}
+        data = form_fields({k: v for k, v in backend_config.items() if k in UTTERANCE_FIELDS})
+        headers = {'Accept': 'application/json'} if server_timing else {}
+        return self.post_http(wav_data, settings, data, headers, timeout, request_id, len(audio_data) / sample_rate)
+
+    def post_http(self, wav_data, settings, data, headers, timeout, request_id, audio_seconds):
+        """
+        Posts the utterance to the best server of the pool. Connection errors,
+        server errors and 503s fail over to the next server. With hedging on, a
+        request still unanswered after the server's p95 round trip is sent to the
+        next server too: the first answer wins and the other request is cancelled.
+        """
+        trace = current_trace()
+        candidates = self.server_pool.ranked()
+        deadline = time.monotonic() + timeout + REPLY_GRACE_SECONDS
+        hedge = self.config.get("hedge_requests", True) and len(candidates) > 1
+        hedge_min_delay = self.config.get("hedge_min_delay_ms", 300) / 1000
+        attempts = {}  # future -> (url, request id)
+        launched = []
+        hedged = False
+        shed_reason = None
+        start = time.perf_counter()
+
+        def launch(rid):
+            url = candidates.pop(0)
+            self.inflight_requests[rid] = url
+            future = self.http_executor.submit(self.post_to_server, trace, url, wav_data, settings, dict(data, request_id=rid), headers,
+                                               deadline - time.monotonic(), audio_seconds)
+            attempts[future] = (url, rid)
+            launched.append(rid)
+            return url
+
+        def cancel_others():
+            for url, rid in attempts.values():
+                self.cancel_request(rid, url)
+
+        primary = launch(request_id)
         try:
-            files = {'audio': ('audio.wav', wav_data, 'audio/wav')}
-            
-            # Prepare data with all settings from the current backend config
-            data = {}
-            backend_config = self.config.get(backend, {})
-            for k, v in backend_config.items():
-                if v is not None:
-                    # If the value is a dict or list, send it as a JSON string
-                    if isinstance(v, (dict, list)):
-                        data[k] = json.dumps(v)
-                    else:
-                        data[k] = str(v)
-                
-            response = requests.post(self.asr_server_url, files=files, data=data, timeout=60)
+            while attempts:
+                wait_for = deadline - time.monotonic()
+                hedge_delay = self.server_pool.hedge_delay(primary, audio_seconds, hedge_min_delay) if hedge and not hedged and candidates else None
+                if hedge_delay is not None:
+                    wait_for = min(wait_for, start + hedge_delay - time.perf_counter())
+                done, _ = wait(list(attempts), timeout=max(0.0, wait_for), return_when=FIRST_COMPLETED)
+                if not done:
+                    if hedge_delay is None or time.monotonic() >= deadline:
+                        print(f"ASR request timed out after {timeout + REPLY_GRACE_SECONDS:.0f}s")
+                        cancel_others()
+                        return ""
+                    hedged = True
+                    url = launch(f"{request_id}-hedge")
+                    print(f"No answer from {primary} after {hedge_delay * 1000:.0f} ms, hedging to {url}")
+                    trace.note(hedged=True)
+                    continue
+                for future in done:
+                    url, rid = attempts.pop(future)
+                    outcome, value = future.result()
+                    if outcome == "ok":
+                        trace.durations["round_trip"] = time.perf_counter() - start
+                        if hedged:
+                            print(f"Hedged request answered first by {url}")
+                            self.server_pool.record_hedge_win(url)
+                            # The slower server's round trip is at least this long, so it ranks lower next time
+                            for other, _ in attempts.values():
+                                self.server_pool.record_latency(other, time.perf_counter() - start, audio_seconds)
+                        trace.note(server=url)
+                        cancel_others()
+                        return value
+                    if outcome in ("cancelled", "rejected"):
+                        cancel_others()
+                        return ""
+                    if outcome == "shed":
+                        shed_reason = value
+                    elif outcome == "timeout":
+                        self.cancel_request(rid, url)
+                # Fail over once nothing else is running for this utterance
+                if not attempts and candidates and time.monotonic() < deadline:
+                    url = launch(f"{request_id}-{len(self.server_pool.urls) - len(candidates)}")
+                    print(f"Failing over to {url}")
+                    trace.note(failover=True)
+            if shed_reason is not None:
+                self.on_shed(shed_reason)
+            return ""
+        finally:
+            for rid in launched:
+                self.inflight_requests.pop(rid, None)
+
+    def post_to_server(self, trace, url, wav_data, settings, data, headers, timeout, audio_seconds):
+        """
+        One attempt of post_http. Returns (outcome, value): ("ok", text), ("shed",
+        reason), ("cancelled", None), ("rejected", None) for errors another server
+        would repeat, ("error", None) and ("timeout", None).
+        """
+        with tracing(trace):
+            self.server_pool.started(url)
+            try:
+                files = {'audio': ('audio.wav', wav_data, 'audio/wav')}
+                for attempt in range(2):
+                    fields = dict(self.profile_fields(url, settings), **data)
+                    start = time.perf_counter()
+                    response = requests.post(url, files=files, data=fields, headers=headers, timeout=(CONNECT_TIMEOUT_SECONDS, max(0.1, timeout)))
+                    rtt = time.perf_counter() - start
+                    if response.status_code != 409 or "profile" not in fields:
+                        break
+                    # Evicted, or the server restarted since it was registered
+                    print(f"{url} no longer has profile {fields['profile']}, registering it again")
+                    self.server_profiles.pop((url, profile_key(settings)), None)
+            except requests.ConnectionError as e:
+                print(f"ASR Request to {url} failed: {e}")
+                self.server_pool.record_failure(url)
+                return "error", None
+            except requests.Timeout:
+                return "timeout", None
+            except Exception as e:
+                print(f"ASR Request to {url} failed: {e}")
+                self.server_pool.record_failure(url)
+                return "error", None
+            finally:
+                self.server_pool.finished(url)
+
             if response.status_code == 200:
+                self.server_pool.record_success(url, rtt, audio_seconds)
                 response.encoding = 'utf-8'
-                text = response.text
-                
-                # Apply OpenCC immediately after receiving server response
-                opencc_mode = self.config.get("opencc_convert")
-                if opencc_mode:
-                    try:
-                        converter = opencc.OpenCC(opencc_mode)
-                        text = converter.convert(text)
-                        print(f"OpenCC converted ({opencc_mode}): {text}")
-                    except Exception as e:
-                        print(f"OpenCC conversion error: {e}")
+                if response.headers.get('Content-Type', '').startswith('application/json'):
+                    result = response.json()
+                    self.log_server_timing(rtt, result)
+                    return "ok", Transcript(result["text"], result.get("postprocessed", ()))
+                if response.headers.get('Server-Timing'):
+                    print(f"ASR round trip {rtt * 1000:.0f} ms, server timing: {response.headers['Server-Timing']}")
+                postprocessed = [name.strip() for name in response.headers.get('X-Postprocessed', '').split(",") if name.strip()]
+                return "ok", Transcript(response.text, postprocessed)
+            elif response.status_code == 499:
+                print("ASR request cancelled")
+                return "cancelled", None
+            elif response.status_code == 503:
+                retry_after = response.headers.get('Retry-After', '?')
+                self.server_pool.record_shed(url, float(retry_after) if retry_after.replace('.', '', 1).isdigit() else 1.0)
+                return "shed", f"{response.text} (Retry-After: {retry_after}s)"
+            print(f"ASR Error from {url}: {response.status_code} - {response.text}")
+            if response.status_code >= 500:
+                self.server_pool.record_failure(url)
+                return "error", None
+            return "rejected", None
 
-                # Apply extra_replace if configured for the current backend
-                extra_replace = backend_config.get("extra_replace")
-                if extra_replace and isinstance(extra_replace, dict):
-                    for old, new in extra_replace.items():
-                        text = text.replace(old, new)
-                    print(f"Extra replace applied: {text}")
+    def profile_fields(self, url, settings):
+        """
+        Form fields carrying settings to url: the id of a profile registered there
+        (registered now if needed), or every setting when the server has no
+        profiles or config_profiles is off.
+        """
+        if self.config.get("config_profiles", True) and url not in self.profiles_unsupported:
+            key = (url, profile_key(settings))
+            profile = self.server_profiles.get(key)
+            if profile is None:
+                profile = self.register_profile(url, settings)
+                if profile is not None:
+                    self.server_profiles[key] = profile
+            if profile is not None:
+                return {"profile": profile}
+        return form_fields(settings)
 
-                return text
-            else:
-                print(f"ASR Error: {response.status_code} - {response.text}")
+    def register_profile(self, url, settings):
+        """POSTs settings to url/profiles and returns the profile id, None when that fails."""
+        try:
+            response = requests.post(url.rstrip("/") + "/profiles", json={"settings": settings}, timeout=(CONNECT_TIMEOUT_SECONDS, 5))
         except Exception as e:
-            print(f"ASR Request failed: {e}")
-        return ""
+            print(f"Registering config profile on {url} failed: {e}")
+            return None
+        if response.status_code == 200:
+            profile = response.json()["profile_id"]
+            print(f"Registered config profile {profile} on {url}")
+            return profile
+        # Older server, it takes the POST for a transcription without audio
+        print(f"{url} does not support config profiles ({response.status_code}), sending every setting with each utterance")
+        self.profiles_unsupported.add(url)
+        return None
+
+    def cancel_request(self, request_id, url=None):
+        """Asks the server (the one request_id went to by default) to stop working on it, in the background."""
+        if self.embedded is not None:
+            return
+        url = url or self.inflight_requests.get(request_id) or self.asr_server_url
+        def post():
+            try:
+                requests.post(url.rstrip("/") + "/cancel", json={"request_id": request_id}, timeout=2)
+            except Exception as e:
+                print(f"Cancelling request {request_id} failed: {e}")
+        threading.Thread(target=post, daemon=True).start()
+
+    def cancel_inflight(self):
+        for request_id in list(self.inflight_requests):
+            print(f"Cancelling ASR request {request_id}")
+            self.cancel_request(request_id)
+
+    def request_timeout(self, audio_seconds):
+        """Seconds the text of an utterance this long is still worth waiting for."""
+        timeout = self.config.get("request_timeout_base", 5.0) + audio_seconds * self.config.get("request_timeout_per_second", 1.0)
+        return min(timeout, self.config.get("request_timeout_max", 60.0))
+
+    def on_shed(self, reason):
+        """The server rejected the utterance as it could not transcribe it in time."""
+        self.shed_count += 1
+        current_trace().note(shed=True)
+        print(f"ASR server busy, utterance dropped ({self.shed_count} so far): {reason}")
+
+    def log_server_timing(self, rtt, result, remote=True):
+        """Prints the server's stage timings next to the measured round trip."""
+        if remote and self.hybrid is not None:
+            self.hybrid.record_remote(rtt, result)
+        server_ms = result.get("total_ms", 0.0)
+        stages = ", ".join(f"{name} {ms:.0f}" for name, ms in result.get("stages_ms", {}).items())
+        details = [f"{result.get('backend', '?')}/{result.get('model', '?')}"]
+        if "audio_seconds" in result:
+            details.append(f"audio {result['audio_seconds']:.2f}s")
+        if "rtf" in result:
+            details.append(f"RTF {result['rtf']:.2f}")
+        if "cache_hit" in result:
+            details.append("cache hit" if result["cache_hit"] else "cache miss")
+        print(f"ASR round trip {rtt * 1000:.0f} ms = server {server_ms:.0f} ms ({stages}) + network {rtt * 1000 - server_ms:.0f} ms | {', '.join(details)}")
+        self.last_server_timing = dict(result, rtt_ms=round(rtt * 1000, 1))
+        current_trace().note(server_ms=server_ms, server_stages=result.get("stages_ms", {}))
+
+    def preload_backend(self, backend):
+        """Asks the server to load backend in the background, so the first request to it is fast."""
+        if self.embedded is not None:
+            return
+        def post(url):
+            try:
+                response = requests.post(url.rstrip("/") + "/models/load", json={"backend": backend}, timeout=600)
+                if response.status_code != 200:
+                    print(f"Preloading {backend} on {url} failed: {response.status_code} - {response.text}")
+            except Exception as e:
+                print(f"Preloading {backend} on {url} failed: {e}")
+        for url in self.server_pool.urls:
+            threading.Thread(target=post, args=(url,), daemon=True).start()
+
+    def speculate(self, audio_data, sample_rate):
+        """Starts transcribing the utterance so far while the endpointer is still waiting."""
+        request_id = uuid.uuid4().hex
+        self.speculation = (audio_data, self.speculation_executor.submit(self.request_transcription, audio_data, sample_rate, request_id), request_id)
+
+    def discard_speculation(self):
+        """Drops the speculative request, cancelling it on the server if it is still running."""
+        speculation, self.speculation = self.speculation, None
+        if speculation is not None and not speculation[1].done():
+            self.cancel_request(speculation[2])
+
+    def take_speculation(self, audio_data):
+        """Returns the speculative future if it was computed on a prefix of audio_data."""
+        speculation, self.speculation = self.speculation, None
+        if speculation is None:
+            return None
+        spec_audio, future, request_id = speculation
+        if len(audio_data) >= len(spec_audio) and np.array_equal(audio_data[:len(spec_audio)], spec_audio):
+            return future
+        if not future.done():
+            self.cancel_request(request_id)
+        return None
+
+    def send_to_asr(self, audio_data, sample_rate, speculative=None):
+        """
+        Transcribes and post-processes an utterance. speculative is the future of a
+        speculative request for it, taken with take_speculation() by the recording
+        thread at the endpoint, since this may run later on another thread.
+        """
+        backend = self.config.get("asr_backend", "glm")
+        if backend == "sherpa-onnx/sense-voice":
+            backend = "sensevoice"
+        backend_config = self.config.get(backend, {})
+
+        future = speculative
+        if future is not None:
+            print("Using speculative transcription")
+            current_trace().note(speculative=True)
+            with current_trace().phase("round_trip"):
+                text = future.result()
+        else:
+            text = self.request_transcription(audio_data, sample_rate)
+        if not text:
+            return ""
+        self.history.append(text)
+        with current_trace().phase("postprocess"):
+            # Stages the server already ran are not applied twice
+            return self.postprocess(text, backend_config, skip=getattr(text, "postprocessed", ()))
+
+    def postprocess(self, text, backend_config, skip=()):
+        settings = {"opencc_convert": self.config.get("opencc_convert"),
+                    "replacements": compile_replacements(backend_config.get("extra_replace"))}
+        if skip:
+            print(f"Already done by the server: {', '.join(skip)}")
+        text, _ = self.pipeline.run(str(text), settings, skip=skip)
+        return text
+
+    def submit_utterance(self, audio_data, sample_rate, trace):
+        """Queues an utterance for transcription without waiting for the result. Called by the recording thread."""
+        print(f"Submitting {len(audio_data) / sample_rate:.2f}s utterance")
+        # Taken now: by the time the worker runs, the slot may hold the next utterance's speculation
+        speculative = self.take_speculation(audio_data)
+        self.pending_results.put((trace, self.transcribe_executor.submit(self.traced_send_to_asr, trace, audio_data, sample_rate, speculative)))
+
+    def traced_send_to_asr(self, trace, audio_data, sample_rate, speculative=None):
+        with tracing(trace):
+            return self.send_to_asr(audio_data, sample_rate, speculative=speculative)
+
+    def typing_loop(self):
+        """Types continuous-mode results in the order their utterances were captured."""
+        while not self.stop_event.is_set():
+            try:
+                trace, future = self.pending_results.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                text = future.result()
+            except Exception as e:
+                print(f"Transcription failed: {e}")
+                continue
+            if text:
+                print(f"Result: {text}")
+                with trace.phase("paste"):
+                    self.wayland_type(text)
+            self.latency_log.finish(trace)
 
     def audio_callback(self, indata, frames, time_info, status):
         if status: print(f"Audio Status: {status}", file=sys.stderr)
@@ -200,9 +676,9 @@ class ASRClient:
 
     def recording_loop(self):
         VAD_SAMPLE_RATE = 16000
-        FRAME_DURATION_MS = 32
-        PADDING_DURATION_MS = 640
-        max_silent_frames = int(PADDING_DURATION_MS / FRAME_DURATION_MS)
+        continuous = self.config.get("continuous_mode", False)
+        if continuous:
+            threading.Thread(target=self.typing_loop, daemon=True).start()
 
         while not self.stop_event.is_set():
             if not self.is_recording_dict["active"]:
@@ -216,15 +692,19 @@ class ASRClient:
                 
             self.is_recording_dict["internal_active"] = True
             print("Triggered! Playing sound...")
-            play_sound(self.config.get("sound_up"), wait=True)
-            set_mute(True)
-            # Wait a bit for the system to actually mute and for any residual audio to clear
-            time.sleep(0.1)
-            print("Muted. VAD Listening...")
+            triggered_at = time.monotonic()
+            trace = self.session_trace or UtteranceTrace(triggered_at)
+            trace.mark("triggered", triggered_at)
+            # Mute once the cue has been heard; audio captured before then is dropped below
+            cue_end = self.audio_control.play_cue(self.config.get("sound_up"))
+            muted = self.audio_control.set_mute(True, at=cue_end)
+            print("VAD Listening...")
             
             recorded_audio = []
-            num_silent_frames = 0
-            # Clear queue AFTER muting to ensure no pre-mute audio is processed
+            stats = self.speech_gate.stats()
+            self.endpointer.reset()
+            self.discard_speculation()
+            # Drop audio left over from the previous cycle
             while not self.audio_queue.empty():
                 try:
                     self.audio_queue.get_nowait()
@@ -235,7 +715,14 @@ class ASRClient:
             
             while not self.stop_event.is_set():
                 if self.is_recording_dict.get("cancel"):
-                    print("VAD: Cancelled by user")
+                    if continuous and active:
+                        # In continuous mode the hotkey ends dictation, keep the utterance in progress
+                        print("VAD: Stopped by user")
+                        trace.mark("endpoint")
+                        if self.admit_capture(stats, trace):
+                            self.submit_utterance(np.concatenate(recorded_audio).flatten(), self.input_sample_rate, trace)
+                    else:
+                        print("VAD: Cancelled by user")
                     recorded_audio = []
                     break
 
@@ -243,6 +730,20 @@ class ASRClient:
                     chunk = self.audio_queue.get(timeout=0.1)
                 except queue.Empty:
                     continue
+
+                if muted is not None:
+                    if not muted.is_set():
+                        continue
+                    print(f"Muted. Cue and mute took {(time.monotonic() - triggered_at) * 1000:.0f} ms")
+                    trace.mark("muted")
+                    muted = None
+                    # Clear queue AFTER muting to ensure no pre-mute audio is processed
+                    while not self.audio_queue.empty():
+                        try:
+                            self.audio_queue.get_nowait()
+                        except queue.Empty:
+                            break
+                    continue
                 
                 if self.input_channels > 1:
                     chunk_mono = np.mean(chunk, axis=1, keepdims=False).reshape(-1, 1)
@@ -264,37 +765,76 @@ class ASRClient:
                 
                 is_speech = speech_prob > 0.5
                 
+                if is_speech and not active:
+                    print(f"VAD: Speech started (prob: {speech_prob:.2f})")
+                    active = True
+                    speech_detected = True
+                    trace.mark_once("first_speech")
                 if is_speech:
-                    if not active:
-                        print(f"VAD: Speech started (prob: {speech_prob:.2f})")
-                        active = True
-                        speech_detected = True
-                    num_silent_frames = 0
-                    recorded_audio.append(chunk_mono)
-                elif active:
+                    trace.mark("last_speech")
+
+                if active:
                     recorded_audio.append(chunk_mono)
-                    num_silent_frames += 1
-                    if num_silent_frames > max_silent_frames:
-                        print("VAD: Silence timeout")
+                    stats.add(speech_prob, chunk_mono, self.input_sample_rate)
+                    decision = self.endpointer.update(speech_prob)
+                    if decision == Endpoint.END:
+                        print(f"VAD: Silence timeout ({self.endpointer.silent_frames * self.endpointer.frame_ms} ms)")
                         active = False
+                        trace.mark("endpoint")
+                        if continuous:
+                            if self.admit_capture(stats, trace):
+                                self.submit_utterance(np.concatenate(recorded_audio).flatten(), self.input_sample_rate, trace)
+                            # The next utterance is timed from here
+                            trace = UtteranceTrace()
+                            recorded_audio = []
+                            stats = self.speech_gate.stats()
+                            self.endpointer.reset()
+                            continue
                         break
+                    elif decision == Endpoint.PAUSE and self.speech_gate.check(stats) is None:
+                        self.speculate(np.concatenate(recorded_audio).flatten(), self.input_sample_rate)
+                    elif decision == Endpoint.SPEECH and self.speculation is not None:
+                        print("VAD: Speech resumed, discarding speculative request")
+                        self.discard_speculation()
                 elif not speech_detected:
                     pass
 
+            if recorded_audio and not self.admit_capture(stats, trace):
+                recorded_audio = []
             if recorded_audio:
                 print(f"Processing {len(recorded_audio)} chunks of audio...")
                 full_audio = np.concatenate(recorded_audio).flatten()
-                text = self.send_to_asr(full_audio, self.input_sample_rate)
-                if text:
-                    print(f"Result: {text}")
-                    self.wayland_type(text)
+                with tracing(trace):
+                    text = self.send_to_asr(full_audio, self.input_sample_rate, speculative=self.take_speculation(full_audio))
+                    if text and self.is_recording_dict.get("cancel"):
+                        print(f"Discarding result, cancelled by user: {text}")
+                    elif text:
+                        print(f"Result: {text}")
+                        with trace.phase("paste"):
+                            self.wayland_type(text)
+                self.latency_log.finish(trace)
+            self.session_trace = None
             
             self.is_recording_dict["active"] = False
             self.is_recording_dict["internal_active"] = False
             self.is_recording_dict["cancel"] = False
             print("Recording cycle finished. Waiting for next trigger.")
-            play_sound(self.config.get("sound_down"))
-            set_mute(False)
+            self.audio_control.set_mute(False)
+            self.audio_control.queue_cue(self.config.get("sound_down"))
+
+    def admit_capture(self, stats, trace):
+        """Speech gate before upload. False when the capture is dropped as not speech."""
+        if self.speech_gate.admit(stats):
+            return True
+        trace.note(gated=True)
+        self.discard_speculation()
+        return False
+
+    def mark_stream_open(self):
+        """Called by whoever opens the input stream once it is running."""
+        trace = self.session_trace
+        if trace is not None:
+            trace.mark_once("stream_open")
 
     def socket_listener(self):
         socket_path = self.config.get("socket_path", "/tmp/glm_asr_keyboard.sock")
@@ -314,7 +854,11 @@ class ASRClient:
                         if data == b"DOWN":
                             if self.is_recording_dict["active"]:
                                 self.is_recording_dict["cancel"] = True
+                                # Continuous mode still types the utterances already sent
+                                if not self.config.get("continuous_mode", False):
+                                    self.cancel_inflight()
                             else:
+                                self.session_trace = UtteranceTrace()
                                 self.is_recording_dict["active"] = True
                                 self.is_recording_dict["cancel"] = False
                         elif data == b"UP":
@@ -343,6 +887,7 @@ class ASRClient:
                                           channels=self.input_channels, 
                                           callback=self.audio_callback, 
                                           blocksize=CHUNK_SIZE):
+                            self.mark_stream_open()
                             while not self.stop_event.is_set() and (self.is_recording_dict["active"] or self.is_recording_dict["internal_active"]):
                                 time.sleep(0.1)
                         print("InputStream closed.")
@@ -364,13 +909,42 @@ class ASRClient:
         return self.keyboard_proc
 
     def start_local_server(self):
+        if self.hybrid is not None:
+            return self.start_hybrid_local()
+        backend = self.config.get("asr_backend", "glm")
+        if self.config.get("local_mode", "subprocess") == "embedded":
+            # Load the backend in this process instead of spawning server.py
+            print("Starting embedded ASR backend...")
+            self.embedded = EmbeddedBackend(backend, self.config)
+            return None
+
         print("Starting local ASR server...")
         server_script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server", "server.py")
-        backend = self.config.get("asr_backend", "glm")
         
         # Pass the current in-memory CONFIG as a JSON string to the server
         # This avoids overwriting config.json while ensuring the server uses latest UI settings
         cmd = [sys.executable, server_script, "--backend", backend, "--config-json", json.dumps(self.config)]
+        # The backend menu switches backends on this server without a restart
+        cmd += ["--backends"] + [name for name in BACKEND_TYPES if name != backend]
+        if self.local_socket:
+            cmd += ["--unix-socket", self.local_socket]
+        self.server_proc = subprocess.Popen(cmd)
+        return self.server_proc
+
+    def start_hybrid_local(self):
+        """Starts hybrid routing's local backend, in this process or as a local server."""
+        hybrid = self.config.get("hybrid", {})
+        backend = self.hybrid.local_backend
+        if hybrid.get("local_mode", "embedded") == "embedded":
+            print(f"Starting embedded {backend} backend for hybrid routing...")
+            self.hybrid_embedded = EmbeddedBackend(backend, self.config)
+            return None
+
+        print(f"Starting local {backend} server for hybrid routing...")
+        server_script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server", "server.py")
+        self.hybrid_socket = hybrid.get("local_socket", "/tmp/glm_asr_hybrid.sock")
+        cmd = [sys.executable, server_script, "--backend", backend, "--port", str(hybrid.get("local_port", 8001)),
+               "--config-json", json.dumps(self.config), "--unix-socket", self.hybrid_socket]
         self.server_proc = subprocess.Popen(cmd)
         return self.server_proc
 
@@ -379,7 +953,9 @@ class ASRClient:
         self.stop_event.set()
         
         # Ensure unmuted on stop
-        set_mute(False)
+        self.audio_control.set_mute(False).wait(timeout=1.0)
+        self.transcribe_executor.shutdown(wait=False, cancel_futures=True)
+        self.speculation_executor.shutdown(wait=False, cancel_futures=True)
 
         # Cleanup socket
         socket_path = self.config.get("socket_path", "/tmp/glm_asr_keyboard.sock")
@@ -415,6 +991,13 @@ class ASRClient:
                 pass
             self.keyboard_proc = None
 
+        if self.embedded is not None:
+            self.embedded.stop()
+            self.embedded = None
+        if self.hybrid_embedded is not None:
+            self.hybrid_embedded.stop()
+            self.hybrid_embedded = None
+
         if hasattr(self, 'server_proc') and self.server_proc:
             print("Cleaning up local ASR server...")
             try:
@@ -439,7 +1022,7 @@ if __name__ == "__main__":
     
     client = ASRClient(CONFIG)
     
-    if CONFIG.get("use_local_server"):
+    if CONFIG.get("use_local_server") or client.hybrid is not None:
         client.start_local_server()
         # Give the server a moment to start
         time.sleep(2)
@@ -0,0 +1,136 @@
+"""
+Health and latency bookkeeping for the ASR servers a client can use.
+
+Each server keeps a rolling window of round-trip times, normalised per second of
+audio (utterances shorter than a second count as one second). Utterances go to
+the healthy server with the lowest expected latency, servers never measured are
+tried first, and one that fails is skipped for a backoff that grows with each
+consecutive failure. The p95 of the window decides when a slow request gets a
+hedge sent to the next server.
+"""
+import time
+import threading
+from collections import deque
+
+# Recent round trips kept per server
+WINDOW = 50
+# Round trips needed before the p95 is trusted for hedging
+MIN_SAMPLES = 5
+MAX_BACKOFF_SECONDS = 60
+
+class ServerStats:
+    def __init__(self, url):
+        self.url = url
+        self.latencies = deque(maxlen=WINDOW)  # seconds per audio second
+        self.inflight = 0
+        self.failures = 0  # consecutive
+        self.unavailable_until = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.sheds = 0
+        self.hedges_won = 0
+
+    def expected(self):
+        """Typical seconds per audio second, None when never measured."""
+        if not self.latencies:
+            return None
+        recent = sorted(self.latencies)
+        return recent[len(recent) // 2]
+
+    def p95(self):
+        if len(self.latencies) < MIN_SAMPLES:
+            return None
+        recent = sorted(self.latencies)
+        return recent[min(len(recent) - 1, int(len(recent) * 0.95))]
+
+class ServerPool:
+    def __init__(self, urls):
+        self.servers = [ServerStats(url) for url in urls]
+        self.lock = threading.Lock()
+
+    @property
+    def urls(self):
+        return [s.url for s in self.servers]
+
+    def get(self, url):
+        return next(s for s in self.servers if s.url == url)
+
+    def ranked(self):
+        """URLs best first. Unavailable servers come last, soonest available first."""
+        now = time.monotonic()
+        with self.lock:
+            available = [s for s in self.servers if s.unavailable_until <= now]
+            unavailable = sorted((s for s in self.servers if s.unavailable_until > now), key=lambda s: s.unavailable_until)
+            # Unmeasured servers first, then by expected latency scaled by the work already sent there
+            available.sort(key=lambda s: (s.expected() is not None, (s.expected() or 0.0) * (1 + s.inflight)))
+            return [s.url for s in available + unavailable]
+
+    def hedge_delay(self, url, audio_seconds, min_delay):
+        """Seconds to wait for url before hedging, None until enough round trips were seen."""
+        with self.lock:
+            p95 = self.get(url).p95()
+        if p95 is None:
+            return None
+        return max(min_delay, p95 * max(1.0, audio_seconds))
+
+    def started(self, url):
+        with self.lock:
+            stats = self.get(url)
+            stats.inflight += 1
+            stats.requests += 1
+
+    def finished(self, url):
+        with self.lock:
+            self.get(url).inflight -= 1
+
+    def record_latency(self, url, rtt, audio_seconds):
+        """Adds a round trip. Also used for a hedged request's loser, with the time it had taken so far."""
+        with self.lock:
+            self.get(url).latencies.append(rtt / max(1.0, audio_seconds))
+
+    def record_success(self, url, rtt, audio_seconds):
+        self.record_latency(url, rtt, audio_seconds)
+        with self.lock:
+            stats = self.get(url)
+            stats.failures = 0
+            stats.unavailable_until = 0.0
+
+    def record_failure(self, url):
+        """Unreachable or erroring: skipped for a backoff growing with consecutive failures."""
+        with self.lock:
+            stats = self.get(url)
+            stats.errors += 1
+            stats.failures += 1
+            backoff = min(MAX_BACKOFF_SECONDS, 2 ** (stats.failures - 1))
+            stats.unavailable_until = time.monotonic() + backoff
+        print(f"ASR server {url} failed, skipping it for {backoff}s")
+
+    def record_shed(self, url, retry_after):
+        """Overloaded: skipped until its Retry-After has passed."""
+        with self.lock:
+            stats = self.get(url)
+            stats.sheds += 1
+            stats.unavailable_until = time.monotonic() + retry_after
+
+    def record_hedge_win(self, url):
+        with self.lock:
+            self.get(url).hedges_won += 1
+
+    def any_available(self):
+        now = time.monotonic()
+        with self.lock:
+            return any(s.unavailable_until <= now for s in self.servers)
+
+    def status(self):
+        with self.lock:
+            return [{
+                "url": s.url,
+                "expected_seconds_per_audio_second": s.expected(),
+                "p95": s.p95(),
+                "inflight": s.inflight,
+                "requests": s.requests,
+                "errors": s.errors,
+                "sheds": s.sheds,
+                "hedges_won": s.hedges_won,
+                "available": s.unavailable_until <= time.monotonic(),
+            } for s in self.servers]
@@ -0,0 +1,75 @@
+"""
+Gate between recording and upload.
+
+One VAD frame above 0.5 starts a recording, so a cough, a keyboard clack or a
+door also gets shipped to the server for a full generate pass. The gate looks
+at the whole capture before it is sent: how long it was voiced, how confident
+the VAD was on those frames, and how loud they were. Captures failing any of
+the thresholds are dropped and counted:
+
+    "speech_gate": {"min_voiced_ms": 200, "min_mean_prob": 0.6, "min_rms_db": -55}
+
+Set "enabled" to false to send everything.
+"""
+import numpy as np
+
+class SpeechStats:
+    """VAD probability and energy of the frames of one capture."""
+
+    def __init__(self, threshold=0.5):
+        self.threshold = threshold
+        self.voiced_ms = 0.0
+        self.voiced_probs = []
+        self.voiced_rms = []
+
+    def add(self, speech_prob, chunk, sample_rate):
+        if speech_prob <= self.threshold:
+            return
+        self.voiced_ms += len(chunk) / sample_rate * 1000
+        self.voiced_probs.append(speech_prob)
+        self.voiced_rms.append(float(np.sqrt(np.mean(np.square(chunk, dtype=np.float64)))))
+
+    @property
+    def mean_prob(self):
+        return float(np.mean(self.voiced_probs)) if self.voiced_probs else 0.0
+
+    @property
+    def rms_db(self):
+        """Level of the voiced frames in dBFS."""
+        if not self.voiced_rms:
+            return -float("inf")
+        return 20 * np.log10(np.mean(self.voiced_rms) + 1e-10)
+
+class SpeechGate:
+    def __init__(self, config=None):
+        config = config or {}
+        self.enabled = config.get("enabled", True)
+        self.threshold = config.get("speech_threshold", 0.5)
+        self.min_voiced_ms = config.get("min_voiced_ms", 200)
+        self.min_mean_prob = config.get("min_mean_prob", 0.6)
+        self.min_rms_db = config.get("min_rms_db", -55)
+        self.dropped = 0
+
+    def stats(self):
+        return SpeechStats(self.threshold)
+
+    def check(self, stats):
+        """Returns None when the capture looks like speech, else why it does not."""
+        if not self.enabled:
+            return None
+        if stats.voiced_ms < self.min_voiced_ms:
+            return f"only {stats.voiced_ms:.0f} ms voiced (min {self.min_voiced_ms})"
+        if stats.mean_prob < self.min_mean_prob:
+            return f"mean VAD probability {stats.mean_prob:.2f} (min {self.min_mean_prob})"
+        if stats.rms_db < self.min_rms_db:
+            return f"level {stats.rms_db:.0f} dBFS (min {self.min_rms_db})"
+        return None
+
+    def admit(self, stats):
+        """check(), counting and printing the drop. Returns True when the capture may be sent."""
+        reason = self.check(stats)
+        if reason is None:
+            return True
+        self.dropped += 1
+        print(f"Speech gate: dropped capture ({self.dropped} so far), {reason}")
+        return False
@@ -1,9 +1,29 @@
 from abc import ABC, abstractmethod
 
 class ASRBackend(ABC):
+    # Backends that can serve overlapping transcribe() calls set this, the server
+    # serialises requests to all others
+    concurrent = False
+    # Requests a concurrent backend can usefully run at once, the server queues the rest
+    slots = 1
+    # Reported with each request's timings
+    model_id = None
+
     def __init__(self, config=None):
         self.config = config or {}
 
     @abstractmethod
     def transcribe(self, audio_data, sample_rate, system_prompt=None, history=None, **kwargs):
         pass
+
+    def offload(self):
+        """Moves the weights off the accelerator while idle. Returns False if there is nothing to offload."""
+        return False
+
+    def restore(self):
+        """Undoes offload() before the next request."""
+        pass
+
+    def close(self):
+        """Stops any threads or processes the backend started, before it is dropped."""
+        pass
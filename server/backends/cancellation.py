@@ -0,0 +1,57 @@
+"""
+Cancellation of in-flight requests.
+
+The server gives every request a CancelToken, current for the thread handling it.
+POST /cancel or the client hanging up cancels it. Queued requests are dropped and
+the generative backends stop decoding at the next token (see decoding.py), so the
+device time goes to requests someone is still waiting for.
+"""
+import threading
+
+class Cancelled(Exception):
+    """The request was cancelled before it finished."""
+    # nginx's "client closed request", there is no standard code for this
+    status = 499
+
+class CancelToken:
+    def __init__(self, request_id=None):
+        self.request_id = request_id
+        self.reason = None
+        self.event = threading.Event()
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def cancel(self, reason="cancelled"):
+        with self.lock:
+            if self.event.is_set():
+                return
+            self.reason = reason
+            self.event.set()
+            callbacks = list(self.callbacks)
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback):
+        """Calls callback() once the token is cancelled (right away if it already is)."""
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(callback)
+                return
+        callback()
+
+    def check(self):
+        if self.event.is_set():
+            raise Cancelled(f"Request cancelled: {self.reason}")
+
+_local = threading.local()
+
+def set_current_token(token):
+    _local.token = token
+
+def current_token():
+    """Token of the request handled by the calling thread, None outside a request."""
+    return getattr(_local, "token", None)
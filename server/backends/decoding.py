@@ -0,0 +1,131 @@
+import math
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList
+from .metrics import METRICS, note
+from .cancellation import current_token
+
+class RepetitionStoppingCriteria(StoppingCriteria):
+    """
+    Stops generation once the newest tokens are a loop: some period of at most
+    max_period tokens repeated back to back, covering at least min_span tokens
+    and at least min_repeats times. Hallucinated loops on noise or silence look
+    exactly like this and otherwise run until max_new_tokens.
+    """
+
+    def __init__(self, prompt_length=None, max_period=16, min_repeats=3, min_span=12):
+        # None: inferred on the first call, which generate() makes right after the first new token
+        self.prompt_length = prompt_length
+        self.max_period = max_period
+        self.min_repeats = min_repeats
+        self.min_span = min_span
+        # Number of generated tokens to keep once a loop was found (first occurrence only)
+        self.keep_tokens = None
+        # New tokens seen on the latest call (the longest row)
+        self.generated_tokens = 0
+
+    def find_loop(self, generated):
+        for period in range(1, self.max_period + 1):
+            repeats = max(self.min_repeats, math.ceil(self.min_span / period))
+            span = period * repeats
+            if len(generated) < span:
+                break
+            tail = generated[-span:]
+            if torch.equal(tail[period:], tail[:-period]):
+                return period, repeats
+        return None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.prompt_length is None:
+            self.prompt_length = input_ids.shape[1] - 1
+        self.generated_tokens = input_ids.shape[1] - self.prompt_length
+        done = torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+        for i in range(input_ids.shape[0]):
+            generated = input_ids[i, self.prompt_length:]
+            loop = self.find_loop(generated)
+            if loop is not None:
+                period, repeats = loop
+                done[i] = True
+                self.keep_tokens = len(generated) - period * (repeats - 1)
+        return done
+
+class TokenCounter(StoppingCriteria):
+    """Never stops, only counts the new tokens, for backends whose generate() output is not ours to see."""
+
+    def __init__(self, prompt_length=None):
+        self.prompt_length = prompt_length
+        self.generated_tokens = 0
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.prompt_length is None:
+            self.prompt_length = input_ids.shape[1] - 1
+        self.generated_tokens = input_ids.shape[1] - self.prompt_length
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+def trim_repetition(text, min_repeats=3):
+    """
+    Cuts a loop at the end of decoded text down to its first occurrence, for
+    backends that only return text after RepetitionStoppingCriteria fired.
+    Text not ending in at least min_repeats copies of some unit is returned as is.
+    """
+    for period in range(1, len(text) // min_repeats + 1):
+        unit = text[-period:]
+        repeats = 1
+        while text[:-period * repeats].endswith(unit):
+            repeats += 1
+        if repeats >= min_repeats:
+            return text[:len(text) - period * (repeats - 1)]
+    return text
+
+class CancelStoppingCriteria(StoppingCriteria):
+    """Ends generation at the next token once the request's CancelToken is cancelled."""
+
+    def __init__(self, token):
+        self.token = token
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.token.cancelled, dtype=torch.bool, device=input_ids.device)
+
+def cancel_criteria():
+    """Stopping criteria for the current request's cancellation, empty outside a request."""
+    token = current_token()
+    return StoppingCriteriaList([CancelStoppingCriteria(token)] if token is not None else [])
+
+class DecodingControl:
+    """
+    Decoding limits shared by the generative backends: a new-token budget derived
+    from the audio duration, and early stopping on repetition loops. Outcomes are
+    recorded in METRICS under "decoding.*".
+    """
+
+    def __init__(self, config, max_new_tokens=500):
+        config = config or {}
+        self.max_new_tokens = int(config.get("max_new_tokens", max_new_tokens))
+        self.tokens_per_second = float(config.get("tokens_per_second", 10.0))
+        self.token_margin = float(config.get("token_margin", 1.5))
+        self.min_new_tokens = int(config.get("min_token_budget", 16))
+        self.repetition_stop = config.get("repetition_stop", True)
+
+    def budget(self, audio_seconds):
+        """Upper bound on new tokens for an utterance of the given length."""
+        estimate = math.ceil(audio_seconds * self.tokens_per_second * self.token_margin) + self.min_new_tokens
+        return max(1, min(self.max_new_tokens, estimate))
+
+    def stopping_criteria(self, prompt_length=None):
+        """Returns (StoppingCriteriaList for generate(), the repetition criterion or None)."""
+        criteria = cancel_criteria()
+        if not self.repetition_stop:
+            return criteria, None
+        criterion = RepetitionStoppingCriteria(prompt_length)
+        criteria.append(criterion)
+        return criteria, criterion
+
+    def record(self, budget, generated_tokens, criterion=None):
+        note(generated_tokens=int(generated_tokens), token_budget=budget,
+             repetition_stop=criterion is not None and criterion.keep_tokens is not None)
+        METRICS.incr("decoding.requests")
+        METRICS.observe("decoding.generated_tokens", generated_tokens)
+        if criterion is not None and criterion.keep_tokens is not None:
+            METRICS.incr("decoding.repetition_stops")
+            METRICS.incr("decoding.tokens_saved", max(0, budget - generated_tokens))
+        elif generated_tokens >= budget:
+            METRICS.incr("decoding.budget_exhausted")
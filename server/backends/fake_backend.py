@@ -0,0 +1,39 @@
+import time
+from .base import ASRBackend
+from .cancellation import current_token
+from .registry import register_backend
+
+class FakeBackend(ASRBackend):
+    """
+    Returns a fixed text after simulating compute time. Used for benchmarks and
+    CPU-only testing, so it is not a server backend unless register() was called.
+    """
+    model_id = "fake"
+
+    def __init__(self, config=None):
+        super().__init__(config)
+        fake_config = self.config.get("fake", {})
+        self.text = fake_config.get("text", "fake transcription")
+        # Simulated seconds of inference per second of audio
+        self.rtf = fake_config.get("rtf", 0.0)
+        # Spin on the CPU (holding the GIL) instead of sleeping, like real pre/post-processing
+        self.busy = fake_config.get("busy", False)
+
+    def transcribe(self, audio_data, sample_rate, system_prompt=None, history=None, **kwargs):
+        duration = len(audio_data) / sample_rate
+        if self.rtf and self.busy:
+            # CPU time, so replicas sharing a core really take longer
+            end = time.thread_time() + duration * self.rtf
+            while time.thread_time() < end:
+                pass
+        elif self.rtf:
+            token = current_token()
+            if token is not None:
+                # Returns early when cancelled, like a generative backend's stopping criterion
+                token.event.wait(duration * self.rtf)
+            else:
+                time.sleep(duration * self.rtf)
+        return self.text
+
+def register():
+    register_backend("fake", FakeBackend)
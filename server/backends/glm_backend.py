@@ -1,26 +1,34 @@
 import time
+import json
 import torch
 import torchaudio
 import numpy as np
 from transformers import AutoModelForSeq2SeqLM, AutoProcessor
 from .base import ASRBackend
+from .prefix_cache import PrefixCache, generate_with_prefix
+from .decoding import DecodingControl
+from .metrics import note
+from .model_cache import load_pretrained
 
 MODEL_ID = "zai-org/GLM-ASR-Nano-2512"
 TARGET_SAMPLE_RATE = 16000
 
 class GLMBackend(ASRBackend):
+    model_id = MODEL_ID
+
     def __init__(self, config=None):
         super().__init__(config)
         print("Loading GLM-ASR model...")
-        try:
-            self.processor = AutoProcessor.from_pretrained(MODEL_ID, local_files_only=True)
-            self.model = AutoModelForSeq2SeqLM.from_pretrained(MODEL_ID, dtype="auto", device_map="auto", local_files_only=True)
-        except Exception as e:
-            print(f"Local model files not found or error loading locally: {e}. Attempting to download/load from internet...")
-            self.processor = AutoProcessor.from_pretrained(MODEL_ID)
-            self.model = AutoModelForSeq2SeqLM.from_pretrained(MODEL_ID, dtype="auto", device_map="auto")
+        glm_config = self.config.get("glm", {})
+        device = glm_config.get("device", "cuda:0" if torch.cuda.is_available() else "cpu")
+        self.model, self.processor = load_pretrained(AutoModelForSeq2SeqLM, AutoProcessor, MODEL_ID, self.config, "glm",
+                                                     dtype="auto", device_map=device)
         self.device_model = self.model.device
 
+        prefix_cache_mb = glm_config.get("prefix_cache_mb", 256)
+        self.prefix_cache = PrefixCache(prefix_cache_mb) if prefix_cache_mb else None
+        self.decoding = DecodingControl(glm_config, max_new_tokens=500)
+
     def transcribe(self, audio_data, sample_rate, system_prompt=None, history=None, **kwargs):
         start_time = time.time()
         audio_tensor = torch.from_numpy(audio_data).to(torch.float32)
@@ -28,6 +36,7 @@ class GLMBackend(ASRBackend):
             resampler = torchaudio.transforms.Resample(sample_rate, TARGET_SAMPLE_RATE)
             audio_tensor = resampler(audio_tensor.unsqueeze(0)).squeeze(0)
         
+        prefix_messages = None
         if system_prompt or history:
             messages = []
             if system_prompt:
@@ -35,11 +44,12 @@ class GLMBackend(ASRBackend):
             if history:
                 messages.extend(history)
             
-            messages.append({"role": "user", "content": [{"type": "audio", "audio": audio_tensor.cpu().numpy()}]})
-            
             for msg in messages:
                 if isinstance(msg["content"], str):
                     msg["content"] = [{"type": "text", "text": msg["content"]}]
+            prefix_messages = list(messages)
+
+            messages.append({"role": "user", "content": [{"type": "audio", "audio": audio_tensor.cpu().numpy()}]})
             
             inputs = self.processor.apply_chat_template(messages, add_generation_prompt=True, tokenize=True, return_dict=True, sampling_rate=TARGET_SAMPLE_RATE)
         else:
@@ -51,12 +61,56 @@ class GLMBackend(ASRBackend):
                 if isinstance(v, torch.Tensor) and v.is_floating_point():
                     inputs[k] = v.to(self.model.dtype)
 
-        with torch.no_grad():
-            outputs = self.model.generate(**inputs, do_sample=False, max_new_tokens=500)
+        prompt_length = inputs["input_ids"].shape[1]
+        max_new_tokens = self.decoding.budget(len(audio_data) / sample_rate)
+        stopping_criteria, repetition = self.decoding.stopping_criteria(prompt_length)
+
+        outputs = None
+        if prefix_messages and self.prefix_cache is not None:
+            try:
+                outputs = self.generate_with_prefix_cache(inputs, prefix_messages, max_new_tokens, stopping_criteria=stopping_criteria)
+            except Exception as e:
+                print(f"Prefix cache disabled after error: {e}")
+                self.prefix_cache = None
+
+        if outputs is None:
+            with torch.no_grad():
+                outputs = self.model.generate(**inputs, do_sample=False, max_new_tokens=max_new_tokens, stopping_criteria=stopping_criteria)
+
+        generated = outputs[:, prompt_length:]
+        self.decoding.record(max_new_tokens, generated.shape[1], repetition)
+        if repetition is not None and repetition.keep_tokens is not None:
+            print(f"GLM-ASR: repetition loop stopped after {generated.shape[1]} of {max_new_tokens} tokens")
+            generated = generated[:, :repetition.keep_tokens]
         
-        decoded = self.processor.batch_decode(outputs[:, inputs["input_ids"].shape[1]:], skip_special_tokens=True)
+        decoded = self.processor.batch_decode(generated, skip_special_tokens=True)
         text = decoded[0] if decoded else ""
         
         duration = time.time() - start_time
         print(f"GLM-ASR took {duration:.2f}s")
         return text
+
+    def offload(self):
+        self.model.to("cpu")
+        # Cached KV lives on the device and is cheap to rebuild
+        if self.prefix_cache is not None:
+            self.prefix_cache.clear()
+        return True
+
+    def restore(self):
+        self.model.to(self.device_model)
+
+    def generate_with_prefix_cache(self, inputs, prefix_messages, max_new_tokens, **generate_kwargs):
+        """Generates while reusing the prefilled KV of the system prompt and history."""
+        key = json.dumps(prefix_messages, ensure_ascii=False, sort_keys=True)
+
+        def prefix_ids():
+            prefix = self.processor.apply_chat_template(prefix_messages, add_generation_prompt=False, tokenize=True, return_dict=True)
+            return torch.as_tensor(prefix["input_ids"][0])
+
+        hits = self.prefix_cache.hits
+        past_key_values, prefix_length = self.prefix_cache.get(self.model, key, inputs["input_ids"][0], prefix_ids)
+        note(cache_hit=self.prefix_cache.hits > hits)
+        if past_key_values is None:
+            return None
+        return generate_with_prefix(self.model, inputs, past_key_values, prefix_length, max_new_tokens, **generate_kwargs)
@@ -0,0 +1,104 @@
+import time
+import threading
+from contextlib import contextmanager
+from collections import deque
+
+class Metrics:
+    """Thread-safe counters and timing observations, served as JSON on GET /metrics."""
+
+    def __init__(self, window=256):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.observations = {}
+        self.window = window
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        with self.lock:
+            if name not in self.observations:
+                self.observations[name] = {"count": 0, "sum": 0.0, "max": 0.0, "recent": deque(maxlen=self.window)}
+            obs = self.observations[name]
+            obs["count"] += 1
+            obs["sum"] += value
+            obs["max"] = max(obs["max"], value)
+            obs["recent"].append(value)
+
+    def snapshot(self):
+        with self.lock:
+            result = {"counters": dict(self.counters), "observations": {}}
+            for name, obs in self.observations.items():
+                recent = sorted(obs["recent"])
+                result["observations"][name] = {
+                    "count": obs["count"],
+                    "mean": obs["sum"] / obs["count"],
+                    "max": obs["max"],
+                    "p50": recent[len(recent) // 2],
+                    "p95": recent[min(len(recent) - 1, int(len(recent) * 0.95))],
+                }
+            return result
+
+METRICS = Metrics()
+
+class RequestTrace:
+    """
+    Stage durations and facts (backend, model, cache hits...) of one request,
+    returned to clients that ask for a JSON response and as a Server-Timing header.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.info = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def note(self, **info):
+        self.info.update(info)
+
+    def result(self, text):
+        """JSON-serialisable response body."""
+        total = time.perf_counter() - self.start
+        result = {"text": text, "total_ms": round(total * 1000, 1),
+                  "stages_ms": {name: round(seconds * 1000, 1) for name, seconds in self.stages.items()},
+                  "queue_wait_ms": round(self.stages.get("queue", 0.0) * 1000, 1)}
+        result.update(self.info)
+        audio_seconds = self.info.get("audio_seconds")
+        if audio_seconds:
+            result["rtf"] = round(self.stages.get("inference", total) / audio_seconds, 3)
+        return result
+
+    def server_timing(self):
+        """Value for the Server-Timing header, durations in milliseconds."""
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        entries.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.1f}")
+        return ", ".join(entries)
+
+_local = threading.local()
+
+def begin_trace():
+    """Starts the trace of the request handled by the calling thread."""
+    _local.trace = RequestTrace()
+    return _local.trace
+
+def current_trace():
+    """Trace of the calling thread's request. Outside a request one is discarded afterwards."""
+    trace = getattr(_local, "trace", None)
+    return trace if trace is not None else RequestTrace()
+
+def note(**info):
+    """Records facts about the current request, e.g. note(cache_hit=True)."""
+    trace = getattr(_local, "trace", None)
+    if trace is not None:
+        trace.note(**info)
@@ -0,0 +1,117 @@
+"""
+Local cache of model artifacts in their serving form.
+
+The first load converts a model to the dtype it is served in, applies any
+backend-specific patches (e.g. Whisper's generation config) and saves weights as
+safetensors with the processor next to them. Later starts load that directory,
+so no dtype conversion, no hub resolution and no patching happens, and the
+weights are memory-mapped from safetensors instead of being read and copied.
+
+The cache is a full copy of the weights, several GB per model, so it is opt-in:
+server.py --model-cache DIR (model_cache_dir in the config) turns it on for the
+GLM and Whisper backends, and "model_cache": true/false in a backend's section
+overrides that. It is not written when it would leave less than MIN_FREE_MB free.
+"""
+import os
+import json
+import time
+import shutil
+import itertools
+import torch
+import transformers
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "wtako-asr-ime", "models")
+MARKER = "asr_model_cache.json"
+# Disk space to leave free after writing a cache
+MIN_FREE_MB = 2048
+
+def dtype_name(dtype):
+    return dtype if isinstance(dtype, str) else str(dtype).replace("torch.", "")
+
+def cache_enabled(config, section):
+    return config.get(section, {}).get("model_cache", bool(config.get("model_cache_dir")))
+
+def cache_path(config, model_id, dtype):
+    root = config.get("model_cache_dir") or DEFAULT_CACHE_DIR
+    return os.path.join(root, f"{model_id.replace('/', '--')}-{dtype_name(dtype)}")
+
+def read_marker(path):
+    try:
+        with open(os.path.join(path, MARKER)) as f:
+            marker = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # Saved by another transformers version, the serialised form may differ
+    if marker.get("transformers") != transformers.__version__:
+        return None
+    return marker
+
+def load_pretrained(model_cls, processor_cls, model_id, config, section, dtype="auto", patch=None, **kwargs):
+    """
+    Returns (model, processor) for model_id, through the cache when it is enabled
+    (see cache_enabled). patch(model, processor) runs once, before the artifacts
+    are saved. kwargs go to model_cls.from_pretrained.
+    """
+    use_cache = cache_enabled(config, section)
+    path = cache_path(config, model_id, dtype)
+    marker = read_marker(path) if use_cache else None
+
+    if marker is not None:
+        start = time.time()
+        processor = processor_cls.from_pretrained(path)
+        model = model_cls.from_pretrained(path, dtype=getattr(torch, marker["dtype"]), use_safetensors=True, **kwargs)
+        print(f"Loaded {model_id} from model cache {path} in {time.time() - start:.2f}s")
+        return model, processor
+
+    start = time.time()
+    try:
+        processor = processor_cls.from_pretrained(model_id, local_files_only=True)
+        model = model_cls.from_pretrained(model_id, dtype=dtype, local_files_only=True, **kwargs)
+    except Exception as e:
+        print(f"Local model files not found or error loading locally: {e}. Attempting to download/load from internet...")
+        processor = processor_cls.from_pretrained(model_id)
+        model = model_cls.from_pretrained(model_id, dtype=dtype, **kwargs)
+    if patch:
+        patch(model, processor)
+    print(f"Loaded {model_id} in {time.time() - start:.2f}s")
+
+    if use_cache:
+        save(model, processor, model_id, path)
+    return model, processor
+
+def free_mb(path):
+    """Free space on the disk path is (or would be) on."""
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    return shutil.disk_usage(path).free / (1024 * 1024)
+
+def save(model, processor, model_id, path):
+    size_mb = sum(t.numel() * t.element_size() for t in itertools.chain(model.parameters(), model.buffers())) / (1024 * 1024)
+    available_mb = free_mb(os.path.dirname(path))
+    if available_mb - size_mb < MIN_FREE_MB:
+        print(f"Not writing model cache {path}: {size_mb:.0f} MB needed, {available_mb:.0f} MB free "
+              f"and {MIN_FREE_MB} MB kept free")
+        return
+    print(f"Writing {size_mb:.0f} MB model cache of {model_id} to {path}")
+    # Written next to the final directory and renamed, so a crash never leaves a half cache
+    tmp = f"{path}.tmp-{os.getpid()}"
+    try:
+        start = time.time()
+        shutil.rmtree(tmp, ignore_errors=True)
+        # Otherwise transformers rebuilds the generation config from config.json on load
+        model.generation_config._from_model_config = False
+        model.save_pretrained(tmp, safe_serialization=True)
+        processor.save_pretrained(tmp)
+        with open(os.path.join(tmp, MARKER), "w") as f:
+            json.dump({
+                "model_id": model_id,
+                "dtype": dtype_name(model.dtype),
+                "transformers": transformers.__version__,
+                "created": time.time(),
+            }, f, indent=2)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp, path)
+        print(f"Saved {model_id} to model cache {path} in {time.time() - start:.2f}s")
+    except Exception as e:
+        print(f"Could not write model cache {path}: {e}")
+        shutil.rmtree(tmp, ignore_errors=True)
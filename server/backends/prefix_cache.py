@@ -0,0 +1,145 @@
+import copy
+import threading
+from collections import OrderedDict
+import torch
+from transformers import DynamicCache
+
+def common_prefix_length(a, b):
+    """Number of leading tokens two 1-D id tensors have in common."""
+    n = min(len(a), len(b))
+    mismatch = (a[:n] != b[:n]).nonzero()
+    return int(mismatch[0]) if len(mismatch) else n
+
+def cache_nbytes(past_key_values):
+    """Approximate device memory held by a KV cache."""
+    if hasattr(past_key_values, "layers"):
+        tensors = [t for layer in past_key_values.layers for t in (getattr(layer, "keys", None), getattr(layer, "values", None))]
+    elif hasattr(past_key_values, "key_cache"):
+        tensors = list(past_key_values.key_cache) + list(past_key_values.value_cache)
+    else:
+        tensors = [t for layer in past_key_values for t in layer]
+    return sum(t.numel() * t.element_size() for t in tensors if isinstance(t, torch.Tensor))
+
+def prefill(model, ids, start=0, past_key_values=None):
+    """Runs ids[start:] through the model on top of past_key_values (covering ids[:start])."""
+    if past_key_values is None:
+        past_key_values = DynamicCache()
+    if start >= len(ids):
+        return past_key_values
+    device = model.device
+    with torch.no_grad():
+        out = model(
+            input_ids=ids[start:].unsqueeze(0).to(device),
+            attention_mask=torch.ones(1, len(ids), dtype=torch.long, device=device),
+            past_key_values=past_key_values,
+            cache_position=torch.arange(start, len(ids), device=device),
+            use_cache=True,
+        )
+    return out.past_key_values
+
+class PrefixCache:
+    """
+    Prefilled past key-values of prompt prefixes (system prompt plus optional
+    history), keyed by the prompt text and evicted LRU under a memory budget.
+
+    A new prefix that extends a cached one (e.g. the same system prompt with more
+    history) only prefills the extra tokens.
+    """
+
+    def __init__(self, budget_mb=256):
+        self.budget = budget_mb * 1024 * 1024
+        self.entries = OrderedDict()  # key -> (prefix ids, past key-values, bytes)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, model, key, input_ids, prefix_ids_fn):
+        """
+        Returns (private copy of the cached KV, prefix length) for the 1-D prompt
+        input_ids. prefix_ids_fn() tokenises the prefix and is only called on a miss.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and len(entry[0]) < len(input_ids) and torch.equal(entry[0], input_ids[:len(entry[0])]):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(entry[1]), len(entry[0])
+
+            self.misses += 1
+            prefix_ids = prefix_ids_fn().to(input_ids.device)
+            # The chat template may render the end of the prefix differently once the
+            # user turn follows, only the tokens shared with the full prompt are reusable.
+            # At least one token must be left for the request itself.
+            length = min(common_prefix_length(prefix_ids, input_ids), len(input_ids) - 1)
+            if length <= 0:
+                return None, 0
+            ids = input_ids[:length].clone()
+
+            base_len, base_kv = 0, None
+            for cached_ids, cached_kv, _ in self.entries.values():
+                if base_len < len(cached_ids) <= length and torch.equal(cached_ids, ids[:len(cached_ids)]):
+                    base_len, base_kv = len(cached_ids), cached_kv
+            kv = prefill(model, ids, base_len, copy.deepcopy(base_kv) if base_kv is not None else None)
+
+            self._put(key, ids, kv)
+            return copy.deepcopy(kv), length
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def _put(self, key, ids, kv):
+        if key in self.entries:
+            self.nbytes -= self.entries.pop(key)[2]
+        size = cache_nbytes(kv)
+        if size > self.budget:
+            return
+        self.entries[key] = (ids, kv, size)
+        self.nbytes += size
+        while self.nbytes > self.budget:
+            _, (_, _, evicted) = self.entries.popitem(last=False)
+            self.nbytes -= evicted
+
+def generate_with_prefix(model, inputs, past_key_values, prefix_length, max_new_tokens, **generate_kwargs):
+    """
+    Greedy generation reusing past_key_values for the first prefix_length prompt tokens.
+
+    The rest of the prompt (including any audio placeholder tokens) is prefilled by
+    one forward call that also receives the audio features, because multimodal
+    models only merge their features on a generate step that starts at position 0.
+    generate() then continues from a cache covering the whole prompt.
+    """
+    input_ids = inputs["input_ids"]
+    attention_mask = inputs.get("attention_mask")
+    if attention_mask is None:
+        attention_mask = torch.ones_like(input_ids)
+    extra_inputs = {k: v for k, v in inputs.items() if k not in ("input_ids", "attention_mask")}
+
+    with torch.no_grad():
+        out = model(
+            input_ids=input_ids[:, prefix_length:],
+            attention_mask=attention_mask,
+            past_key_values=past_key_values,
+            cache_position=torch.arange(prefix_length, input_ids.shape[1], device=input_ids.device),
+            use_cache=True,
+            **extra_inputs,
+        )
+    next_token = out.logits[:, -1].argmax(dim=-1, keepdim=True)
+    sequence = torch.cat([input_ids, next_token], dim=1)
+
+    eos = model.generation_config.eos_token_id
+    eos_ids = eos if isinstance(eos, (list, tuple)) else [eos]
+    if next_token.item() in eos_ids or max_new_tokens <= 1:
+        return sequence
+
+    with torch.no_grad():
+        return model.generate(
+            input_ids=sequence,
+            attention_mask=torch.cat([attention_mask, torch.ones_like(next_token)], dim=1),
+            past_key_values=out.past_key_values,
+            do_sample=False,
+            max_new_tokens=max_new_tokens - 1,
+            **generate_kwargs,
+        )
@@ -0,0 +1,170 @@
+"""
+Model download and verification for backends shipped as release tarballs (SenseVoice).
+
+Verified files are recorded in a manifest next to them (size, mtime, inode and
+SHA-256), so an unchanged file is not hashed again on the next start. Downloads
+go to a .part file and resume from where they stopped. The tarball is extracted
+while it streams in, straight into the model directory, so no full archive sits
+on disk before extraction and nothing is written to the working directory.
+"""
+import io
+import os
+import json
+import time
+import hashlib
+import tarfile
+import requests
+
+SENSEVOICE_URL = "https://github.com/k2-fsa/sherpa-onnx/releases/download/asr-models/sherpa-onnx-sense-voice-zh-en-ja-ko-yue-int8-2024-07-17.tar.bz2"
+SENSEVOICE_SHA256 = "c71f0ce00bec95b07744e116345e33d8cbbe08cef896382cf907bf4b51a2cd51"
+SENSEVOICE_MODEL_DIR = "sherpa-onnx-sense-voice-zh-en-ja-ko-yue-int8-2024-07-17"
+
+MANIFEST = ".manifest.json"
+CHUNK_SIZE = 1024 * 1024
+
+def file_identity(path):
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "inode": st.st_ino}
+
+def sha256_file(path):
+    sha256_hash = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha256_hash.update(block)
+    return sha256_hash.hexdigest()
+
+def load_manifest(model_dir):
+    try:
+        with open(os.path.join(model_dir, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(model_dir, manifest):
+    """Returns False when it cannot be written (e.g. a read-only model_dir), files are then hashed on every start."""
+    path = os.path.join(model_dir, MANIFEST)
+    try:
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(path + ".tmp", path)
+        return True
+    except OSError as e:
+        print(f"Could not write model manifest {path}, files will be hashed again on the next start: {e}")
+        return False
+
+def verify(model_dir, filename, expected_sha256):
+    """
+    Returns "cached" when the manifest vouches for the unchanged file, "verified"
+    after hashing it, or None when it is missing or does not match.
+    """
+    path = os.path.join(model_dir, filename)
+    if not os.path.exists(path):
+        return None
+    manifest = load_manifest(model_dir)
+    entry = manifest.get(filename)
+    identity = file_identity(path)
+    if entry and entry.get("sha256") == expected_sha256 and all(entry.get(k) == v for k, v in identity.items()):
+        return "cached"
+
+    digest = sha256_file(path)
+    if digest != expected_sha256:
+        manifest.pop(filename, None)
+        save_manifest(model_dir, manifest)
+        return None
+    manifest[filename] = dict(identity, sha256=digest, verified=time.time())
+    save_manifest(model_dir, manifest)
+    return "verified"
+
+class ResumableDownload(io.RawIOBase):
+    """
+    Readable stream of the whole file at url: first the bytes already in
+    part_path, then the rest from the server (appended to part_path as it is read).
+    """
+
+    def __init__(self, url, part_path, timeout=60):
+        self.part = open(part_path, "a+b")
+        self.part.seek(0)
+        offset = os.path.getsize(part_path)
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        self.response = requests.get(url, stream=True, headers=headers, timeout=timeout)
+        if offset and self.response.status_code == 200:
+            # Server ignored the range, start over
+            print("Server does not support resuming, downloading from the start")
+            self.part.truncate(0)
+        elif offset and self.response.status_code == 416:
+            # Already complete
+            self.response.close()
+            self.response = None
+        elif self.response.status_code not in (200, 206):
+            raise Exception(f"Failed to download model from {url}: HTTP {self.response.status_code}")
+        elif offset:
+            print(f"Resuming download at {offset / (1024 * 1024):.1f} MB")
+        self.remote = self.response.iter_content(chunk_size=CHUNK_SIZE) if self.response is not None else iter(())
+        self.pending = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.part.read(len(buffer))
+        if not data:
+            if not self.pending:
+                self.pending = next(self.remote, b"")
+                if self.pending:
+                    # Written before it is consumed, so an interruption can resume after it
+                    self.part.seek(0, os.SEEK_END)
+                    self.part.write(self.pending)
+                    self.part.flush()
+            data, self.pending = self.pending[:len(buffer)], self.pending[len(buffer):]
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if self.response is not None:
+            self.response.close()
+        self.part.close()
+        super().close()
+
+def strip_top_dir(members):
+    """Drops the archive's top-level directory and anything that would escape the target."""
+    for member in members:
+        parts = member.name.split("/", 1)
+        if len(parts) < 2 or not parts[1]:
+            continue
+        member.name = parts[1]
+        if member.name.startswith("/") or ".." in member.name.split("/"):
+            continue
+        yield member
+
+def part_path(url, model_dir):
+    return os.path.join(model_dir, os.path.basename(url) + ".part")
+
+def download_and_extract(url, model_dir):
+    os.makedirs(model_dir, exist_ok=True)
+    start = time.time()
+    with ResumableDownload(url, part_path(url, model_dir)) as stream:
+        with tarfile.open(fileobj=io.BufferedReader(stream, CHUNK_SIZE), mode="r|*") as tar:
+            tar.extractall(path=model_dir, members=strip_top_dir(tar), filter="data")
+    os.remove(part_path(url, model_dir))
+    print(f"Downloaded and extracted {os.path.basename(url)} in {time.time() - start:.1f}s")
+
+def ensure_model(model_dir, filename, url, expected_sha256):
+    """
+    Makes sure model_dir/filename exists with the expected hash, downloading and
+    extracting the tarball at url if needed. Returns "cached", "verified" or "downloaded".
+    """
+    if os.path.exists(part_path(url, model_dir)):
+        # Files extracted so far are incomplete, no point hashing them
+        print(f"Resuming interrupted download into {model_dir}...")
+    else:
+        status = verify(model_dir, filename, expected_sha256)
+        if status is not None:
+            return status
+        if os.path.exists(os.path.join(model_dir, filename)):
+            print(f"Model file {os.path.join(model_dir, filename)} checksum mismatch. Re-downloading...")
+        print(f"Downloading model to {model_dir}...")
+
+    download_and_extract(url, model_dir)
+    if verify(model_dir, filename, expected_sha256) is None:
+        print(f"Warning: Downloaded model checksum mismatch! Expected {expected_sha256}, got {sha256_file(os.path.join(model_dir, filename))}")
+    return "downloaded"
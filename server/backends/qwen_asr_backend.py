@@ -3,6 +3,7 @@ import time
 import torch
 import numpy as np
 from .base import ASRBackend
+from .decoding import DecodingControl, TokenCounter, trim_repetition
 
 class QwenASRBackend(ASRBackend):
     def __init__(self, config=None):
@@ -10,6 +11,7 @@ class QwenASRBackend(ASRBackend):
         
         qwen_config = self.config.get("qwen_asr", {})
         model_id = qwen_config.get("model_id", "Qwen/Qwen3-ASR-1.7B")
+        self.model_id = model_id
         self.device = qwen_config.get("device", "cuda:0" if torch.cuda.is_available() else "cpu")
         self.dtype = torch.bfloat16 if "cuda" in self.device else torch.float32
         
@@ -29,6 +31,28 @@ class QwenASRBackend(ASRBackend):
         if self.language == "auto":
             self.language = None
 
+        self.decoding = DecodingControl(qwen_config, max_new_tokens=qwen_config.get("max_new_tokens", 256))
+        self.stopping_criteria = None
+        self.repetition = None
+        # Qwen3ASRModel calls generate() with a fixed max_new_tokens only, so stopping
+        # criteria are injected into the underlying transformers model's generate().
+        hf_model = getattr(self.model, "model", None)
+        if hf_model is not None and hasattr(hf_model, "generate"):
+            original_generate = hf_model.generate
+            def generate(*args, **kwargs):
+                if self.stopping_criteria is not None:
+                    kwargs.setdefault("stopping_criteria", self.stopping_criteria)
+                return original_generate(*args, **kwargs)
+            hf_model.generate = generate
+
+    def offload(self):
+        # Qwen3ASRModel moves inputs to wherever the transformers model is
+        self.model.model.to("cpu")
+        return True
+
+    def restore(self):
+        self.model.model.to(self.device)
+
     def transcribe(self, audio_data, sample_rate, system_prompt=None, history=None, **kwargs):
         start_time = time.time()
         
@@ -37,13 +61,29 @@ class QwenASRBackend(ASRBackend):
         
         # Use language from config if not provided in kwargs
         language = kwargs.get("language", self.language)
-        
-        results = self.model.transcribe(
-            audio=audio_input,
-            language=language,
-        )
+
+        max_new_tokens = self.decoding.budget(len(audio_data) / sample_rate)
+        self.model.max_new_tokens = max_new_tokens
+        self.stopping_criteria, self.repetition = self.decoding.stopping_criteria()
+        # Token counts are not returned by Qwen3ASRModel, this sees every generated one
+        counter = TokenCounter()
+        self.stopping_criteria.append(counter)
+        try:
+            results = self.model.transcribe(
+                audio=audio_input,
+                language=language,
+            )
+        finally:
+            self.stopping_criteria = None
         
         text = results[0].text.strip()
+        repetition = self.repetition
+        generated = counter.generated_tokens
+        self.decoding.record(max_new_tokens, generated, repetition)
+        if repetition is not None and repetition.keep_tokens is not None:
+            print(f"Qwen3-ASR: repetition loop stopped after {generated} of {max_new_tokens} tokens")
+            # Only text comes back, so the loop is cut there instead of at keep_tokens
+            text = trim_repetition(text, repetition.min_repeats)
         
         print(f"Qwen3-ASR took {time.time() - start_time:.2f}s")
         return text
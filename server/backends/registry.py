@@ -0,0 +1,28 @@
+BACKEND_TYPES = ["glm", "sensevoice", "sherpa-onnx/sense-voice", "whisper", "qwen"]
+
+# Name -> backend class, added with register_backend() (the bench scripts' fake backend)
+REGISTERED = {}
+
+def register_backend(name, backend_class):
+    """Makes an extra backend available to create_backend(), and to replicas through ReplicaPool."""
+    REGISTERED[name] = backend_class
+    if name not in BACKEND_TYPES:
+        BACKEND_TYPES.append(name)
+
+def create_backend(backend_type, config=None):
+    """Instantiates a backend by name, importing only the model stack it needs."""
+    if backend_type == "glm":
+        from .glm_backend import GLMBackend
+        return GLMBackend(config=config)
+    elif backend_type == "sensevoice" or backend_type == "sherpa-onnx/sense-voice":
+        from .sensevoice_backend import SenseVoiceBackend
+        return SenseVoiceBackend(config=config)
+    elif backend_type == "whisper":
+        from .whisper_backend import WhisperBackend
+        return WhisperBackend(config=config)
+    elif backend_type == "qwen":
+        from .qwen_asr_backend import QwenASRBackend
+        return QwenASRBackend(config=config)
+    elif backend_type in REGISTERED:
+        return REGISTERED[backend_type](config=config)
+    raise ValueError(f"Unknown backend type: {backend_type}")
@@ -2,85 +2,130 @@ import time
 import numpy as np
 import sherpa_onnx
 import os
-import hashlib
-import requests
-import tarfile
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, CancelledError
 from .base import ASRBackend
+from .metrics import METRICS, current_trace, note
+from .cancellation import Cancelled, current_token
+from .provisioning import ensure_model, SENSEVOICE_URL, SENSEVOICE_SHA256, SENSEVOICE_MODEL_DIR
+
+LANGUAGES = ["auto", "zh", "en", "ja", "ko", "yue"]
+
+class RecognizerPool:
+    """
+    Recognizers created lazily per key (worker, language) and evicted least recently
+    used once their estimated memory exceeds budget_mb. The one just requested is
+    always kept, so a budget below one model still serves every language.
+    """
+
+    def __init__(self, factory, budget_mb, recognizer_mb):
+        self.factory = factory
+        self.budget_mb = budget_mb
+        self.recognizer_mb = recognizer_mb
+        self.recognizers = OrderedDict()
+        # Key -> Future of a recognizer being built. Built outside the lock, so a
+        # slow load does not hold up requests for recognizers already resident.
+        self.loading = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            recognizer = self.recognizers.get(key)
+            if recognizer is not None:
+                self.recognizers.move_to_end(key)
+                return recognizer
+            future = self.loading.get(key)
+            building = future is None
+            if building:
+                future = self.loading[key] = Future()
+        if not building:
+            # Someone else is building it, share theirs (or their error)
+            return future.result()
+
+        start_time = time.time()
+        try:
+            recognizer = self.factory(key)
+        except Exception as e:
+            with self.lock:
+                del self.loading[key]
+            future.set_exception(e)
+            raise
+        with self.lock:
+            del self.loading[key]
+            self.recognizers[key] = recognizer
+            while len(self.recognizers) > 1 and len(self.recognizers) * self.recognizer_mb > self.budget_mb:
+                evicted, _ = self.recognizers.popitem(last=False)
+                print(f"SenseVoice: evicted recognizer {evicted}")
+            resident = len(self.recognizers)
+        future.set_result(recognizer)
+        print(f"SenseVoice: loaded recognizer {key} in {time.time() - start_time:.2f}s ({resident} resident)")
+        return recognizer
 
 class SenseVoiceBackend(ASRBackend):
+    """
+    Requests are queued to `workers` threads, each with its own recognizers of
+    num_threads threads, so `workers * num_threads` cores are used under load.
+    A worker that finds several requests queued decodes them as one batch.
+    """
+    concurrent = True
+
     def __init__(self, config=None):
         super().__init__(config)
         print("Loading SenseVoice model...")
         
-        model_dir = self.config.get("model_dir", "sherpa-onnx-sense-voice-zh-en-ja-ko-yue-int8-2024-07-17")
-        num_threads = self.config.get("num_threads", 2)
-        self.language = self.config.get("language", "auto")
-        provider = self.config.get("provider", "cpu")
+        # Settings live in the "sensevoice" section, older configs kept them at the top level
+        sv_config = self.config.get("sensevoice", self.config)
+        model_dir = sv_config.get("model_dir", SENSEVOICE_MODEL_DIR)
+        self.model_id = os.path.basename(os.path.normpath(model_dir))
+        self.num_threads = sv_config.get("num_threads", 2)
+        self.language = sv_config.get("language", "auto")
+        self.provider = sv_config.get("provider", "cpu")
+        self.workers = sv_config.get("workers", 1)
+        if self.workers == "auto":
+            self.workers = max(1, (os.cpu_count() or 1) // self.num_threads)
+        self.max_batch = sv_config.get("max_batch", 8)
+        self.slots = self.workers * self.max_batch
         
-        self._ensure_model(model_dir)
+        ensure_model(model_dir, "model.int8.onnx", sv_config.get("model_url", SENSEVOICE_URL), sv_config.get("model_sha256", SENSEVOICE_SHA256))
         
-        model_path = os.path.join(model_dir, "model.int8.onnx")
-        tokens_path = os.path.join(model_dir, "tokens.txt")
+        self.model_path = os.path.join(model_dir, "model.int8.onnx")
+        self.tokens_path = os.path.join(model_dir, "tokens.txt")
         
-        if not os.path.exists(model_path) or not os.path.exists(tokens_path):
+        if not os.path.exists(self.model_path) or not os.path.exists(self.tokens_path):
             raise FileNotFoundError(f"SenseVoice model files not found in {model_dir}")
 
-        self.recognizer = sherpa_onnx.OfflineRecognizer.from_sense_voice(
-            model=model_path,
-            tokens=tokens_path,
-            num_threads=num_threads,
+        # One recognizer per worker and language actually requested, the default one is
+        # loaded up front. The budget always fits that one per worker.
+        recognizer_mb = os.path.getsize(self.model_path) / (1024 * 1024)
+        budget_mb = max(sv_config.get("recognizer_pool_mb", 1024), self.workers * recognizer_mb)
+        self.recognizers = RecognizerPool(self.create_recognizer, budget_mb, recognizer_mb)
+
+        self.requests = queue.Queue()
+        for index in range(self.workers):
+            self.recognizers.get((index, self.language))
+            threading.Thread(target=self._worker, args=(index,), daemon=True).start()
+        print(f"SenseVoice: {self.workers} worker(s) x {self.num_threads} thread(s)")
+
+    def create_recognizer(self, key):
+        _, language = key
+        return sherpa_onnx.OfflineRecognizer.from_sense_voice(
+            model=self.model_path,
+            tokens=self.tokens_path,
+            num_threads=self.num_threads,
             use_itn=True,
-            provider=provider,
-            language=self.language,
+            provider=self.provider,
+            language=language,
         )
 
-    def _ensure_model(self, model_dir):
-        model_url = "https://github.com/k2-fsa/sherpa-onnx/releases/download/asr-models/sherpa-onnx-sense-voice-zh-en-ja-ko-yue-int8-2024-07-17.tar.bz2"
-        expected_sha256 = "c71f0ce00bec95b07744e116345e33d8cbbe08cef896382cf907bf4b51a2cd51"
-        model_filename = os.path.basename(model_url)
-        model_path = os.path.join(model_dir, "model.int8.onnx")
-
-        if os.path.exists(model_path):
-            # Verify existing model
-            sha256_hash = hashlib.sha256()
-            with open(model_path, "rb") as f:
-                for byte_block in iter(lambda: f.read(4096), b""):
-                    sha256_hash.update(byte_block)
-            if sha256_hash.hexdigest() == expected_sha256:
-                return
-            else:
-                print(f"Model file {model_path} checksum mismatch. Re-downloading...")
-
-        print(f"Downloading SenseVoice model to {model_dir}...")
-        if not os.path.exists(model_dir):
-            os.makedirs(model_dir, exist_ok=True)
-
-        response = requests.get(model_url, stream=True)
-        if response.status_code == 200:
-            with open(model_filename, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            
-            print(f"Extracting {model_filename}...")
-            with tarfile.open(model_filename, "r:bz2") as tar:
-                tar.extractall(path=".")
-            
-            os.remove(model_filename)
-            
-            # Verify after download
-            sha256_hash = hashlib.sha256()
-            with open(model_path, "rb") as f:
-                for byte_block in iter(lambda: f.read(4096), b""):
-                    sha256_hash.update(byte_block)
-            if sha256_hash.hexdigest() != expected_sha256:
-                print(f"Warning: Downloaded model checksum mismatch! Expected {expected_sha256}, got {sha256_hash.hexdigest()}")
-        else:
-            raise Exception(f"Failed to download model from {model_url}")
-
     def transcribe(self, audio_data, sample_rate, system_prompt=None, history=None, **kwargs):
         start_time = time.time()
         
         language = kwargs.get("language", self.language)
+        if language not in LANGUAGES:
+            print(f"SenseVoice: unsupported language {language!r}, using {self.language}")
+            language = self.language
 
         # SenseVoice expects 16kHz
         if sample_rate != 16000:
@@ -90,17 +135,75 @@ class SenseVoiceBackend(ASRBackend):
             audio_data = librosa.resample(audio_data, orig_sr=sample_rate, target_sr=16000)
             sample_rate = 16000
 
-        stream = self.recognizer.create_stream()
-        stream.accept_waveform(sample_rate, audio_data)
-        # If language is overridden in kwargs, we might need a different recognizer or 
-        # just pass it if the recognizer supports it per-stream.
-        # sherpa-onnx OfflineRecognizer.from_sense_voice doesn't seem to support per-stream language easily if it's fixed at init.
-        # However, SenseVoice is often used with 'auto'.
-        
-        self.recognizer.decode_stream(stream)
-        
-        text = stream.result.text
+        future = Future()
+        queued = time.perf_counter()
+        self.requests.put((language, audio_data, sample_rate, future))
+        token = current_token()
+        if token is not None:
+            # Still queued: dropped before a worker decodes it
+            token.on_cancel(future.cancel)
+        try:
+            text = future.result()
+        except CancelledError:
+            raise Cancelled(f"Request cancelled: {token.reason}")
+        current_trace().add("queue", future.started - queued)
+        note(batch_size=future.batch_size)
         
         duration = time.time() - start_time
         print(f"SenseVoice took {duration:.2f}s")
         return text
+
+    def close(self):
+        for _ in range(self.workers):
+            self.requests.put(None)
+
+    def _worker(self, index):
+        while True:
+            item = self.requests.get()
+            if item is None:
+                break
+            batch = [item]
+            # Batch only this worker's share of the backlog, so idle workers still get requests
+            take = min(self.max_batch, 1 + self.requests.qsize() // self.workers)
+            while len(batch) < take:
+                try:
+                    item = self.requests.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    # Another worker's stop signal
+                    self.requests.put(None)
+                    break
+                batch.append(item)
+
+            # The language is fixed per recognizer, so each language is decoded separately
+            by_language = {}
+            for item in batch:
+                # False for requests cancelled while queued
+                if item[3].set_running_or_notify_cancel():
+                    by_language.setdefault(item[0], []).append(item)
+
+            for language, items in by_language.items():
+                try:
+                    started = time.perf_counter()
+                    for _, _, _, future in items:
+                        # Read by transcribe() for the request's queue wait
+                        future.started, future.batch_size = started, len(items)
+                    recognizer = self.recognizers.get((index, language))
+                    streams = []
+                    for _, audio_data, sample_rate, _ in items:
+                        stream = recognizer.create_stream()
+                        stream.accept_waveform(sample_rate, audio_data)
+                        streams.append(stream)
+                    if len(streams) == 1:
+                        recognizer.decode_stream(streams[0])
+                    else:
+                        recognizer.decode_streams(streams)
+                    METRICS.observe("sensevoice.batch_size", len(streams))
+                    for (_, _, _, future), stream in zip(items, streams):
+                        future.set_result(stream.result.text)
+                except Exception as e:
+                    print(f"SenseVoice worker {index} error: {e}")
+                    for _, _, _, future in items:
+                        if not future.done():
+                            future.set_exception(e)
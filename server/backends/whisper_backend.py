@@ -1,18 +1,65 @@
 import os
+import copy
 import json
 import time
+import threading
+from collections import OrderedDict
 import torch
 import librosa
-from transformers import pipeline, logging as transformers_logging
+from transformers import pipeline, AutoModelForSpeechSeq2Seq, AutoProcessor, GenerationConfig, logging as transformers_logging
 from .base import ASRBackend
+from .model_cache import load_pretrained
+from .metrics import note
+from .decoding import cancel_criteria
 
 # Suppress transformers logging
 transformers_logging.set_verbosity_error()
 
 MODEL_ID = "openai/whisper-large-v3"
 TARGET_SAMPLE_RATE = 16000
+MAX_REQUEST_PLANS = 64
+
+# Whitelist allowed kwargs for Whisper generate
+ALLOWED_KEYS = {
+    "task", "language", "num_beams", "max_new_tokens", "min_new_tokens", "return_timestamps",
+    "temperature", "do_sample", "top_k", "top_p"
+}
+
+def patch_generation_config(model, processor):
+    # Fix for "The generation config is outdated" error
+    # Reload the generation config from the model ID to ensure it has all necessary attributes
+    # like lang_to_id and task_to_id.
+    model.generation_config = GenerationConfig.from_pretrained(MODEL_ID)
+
+    # Manually populate lang_to_id and task_to_id if they are missing
+    # This is required for Whisper v3 with some transformers versions
+    if not hasattr(model.generation_config, "lang_to_id"):
+        from transformers.models.whisper.tokenization_whisper import LANGUAGES
+        model.generation_config.lang_to_id = {
+            lang: processor.tokenizer.convert_tokens_to_ids(f"<|{lang}|>")
+            for lang in LANGUAGES.keys()
+        }
+
+    if not hasattr(model.generation_config, "task_to_id"):
+        model.generation_config.task_to_id = {
+            "transcribe": processor.tokenizer.convert_tokens_to_ids("<|transcribe|>"),
+            "translate": processor.tokenizer.convert_tokens_to_ids("<|translate|>")
+        }
+
+    model.generation_config.is_multilingual = True
+
+def parse_value(value):
+    """Form fields arrive as strings, turn "4", "0.2" or "true" back into numbers and booleans."""
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    return value
 
 class WhisperBackend(ASRBackend):
+    model_id = MODEL_ID
+
     def __init__(self, config=None):
         super().__init__(config)
         print(f"Loading {MODEL_ID} model...")
@@ -21,38 +68,18 @@ class WhisperBackend(ASRBackend):
         self.device = whisper_config.get("device", "cuda:0" if torch.cuda.is_available() else "cpu")
         self.torch_dtype = torch.float16 if "cuda" in self.device else torch.float32
 
-        from transformers import GenerationConfig
-        
+        # The patched generation config is saved with the cached model, so this only runs once
+        model, processor = load_pretrained(AutoModelForSpeechSeq2Seq, AutoProcessor, MODEL_ID, self.config, "whisper",
+                                           dtype=self.torch_dtype, patch=patch_generation_config, low_cpu_mem_usage=True)
         self.pipe = pipeline(
             "automatic-speech-recognition",
-            model=MODEL_ID,
+            model=model,
+            tokenizer=processor.tokenizer,
+            feature_extractor=processor.feature_extractor,
             torch_dtype=self.torch_dtype,
             device=self.device,
-            model_kwargs={"low_cpu_mem_usage": True, "use_safetensors": True}
         )
 
-        # Fix for "The generation config is outdated" error
-        # Reload the generation config from the model ID to ensure it has all necessary attributes
-        # like lang_to_id and task_to_id.
-        self.pipe.model.generation_config = GenerationConfig.from_pretrained(MODEL_ID)
-
-        # Manually populate lang_to_id and task_to_id if they are missing
-        # This is required for Whisper v3 with some transformers versions
-        if not hasattr(self.pipe.model.generation_config, "lang_to_id"):
-            from transformers.models.whisper.tokenization_whisper import LANGUAGES
-            self.pipe.model.generation_config.lang_to_id = {
-                lang: self.pipe.tokenizer.convert_tokens_to_ids(f"<|{lang}|>")
-                for lang in LANGUAGES.keys()
-            }
-        
-        if not hasattr(self.pipe.model.generation_config, "task_to_id"):
-            self.pipe.model.generation_config.task_to_id = {
-                "transcribe": self.pipe.tokenizer.convert_tokens_to_ids("<|transcribe|>"),
-                "translate": self.pipe.tokenizer.convert_tokens_to_ids("<|translate|>")
-            }
-        
-        self.pipe.model.generation_config.is_multilingual = True
-
         language = whisper_config.get("language", "yue")
         
         self.generate_kwargs = {
@@ -64,33 +91,72 @@ class WhisperBackend(ASRBackend):
 
         print(self.generate_kwargs)
 
+        self.plans = OrderedDict()
+        self.plans_lock = threading.Lock()
+
     def transcribe(self, audio_data, sample_rate, system_prompt=None, history=None, **kwargs):
         start_time = time.time()
         
         if sample_rate != TARGET_SAMPLE_RATE:
             audio_data = librosa.resample(audio_data, orig_sr=sample_rate, target_sr=TARGET_SAMPLE_RATE)
+
+        # Copy of the plan's dict only, the generation config and prompt tensor are shared read-only
+        generate_kwargs = dict(self.request_plan(system_prompt, kwargs))
+        stopping_criteria = cancel_criteria()
+        if stopping_criteria:
+            generate_kwargs["stopping_criteria"] = stopping_criteria
+
+        result = self.pipe(audio_data, generate_kwargs=generate_kwargs)
+        text = result["text"].strip()
         
+        print(f"Whisper-v3-large took {time.time() - start_time:.2f}s")
+        return text
+
+    def offload(self):
+        self.pipe.model.to("cpu")
+        # Plans hold prompt_ids on the device
+        with self.plans_lock:
+            self.plans.clear()
+        return True
+
+    def restore(self):
+        self.pipe.model.to(self.device)
+
+    def request_plan(self, system_prompt, kwargs):
+        """
+        Returns the generate_kwargs for a request variant: prompt_ids already on the
+        device and a private GenerationConfig with the task, language and decoding
+        options applied. Plans are cached per (system_prompt, allowed kwargs), so
+        repeated requests skip tokenisation and never touch the model's own config.
+        """
         # Merge default generate_kwargs with those passed in transcribe call
         merged_kwargs = self.generate_kwargs.copy()
-        merged_kwargs.update({k: v for k, v in kwargs.items() if v is not None})
-        
-        # Whitelist allowed kwargs for Whisper generate
-        allowed_keys = {
-            "task", "language", "prompt_ids", "generation_config", 
-            "num_beams", "max_new_tokens", "min_new_tokens", "return_timestamps",
-            "temperature", "do_sample", "top_k", "top_p"
-        }
-        
-        kwargs = {k: v for k, v in merged_kwargs.items() if k in allowed_keys and v is not None}
-        
+        merged_kwargs.update({k: parse_value(v) for k, v in kwargs.items() if k in ALLOWED_KEYS and v is not None})
+        key = json.dumps([system_prompt or "", merged_kwargs], sort_keys=True, default=str)
+
+        with self.plans_lock:
+            plan = self.plans.get(key)
+            if plan is not None:
+                self.plans.move_to_end(key)
+                note(cache_hit=True)
+                return plan
+        note(cache_hit=False)
+
+        generation_config = copy.deepcopy(self.pipe.model.generation_config)
+        plan = {}
+        for k, v in merged_kwargs.items():
+            if k in ("task", "language") or hasattr(generation_config, k):
+                setattr(generation_config, k, v)
+            else:
+                plan[k] = v
         # Pass generation_config explicitly to ensure it's used
-        kwargs["generation_config"] = self.pipe.model.generation_config
-        
+        plan["generation_config"] = generation_config
+
         if system_prompt:
-            kwargs["prompt_ids"] = self.pipe.tokenizer.get_prompt_ids(system_prompt, return_tensors="pt").to(self.device)
+            plan["prompt_ids"] = self.pipe.tokenizer.get_prompt_ids(system_prompt, return_tensors="pt").to(self.device)
 
-        result = self.pipe(audio_data, generate_kwargs=kwargs)
-        text = result["text"].strip()
-        
-        print(f"Whisper-v3-large took {time.time() - start_time:.2f}s")
-        return text
+        with self.plans_lock:
+            self.plans[key] = plan
+            while len(self.plans) > MAX_REQUEST_PLANS:
+                self.plans.popitem(last=False)
+        return plan
@@ -0,0 +1,48 @@
+import sys
+import time
+import json
+import argparse
+import subprocess
+
+SECTIONS = {"glm": "glm", "whisper": "whisper"}
+
+def child(backend, config):
+    start = time.perf_counter()
+    from backends.registry import create_backend
+    create_backend(backend, config=config)
+    print("STARTUP " + json.dumps({"seconds": time.perf_counter() - start}))
+
+def run(backend, config):
+    out = subprocess.run([sys.executable, __file__, "--child", backend, "--config-json", json.dumps(config)],
+                         capture_output=True, text=True, check=True).stdout
+    line = next(l for l in out.splitlines() if l.startswith("STARTUP "))
+    return json.loads(line[len("STARTUP "):])["seconds"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Backend startup time with and without the model artifact cache")
+    parser.add_argument("--backend", type=str, default="glm", choices=list(SECTIONS))
+    parser.add_argument("--cache-dir", type=str, help="Model cache directory (default ~/.cache/wtako-asr-ime/models)")
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--child", type=str, help=argparse.SUPPRESS)
+    parser.add_argument("--config-json", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, json.loads(args.config_json))
+        return
+
+    section = SECTIONS[args.backend]
+    base = {"model_cache_dir": args.cache_dir} if args.cache_dir else {}
+    uncached = dict(base, **{section: {"model_cache": False}})
+    cached = dict(base, **{section: {"model_cache": True}})
+
+    # Fills the cache if needed and warms the page cache for both paths
+    print(f"First cached start (may build the cache): {run(args.backend, cached):.2f}s")
+    run(args.backend, uncached)
+
+    for name, config in (("hub/local files", uncached), ("model cache", cached)):
+        samples = [run(args.backend, config) for _ in range(args.iterations)]
+        print(f"{name:>16}: startup mean {sum(samples) / len(samples):6.2f}s  min {min(samples):6.2f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import os
+import time
+import signal
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from replicas import ReplicaPool
+from backends import fake_backend
+
+def wait_for(condition, timeout, what):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError(f"Timed out waiting for {what}")
+        time.sleep(0.01)
+
+def run(pool, audio, sample_rate, requests, kill=False):
+    """Sends requests concurrently, optionally killing one replica while it is transcribing."""
+    with ThreadPoolExecutor(max_workers=requests) as executor:
+        start = time.perf_counter()
+        futures = [executor.submit(pool.transcribe, audio, sample_rate) for _ in range(requests)]
+        if kill:
+            victim = pool.replicas[0]
+            wait_for(lambda: victim.inflight, 10, "replica 0 to get a request")
+            lost = len(victim.inflight)
+            print(f"Killing replica 0 (pid {victim.process.pid}) with {lost} request(s) in flight")
+            os.kill(victim.process.pid, signal.SIGKILL)
+        texts = [f.result() for f in futures]
+        elapsed = time.perf_counter() - start
+    if kill:
+        # Restarted after its backoff, the lost requests were answered by a retry
+        wait_for(lambda: victim.restarts >= 1 and victim.ready, 30, "replica 0 to restart")
+        print(f"Replica 0 restarted, {lost} lost request(s) retried")
+    return texts, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Replica server check and scaling benchmark with the fake backend (CPU)")
+    parser.add_argument("--replicas", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=1.0, help="Utterance length in seconds")
+    parser.add_argument("--rtf", type=float, default=0.1, help="Fake compute seconds per audio second")
+    parser.add_argument("--kill", action="store_true", help="Kill a replica mid-run to check restart and retry")
+    args = parser.parse_args()
+
+    fake_backend.register()
+    config = {"fake": {"text": "ok", "rtf": args.rtf, "busy": True}}
+    audio = np.zeros(int(args.duration * 16000), dtype=np.float32)
+
+    baseline = None
+    for replicas in args.replicas:
+        pool = ReplicaPool("fake", config, replicas)
+        wait_for(lambda: all(r.ready for r in pool.replicas), 60, "replicas to load")
+        # The model budget counts what the replica processes report
+        ram_mb, vram_mb = pool.memory_mb()
+        if ram_mb <= 0:
+            raise AssertionError("Replicas reported no memory")
+
+        texts, elapsed = run(pool, audio, 16000, args.requests, kill=args.kill)
+        if texts != ["ok"] * args.requests:
+            raise AssertionError(f"Unexpected results: {texts}")
+        status = pool.status()
+        pool.close()
+
+        throughput = args.requests / elapsed
+        baseline = baseline or throughput
+        served = " ".join(str(r["served"]) for r in status["replicas"])
+        restarts = sum(r["restarts"] for r in status["replicas"])
+        print(f"{replicas:>2} replica(s): {throughput:6.1f} req/s  speedup {throughput / baseline:4.2f}x  served [{served}]  restarts {restarts}  RAM {ram_mb:.0f} MB")
+
+if __name__ == "__main__":
+    main()
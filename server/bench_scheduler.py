@@ -0,0 +1,64 @@
+import time
+import random
+import argparse
+import threading
+import numpy as np
+
+from scheduler import Scheduler
+
+def run(policy, args):
+    """Replays the same mixed workload through a one-slot scheduler, returns latencies per kind."""
+    scheduler = Scheduler("bench", slots=1, max_queue=0, policy=policy, aging=args.aging)
+    # Measured before the run, as on a warm server
+    scheduler.rtf = args.rtf
+    rng = random.Random(args.seed)
+    latencies = {"short": [], "long": []}
+    lock = threading.Lock()
+
+    def request(kind, audio_seconds, client, priority):
+        start = time.monotonic()
+        ticket = scheduler.acquire(audio_seconds, client=client, priority=priority)
+        inference = audio_seconds * args.rtf
+        time.sleep(inference)
+        scheduler.release(ticket, inference)
+        with lock:
+            latencies[kind].append(time.monotonic() - start)
+
+    threads = []
+    end = time.monotonic() + args.seconds
+    while time.monotonic() < end:
+        if rng.random() < args.long_fraction:
+            kind, audio_seconds, client, priority = "long", args.long_seconds, "uploader", args.long_priority
+        else:
+            kind, audio_seconds, client, priority = "short", rng.uniform(1, 5), f"user{rng.randrange(args.users)}", "interactive"
+        thread = threading.Thread(target=request, args=(kind, audio_seconds, client, priority))
+        thread.start()
+        threads.append(thread)
+        time.sleep(rng.expovariate(args.rate))
+    for thread in threads:
+        thread.join()
+    return latencies
+
+def main():
+    parser = argparse.ArgumentParser(description="FIFO vs cost-ordered scheduling on a simulated mixed workload")
+    parser.add_argument("--seconds", type=float, default=20, help="Length of the arrival window")
+    parser.add_argument("--rate", type=float, default=3.0, help="Requests per second")
+    parser.add_argument("--rtf", type=float, default=0.05, help="Simulated inference seconds per audio second")
+    parser.add_argument("--long-seconds", type=float, default=120, help="Audio length of a long upload")
+    parser.add_argument("--long-fraction", type=float, default=0.03)
+    parser.add_argument("--long-priority", type=str, default="normal", choices=["interactive", "normal", "batch"])
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--aging", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for policy in ("fifo", "cost"):
+        latencies = run(policy, args)
+        short, long = np.array(latencies["short"]), np.array(latencies["long"])
+        line = f"{policy:>5}: short n={len(short)} p50 {np.percentile(short, 50) * 1000:7.0f} ms  p95 {np.percentile(short, 95) * 1000:7.0f} ms"
+        if len(long):
+            line += f" | long n={len(long)} max {long.max():5.1f} s"
+        print(line)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import os
+import time
+import wave
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from backends.sensevoice_backend import SenseVoiceBackend
+
+def load_audio(path, duration):
+    if path:
+        with wave.open(path, 'rb') as wav_file:
+            params = wav_file.getparams()
+            audio = np.frombuffer(wav_file.readframes(params.nframes), dtype=np.int16).astype(np.float32) / 32768.0
+            if params.nchannels > 1:
+                audio = audio.reshape(-1, params.nchannels).mean(axis=1)
+            return audio, params.framerate
+    return (np.random.default_rng(0).standard_normal(int(duration * 16000)) * 0.05).astype(np.float32), 16000
+
+def main():
+    parser = argparse.ArgumentParser(description="SenseVoice throughput versus cores for different worker counts")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--threads", type=int, default=2, help="Threads per worker (num_threads)")
+    parser.add_argument("--requests", type=int, default=64, help="Concurrent requests per run")
+    parser.add_argument("--duration", type=float, default=5.0, help="Length of the synthetic utterance")
+    parser.add_argument("--wav", type=str, help="Use this recording instead of synthetic audio")
+    parser.add_argument("--model-dir", type=str, default="sherpa-onnx-sense-voice-zh-en-ja-ko-yue-int8-2024-07-17")
+    args = parser.parse_args()
+
+    audio, sample_rate = load_audio(args.wav, args.duration)
+    audio_seconds = len(audio) / sample_rate
+    print(f"{os.cpu_count()} CPUs, {args.requests} requests of {audio_seconds:.1f}s, {args.threads} thread(s) per worker")
+
+    baseline = None
+    for workers in args.workers:
+        backend = SenseVoiceBackend(config={"sensevoice": {
+            "model_dir": args.model_dir,
+            "num_threads": args.threads,
+            "workers": workers,
+            "language": "auto",
+        }})
+        backend.transcribe(audio, sample_rate)
+
+        with ThreadPoolExecutor(max_workers=args.requests) as executor:
+            start = time.perf_counter()
+            list(executor.map(lambda _: backend.transcribe(audio, sample_rate), range(args.requests)))
+            elapsed = time.perf_counter() - start
+
+        throughput = args.requests * audio_seconds / elapsed
+        baseline = baseline or throughput
+        print(f"{workers:>3} worker(s) {workers * args.threads:>3} cores: {args.requests / elapsed:6.1f} req/s  "
+              f"{throughput:7.1f} audio s/s  speedup {throughput / baseline:5.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import os
+import io
+import sys
+import time
+import wave
+import json
+import argparse
+import subprocess
+import numpy as np
+import requests
+
+import local_transport
+
+def http_round_trip(url, audio_data, sample_rate, params):
+    # Same encoding as ASRClient.request_transcription
+    with io.BytesIO() as bio:
+        with wave.open(bio, 'wb') as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(sample_rate)
+            wav_file.writeframes((audio_data * 32767).astype(np.int16).tobytes())
+        wav_data = bio.getvalue()
+    files = {'audio': ('audio.wav', wav_data, 'audio/wav')}
+    data = {k: json.dumps(v) if isinstance(v, (dict, list)) else str(v) for k, v in params.items()}
+    response = requests.post(url, files=files, data=data, timeout=60)
+    response.raise_for_status()
+    return response.text
+
+def unix_round_trip(path, audio_data, sample_rate, params):
+    return local_transport.request(path, audio_data, sample_rate, params)
+
+def main():
+    parser = argparse.ArgumentParser(description="Round-trip benchmark of the HTTP and Unix socket transports")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix-socket", type=str, default="/tmp/glm_asr_bench.sock")
+    parser.add_argument("--sample-rate", type=int, default=48000, help="Client capture rate")
+    parser.add_argument("--durations", type=float, nargs="+", default=[5.0, 30.0])
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    # The fake backend returns instantly, so only transport overhead is measured. It is
+    # not a server backend by default, so the server is started with it registered.
+    server_dir = os.path.dirname(os.path.abspath(__file__))
+    run_server = "from backends import fake_backend; fake_backend.register(); import server; server.main()"
+    server_proc = subprocess.Popen([sys.executable, "-c", run_server, "--backend", "fake", "--port", str(args.port),
+                                    "--unix-socket", args.unix_socket, "--config-json", "{}"], cwd=server_dir)
+    url = f"http://localhost:{args.port}"
+    try:
+        while not os.path.exists(args.unix_socket):
+            if server_proc.poll() is not None:
+                raise RuntimeError("Benchmark server exited")
+            time.sleep(0.1)
+
+        # Typical extra_replace-sized parameter payload
+        params = {"language": "yue", "num_threads": 8, "extra_replace": {f"k{i}": f"v{i}" for i in range(24)}}
+        for duration in args.durations:
+            audio = (np.random.default_rng(0).standard_normal(int(duration * args.sample_rate)) * 0.1).astype(np.float32)
+            for name, round_trip, target in (("http", http_round_trip, url), ("unix", unix_round_trip, args.unix_socket)):
+                round_trip(target, audio, args.sample_rate, params)
+                samples = []
+                for _ in range(args.iterations):
+                    start = time.perf_counter()
+                    round_trip(target, audio, args.sample_rate, params)
+                    samples.append((time.perf_counter() - start) * 1000)
+                print(f"{duration:5.1f}s {name}: mean {np.mean(samples):7.2f} ms  p50 {np.percentile(samples, 50):7.2f} ms  p95 {np.percentile(samples, 95):7.2f} ms")
+    finally:
+        server_proc.terminate()
+        server_proc.wait()
+
+if __name__ == "__main__":
+    main()
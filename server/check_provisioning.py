@@ -0,0 +1,121 @@
+import io
+import os
+import sys
+import time
+import tarfile
+import hashlib
+import argparse
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from backends.provisioning import ensure_model, MANIFEST
+
+def check(condition, message):
+    """Like assert, but not stripped by python -O."""
+    if not condition:
+        raise AssertionError(message)
+
+def make_fixture(size_mb):
+    """A tarball shaped like the SenseVoice release: one top-level directory with the model and tokens."""
+    model = os.urandom(size_mb * 1024 * 1024)
+    with io.BytesIO() as bio:
+        with tarfile.open(fileobj=bio, mode="w:bz2") as tar:
+            for name, data in (("model.int8.onnx", model), ("tokens.txt", b"<blk> 0\n")):
+                info = tarfile.TarInfo(f"sense-voice-fixture/{name}")
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        return bio.getvalue(), hashlib.sha256(model).hexdigest()
+
+def serve(archive, cut_first_at):
+    """Stand-in for the release server: supports Range and drops the first response after cut_first_at bytes."""
+    state = {"requests": 0, "ranges": []}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            state["requests"] += 1
+            start = 0
+            range_header = self.headers.get("Range")
+            if range_header:
+                start = int(range_header.split("=")[1].split("-")[0])
+                state["ranges"].append(start)
+                if start >= len(archive):
+                    self.send_response(416)
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{len(archive) - 1}/{len(archive)}")
+            else:
+                self.send_response(200)
+            body = archive[start:]
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if state["requests"] == 1 and cut_first_at:
+                self.wfile.write(body[:cut_first_at])
+                self.wfile.flush()
+                self.connection.close()
+                return
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, state
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks model provisioning against a local stand-in server")
+    parser.add_argument("--size-mb", type=int, default=8)
+    args = parser.parse_args()
+
+    archive, sha256 = make_fixture(args.size_mb)
+    httpd, state = serve(archive, cut_first_at=len(archive) // 2)
+    url = f"http://127.0.0.1:{httpd.server_address[1]}/sense-voice-fixture.tar.bz2"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_dir = os.path.join(tmp, "model")
+        interrupted = None
+        try:
+            ensure_model(model_dir, "model.int8.onnx", url, sha256)
+        except Exception as e:
+            interrupted = e
+        check(interrupted is not None, "The interrupted download should have failed")
+        print(f"Interrupted download failed as expected: {type(interrupted).__name__}")
+
+        status = ensure_model(model_dir, "model.int8.onnx", url, sha256)
+        check(status == "downloaded", f"Expected downloaded, got {status}")
+        check(state["ranges"] and state["ranges"][0] > 0, f"Download did not resume: {state['ranges']}")
+        check(os.path.exists(os.path.join(model_dir, "tokens.txt")), "tokens.txt was not extracted")
+        check(not any(name.endswith(".part") for name in os.listdir(model_dir)), "The .part file was left behind")
+        print(f"Resumed at byte {state['ranges'][0]} of {len(archive)} and extracted into {os.path.basename(model_dir)}/")
+
+        start = time.perf_counter()
+        status = ensure_model(model_dir, "model.int8.onnx", url, sha256)
+        check(status == "cached", f"Expected cached, got {status}")
+        print(f"Unchanged file skipped rehashing ({(time.perf_counter() - start) * 1000:.2f} ms)")
+
+        # Touching the file invalidates the manifest entry, it is hashed again
+        os.utime(os.path.join(model_dir, "model.int8.onnx"))
+        status = ensure_model(model_dir, "model.int8.onnx", url, sha256)
+        check(status == "verified", f"Expected verified, got {status}")
+        print("Modified file was rehashed")
+
+        # An unwritable manifest (read-only model_dir) only costs the cache. A directory
+        # in the way of its temporary file fails the write even when running as root.
+        os.remove(os.path.join(model_dir, MANIFEST))
+        os.mkdir(os.path.join(model_dir, MANIFEST + ".tmp"))
+        for _ in range(2):
+            status = ensure_model(model_dir, "model.int8.onnx", url, sha256)
+            check(status == "verified", f"Expected verified without a manifest, got {status}")
+        check(state["requests"] == 2, f"Unwritable manifest caused a download ({state['requests']} requests)")
+        print("Unwritable manifest fell back to hashing on every start")
+    httpd.shutdown()
+    print("OK")
+
+if __name__ == "__main__":
+    try:
+        main()
+    except AssertionError as e:
+        print(f"FAILED: {e}")
+        sys.exit(1)
@@ -0,0 +1,123 @@
+"""
+Local fast path between the client and a server on the same machine.
+
+Requests go over a Unix domain socket as a small JSON header followed by the raw
+float32 samples, so there is no WAV encode, multipart wrapping or decode on either
+side. The HTTP API is unchanged and still used by remote clients.
+
+Request:  b"ASR2" | uint32 header length | JSON header | float32 LE samples
+Response: uint32 status | uint32 header length | uint32 payload length | JSON header | UTF-8 payload
+
+The response header always lists the post-processing stages the server applied
+("postprocessed", as X-Postprocessed does over HTTP), so the client does not
+apply them again. With "response_format": "json" in the params, the payload is
+the JSON body of the HTTP API (text plus stage timings) instead of the bare text.
+"""
+import os
+import time
+import json
+import socket
+import struct
+import socketserver
+import numpy as np
+
+from backends.metrics import begin_trace
+from postprocess import Transcript
+
+MAGIC = b"ASR2"
+REQUEST_PREFIX = struct.Struct("<4sI")
+RESPONSE_PREFIX = struct.Struct("<III")
+# Larger headers are malformed, not worth allocating
+MAX_HEADER_BYTES = 1 << 20
+
+class TransportError(RuntimeError):
+    def __init__(self, status, message):
+        super().__init__(f"Local transport error {status}: {message}")
+        self.status = status
+
+def recv_exact(sock, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            raise ConnectionError("Local transport connection closed early")
+        received += n
+    return buf
+
+def make_server(path, handle_transcription):
+    """Returns a Unix socket server calling handle_transcription(audio, sample_rate, system_prompt=..., **params)."""
+    if os.path.exists(path):
+        os.remove(path)
+
+    class LocalTransportHandler(socketserver.BaseRequestHandler):
+        def handle(self):
+            trace = begin_trace()
+            try:
+                magic, header_len = REQUEST_PREFIX.unpack(recv_exact(self.request, REQUEST_PREFIX.size))
+                if magic != MAGIC:
+                    self.reply(400, "Bad magic")
+                    return
+                if header_len > MAX_HEADER_BYTES:
+                    raise ValueError(f"header of {header_len} bytes")
+                header = json.loads(recv_exact(self.request, header_len))
+                num_samples = int(header["num_samples"])
+                sample_rate = int(header["sample_rate"])
+                params = header.get("params", {})
+                if num_samples < 0 or sample_rate <= 0 or not isinstance(params, dict):
+                    raise ValueError("bad num_samples, sample_rate or params")
+                samples = recv_exact(self.request, num_samples * 4)
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"Malformed local transport request: {e}")
+                self.reply(400, f"Malformed request: {e}")
+                return
+            except Exception as e:
+                print(f"Error reading local transport request: {e}")
+                return
+
+            audio_np = np.frombuffer(samples, dtype="<f4")
+            system_prompt = params.pop("system_prompt", None)
+            want_json = params.pop("response_format", None) == "json"
+            trace.add("parse", time.perf_counter() - trace.start)
+            try:
+                text = handle_transcription(audio_np, sample_rate, system_prompt=system_prompt, **params)
+                self.reply(200, json.dumps(trace.result(text), ensure_ascii=False) if want_json else text,
+                           {"postprocessed": trace.info.get("postprocessed", [])})
+            except Exception as e:
+                print(f"Error in local transport transcription: {e}")
+                # e.g. 503 when the request was shed by admission control, 400 like the
+                # HTTP API for a ValueError (unknown backend, bad parameter)
+                self.reply(getattr(e, "status", 400 if isinstance(e, ValueError) else 500), str(e))
+
+        def reply(self, status, text, header=None):
+            header = json.dumps(header or {}).encode('utf-8')
+            payload = text.encode('utf-8')
+            self.request.sendall(RESPONSE_PREFIX.pack(status, len(header), len(payload)) + header + payload)
+
+    server = socketserver.ThreadingUnixStreamServer(path, LocalTransportHandler)
+    server.daemon_threads = True
+    os.chmod(path, 0o600)
+    return server
+
+def request(path, audio_data, sample_rate, params=None, timeout=60):
+    """Sends one utterance over the local transport and returns the transcribed text, as a Transcript."""
+    audio = np.ascontiguousarray(audio_data, dtype="<f4")
+    header = json.dumps({
+        "sample_rate": int(sample_rate),
+        "num_samples": int(audio.shape[0]),
+        "params": params or {},
+    }).encode('utf-8')
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(path)
+        s.sendall(REQUEST_PREFIX.pack(MAGIC, len(header)) + header)
+        s.sendall(memoryview(audio).cast("B"))
+        status, header_len, length = RESPONSE_PREFIX.unpack(recv_exact(s, RESPONSE_PREFIX.size))
+        header = json.loads(recv_exact(s, header_len))
+        payload = recv_exact(s, length).decode('utf-8')
+
+    if status != 200:
+        raise TransportError(status, payload)
+    return Transcript(payload, header.get("postprocessed", ()))
@@ -0,0 +1,311 @@
+"""
+Several backends hosted by one server.
+
+Backends are loaded on first use and stay resident while they fit the RAM and
+VRAM budgets. Loading beyond a budget evicts the least recently used backend that
+is neither pinned nor serving a request. The size of each backend is measured
+when it loads. A reload then makes room up front, so the peak stays within
+budget.
+
+An idle policy can move backends that were not used for a while to CPU memory
+(or drop them) and bring them back on the next request or at scheduled times.
+"""
+import gc
+import os
+import sys
+import time
+import threading
+
+from backends.metrics import METRICS
+
+IDLE_CHECK_SECONDS = 5
+STATES = ("resident", "offloaded", "unloaded")
+
+def process_ram_mb():
+    """Resident memory of this process (Linux)."""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+def process_vram_mb():
+    """Memory allocated by torch on all GPUs, 0 when torch was never imported."""
+    torch = sys.modules.get("torch")
+    if torch is None or not torch.cuda.is_available():
+        return 0.0
+    return sum(torch.cuda.memory_allocated(i) for i in range(torch.cuda.device_count())) / (1024 * 1024)
+
+def release_memory():
+    gc.collect()
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+class ResidentModel:
+    def __init__(self, name, backend, ram_mb, vram_mb, load_seconds, pinned):
+        self.name = name
+        self.backend = backend
+        self.ram_mb = ram_mb
+        self.vram_mb = vram_mb
+        self.load_seconds = load_seconds
+        self.pinned = pinned
+        self.inflight = 0
+        self.requests = 0
+        self.last_used = time.time()
+        # Weights moved to CPU by the idle policy, restored on the next acquire()
+        self.offloaded = False
+
+class ModelStats:
+    """Time a backend spent in each state and how long it took to become usable."""
+
+    def __init__(self):
+        self.state = "unloaded"
+        self.since = time.time()
+        self.state_seconds = {state: 0.0 for state in STATES}
+        self.loads = 0
+        self.restores = 0
+        self.last_activation_seconds = None
+
+    def set_state(self, state):
+        now = time.time()
+        self.state_seconds[self.state] += now - self.since
+        self.state = state
+        self.since = now
+
+    def snapshot(self):
+        seconds = dict(self.state_seconds)
+        seconds[self.state] += time.time() - self.since
+        return {
+            "state": self.state,
+            "state_seconds": {k: round(v, 1) for k, v in seconds.items()},
+            "loads": self.loads,
+            "restores": self.restores,
+            "last_activation_seconds": self.last_activation_seconds,
+        }
+
+class ModelManager:
+    def __init__(self, factory, ram_budget_mb=0, vram_budget_mb=0, pinned=()):
+        """factory(name) creates a backend. A budget of 0 means unlimited."""
+        self.factory = factory
+        self.ram_budget_mb = ram_budget_mb
+        self.vram_budget_mb = vram_budget_mb
+        self.pinned = set(pinned)
+        self.models = {}
+        self.loading = set()
+        # Last measured (ram_mb, vram_mb) per backend, kept across evictions
+        self.sizes = {}
+        self.stats = {}
+        self.condition = threading.Condition()
+
+    def acquire(self, name):
+        """Returns the resident model for name, loading it if needed. Pair with release()."""
+        with self.condition:
+            while name in self.loading:
+                self.condition.wait()
+            model = self.models.get(name)
+            if model is not None and not model.offloaded:
+                model.inflight += 1
+                model.requests += 1
+                model.last_used = time.time()
+                return model
+            self.loading.add(name)
+            # Make room for a backend of known size before loading it
+            if model is not None:
+                self._evict_until(0, model.vram_mb, exclude=name)
+            elif name in self.sizes:
+                self._evict_until(*self.sizes[name], exclude=name)
+
+        try:
+            if model is None:
+                model = self._load(name)
+            else:
+                self._restore(model)
+        finally:
+            with self.condition:
+                self.loading.discard(name)
+                self.condition.notify_all()
+
+        with self.condition:
+            self.models[name] = model
+            model.inflight += 1
+            model.requests += 1
+            self._evict_until(0, 0, exclude=name)
+            return model
+
+    def release(self, model):
+        with self.condition:
+            model.inflight -= 1
+            model.last_used = time.time()
+            self.condition.notify_all()
+
+    def _load(self, name):
+        print(f"Loading backend {name}...")
+        ram_before, vram_before = process_ram_mb(), process_vram_mb()
+        start = time.time()
+        while True:
+            try:
+                backend = self.factory(name)
+                break
+            except Exception as e:
+                # Out of GPU memory: drop the least recently used idle backend and retry
+                if "OutOfMemory" not in type(e).__name__:
+                    raise
+                with self.condition:
+                    if not self._evict_one(exclude=name):
+                        raise
+                release_memory()
+        load_seconds = time.time() - start
+        ram_mb = max(0.0, process_ram_mb() - ram_before)
+        vram_mb = max(0.0, process_vram_mb() - vram_before)
+        self.sizes[name] = (ram_mb, vram_mb)
+        print(f"Backend {name} loaded in {load_seconds:.1f}s (RAM +{ram_mb:.0f} MB, VRAM +{vram_mb:.0f} MB)")
+        METRICS.observe("models.load_seconds", load_seconds)
+        with self.condition:
+            stats = self.stats.setdefault(name, ModelStats())
+            stats.set_state("resident")
+            stats.loads += 1
+            stats.last_activation_seconds = round(load_seconds, 3)
+        return ResidentModel(name, backend, ram_mb, vram_mb, load_seconds, name in self.pinned)
+
+    def _restore(self, model):
+        start = time.time()
+        model.backend.restore()
+        restore_seconds = time.time() - start
+        print(f"Backend {model.name} restored from CPU in {restore_seconds:.2f}s")
+        METRICS.observe("models.restore_seconds", restore_seconds)
+        with self.condition:
+            model.offloaded = False
+            stats = self.stats[model.name]
+            stats.set_state("resident")
+            stats.restores += 1
+            stats.last_activation_seconds = round(restore_seconds, 3)
+
+    def _refresh_sizes(self):
+        # Replicas run in their own processes, so their memory is what they report
+        for m in self.models.values():
+            if hasattr(m.backend, "memory_mb"):
+                m.ram_mb, m.vram_mb = m.backend.memory_mb()
+                if m.ram_mb:
+                    self.sizes[m.name] = (m.ram_mb, m.vram_mb)
+
+    def _over_budget(self, extra_ram_mb, extra_vram_mb):
+        self._refresh_sizes()
+        # Offloaded weights sit in RAM instead of VRAM
+        ram = sum(m.ram_mb + (m.vram_mb if m.offloaded else 0) for m in self.models.values()) + extra_ram_mb
+        vram = sum(m.vram_mb for m in self.models.values() if not m.offloaded) + extra_vram_mb
+        return (self.ram_budget_mb and ram > self.ram_budget_mb) or (self.vram_budget_mb and vram > self.vram_budget_mb)
+
+    def _evict_until(self, extra_ram_mb, extra_vram_mb, exclude):
+        while self._over_budget(extra_ram_mb, extra_vram_mb):
+            if not self._evict_one(exclude):
+                print("Model budget exceeded, but every other resident backend is pinned or busy")
+                return
+
+    def _evict_one(self, exclude):
+        candidates = [m for m in self.models.values() if m.name != exclude and not m.pinned and m.inflight == 0]
+        if not candidates:
+            return False
+        self._unload(min(candidates, key=lambda m: m.last_used))
+        return True
+
+    def _unload(self, model):
+        del self.models[model.name]
+        model.backend.close()
+        model.backend = None
+        release_memory()
+        self.stats[model.name].set_state("unloaded")
+        print(f"Unloaded backend {model.name}")
+
+    def start_idle_policy(self, idle_seconds=0, action="offload", preload=(), preload_at=()):
+        """
+        Offloads (action "offload") or drops (action "unload") backends unused for
+        idle_seconds, pinned ones excepted. At each "HH:MM" in preload_at the
+        backends in preload are made resident again before anyone asks for them.
+        """
+        if idle_seconds or preload_at:
+            threading.Thread(target=self._idle_loop, args=(idle_seconds, action, preload, preload_at), daemon=True).start()
+
+    def _idle_loop(self, idle_seconds, action, preload, preload_at):
+        fired = set()
+        while True:
+            time.sleep(IDLE_CHECK_SECONDS)
+            if idle_seconds:
+                now = time.time()
+                with self.condition:
+                    idle = [m for m in self.models.values()
+                            if not m.pinned and not m.offloaded and m.inflight == 0 and m.name not in self.loading
+                            and now - m.last_used > idle_seconds]
+                    # Marked as loading so requests wait instead of racing the offload
+                    self.loading.update(m.name for m in idle)
+                for model in idle:
+                    try:
+                        self._deactivate(model, action)
+                    except Exception as e:
+                        print(f"Idle offload of {model.name} failed: {e}")
+                    finally:
+                        with self.condition:
+                            self.loading.discard(model.name)
+                            self.condition.notify_all()
+
+            today, clock = time.strftime("%Y-%m-%d"), time.strftime("%H:%M")
+            if clock in preload_at and (today, clock) not in fired:
+                fired.add((today, clock))
+                for name in preload:
+                    try:
+                        self.load(name)
+                    except Exception as e:
+                        print(f"Scheduled preload of {name} failed: {e}")
+
+    def _deactivate(self, model, action):
+        if action == "unload":
+            with self.condition:
+                self._unload(model)
+            return
+        start = time.time()
+        # CPU-only backends have nothing to offload and stay as they are
+        if model.backend.offload():
+            release_memory()
+            with self.condition:
+                model.offloaded = True
+                self.stats[model.name].set_state("offloaded")
+            print(f"Offloaded idle backend {model.name} to CPU in {time.time() - start:.2f}s")
+
+    def load(self, name, pin=None):
+        """Preloads name (admin endpoint) and optionally changes its pinning."""
+        model = self.acquire(name)
+        with self.condition:
+            if pin is not None:
+                model.pinned = pin
+                (self.pinned.add if pin else self.pinned.discard)(name)
+        self.release(model)
+
+    def unload(self, name):
+        """Unloads name once its running requests have finished. Returns False if it was not loaded."""
+        with self.condition:
+            while name in self.models and self.models[name].inflight > 0:
+                self.condition.wait()
+            model = self.models.get(name)
+            if model is None:
+                return False
+            self.pinned.discard(name)
+            self._unload(model)
+            return True
+
+    def status(self):
+        with self.condition:
+            self._refresh_sizes()
+            return {
+                "ram_budget_mb": self.ram_budget_mb,
+                "vram_budget_mb": self.vram_budget_mb,
+                "loading": sorted(self.loading),
+                "models": {m.name: {
+                    "ram_mb": round(m.ram_mb),
+                    "vram_mb": round(m.vram_mb),
+                    "load_seconds": round(m.load_seconds, 2),
+                    "pinned": m.pinned,
+                    "offloaded": m.offloaded,
+                    "inflight": m.inflight,
+                    "requests": m.requests,
+                    "idle_seconds": round(time.time() - m.last_used, 1),
+                    **({"backend": m.backend.status()} if hasattr(m.backend, "status") else {}),
+                } for m in self.models.values()},
+                "states": {name: stats.snapshot() for name, stats in self.stats.items()},
+            }
@@ -0,0 +1,100 @@
+"""
+The text pipeline applied to a transcript, shared by the server and the client.
+
+STAGES is the declared order. The server runs the stages it was started with
+(--enable-opencc, --enable-extra-replace) using the settings the request sent,
+up to the first stage it does not run that has work to do, and reports them as
+"postprocessed" in the JSON response (X-Postprocessed for plain text). The
+client runs the remaining stages. Each stage thus runs exactly once, in the
+declared order, wherever it is configured to run, and a replacement table that
+is not idempotent is never applied twice.
+
+Settings: opencc_convert (mode, empty for none) and replacements (compiled
+extra_replace table, see compile_replacements).
+"""
+import threading
+
+import opencc
+
+STAGES = ("opencc", "extra_replace")
+
+class Transcript(str):
+    """Text with the stages that were already applied to it."""
+
+    def __new__(cls, text, postprocessed=()):
+        transcript = super().__new__(cls, text)
+        transcript.postprocessed = tuple(postprocessed)
+        return transcript
+
+def compile_replacements(table):
+    """extra_replace table -> (old, new) pairs in order, None when there is nothing to replace."""
+    if not isinstance(table, dict):
+        return None
+    pairs = tuple((str(old), str(new)) for old, new in table.items() if old)
+    return pairs or None
+
+def apply_replacements(text, pairs):
+    for old, new in pairs:
+        text = text.replace(old, new)
+    return text
+
+_converters = {}
+_converters_lock = threading.Lock()
+
+def converter(mode):
+    """OpenCC converter for mode, loaded once (loading reads its dictionaries)."""
+    with _converters_lock:
+        if mode not in _converters:
+            _converters[mode] = opencc.OpenCC(mode)
+        return _converters[mode]
+
+class Pipeline:
+    def __init__(self, stages=STAGES, label=""):
+        unknown = set(stages) - set(STAGES)
+        if unknown:
+            raise ValueError(f"Unknown post-processing stages: {', '.join(sorted(unknown))}")
+        # Always in the declared order, whatever order they were given in
+        self.stages = tuple(name for name in STAGES if name in stages)
+        # Prefix of the log lines ("Server " on the server)
+        self.label = label
+
+    def active(self, name, settings):
+        """Whether stage name has anything to do with these settings."""
+        if name == "opencc":
+            return bool(settings.get("opencc_convert"))
+        return bool(settings.get("replacements"))
+
+    def run(self, text, settings, skip=()):
+        """
+        Applies this pipeline's stages not in skip, in the declared order. Stops
+        before a stage it does not have that has work to do, so whoever runs the
+        rest keeps the order. Returns the text and the stages that were run.
+        """
+        ran = []
+        for name in STAGES:
+            if name in skip:
+                continue
+            if name not in self.stages:
+                if self.active(name, settings):
+                    break
+                continue
+            text = getattr(self, "stage_" + name)(text, settings)
+            ran.append(name)
+        return text, ran
+
+    def stage_opencc(self, text, settings):
+        mode = settings.get("opencc_convert")
+        if mode:
+            try:
+                text = converter(mode).convert(text)
+                print(f"{self.label}OpenCC converted ({mode}): {text}")
+            except Exception as e:
+                print(f"{self.label}OpenCC conversion error: {e}")
+        return text
+
+    def stage_extra_replace(self, text, settings):
+        pairs = settings.get("replacements")
+        if pairs:
+            text = apply_replacements(text, pairs)
+            print(f"{self.label}Extra replace applied: {text}")
+        return text
@@ -0,0 +1,35 @@
+import os
+import sys
+import json
+import argparse
+
+from backends.provisioning import ensure_model, verify, SENSEVOICE_URL, SENSEVOICE_SHA256, SENSEVOICE_MODEL_DIR
+
+def main():
+    parser = argparse.ArgumentParser(description="Download and verify the SenseVoice model ahead of time, so the server can start offline")
+    parser.add_argument("--config", type=str, default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "client", "config.json"))
+    parser.add_argument("--model-dir", type=str, help="Overrides sensevoice.model_dir")
+    parser.add_argument("--url", type=str, help="Overrides sensevoice.model_url")
+    parser.add_argument("--sha256", type=str, help="Overrides sensevoice.model_sha256")
+    parser.add_argument("--verify-only", action="store_true", help="Only check the files already on disk")
+    args = parser.parse_args()
+
+    config = {}
+    if os.path.exists(args.config):
+        with open(args.config) as f:
+            config = json.load(f)
+    sv_config = config.get("sensevoice", config)
+    model_dir = args.model_dir or sv_config.get("model_dir", SENSEVOICE_MODEL_DIR)
+    url = args.url or sv_config.get("model_url", SENSEVOICE_URL)
+    sha256 = args.sha256 or sv_config.get("model_sha256", SENSEVOICE_SHA256)
+
+    if args.verify_only:
+        status = verify(model_dir, "model.int8.onnx", sha256)
+        print(f"{model_dir}: {status or 'missing or corrupt'}")
+        sys.exit(0 if status else 1)
+
+    status = ensure_model(model_dir, "model.int8.onnx", url, sha256)
+    print(f"{model_dir}: {status}")
+
+if __name__ == "__main__":
+    main()
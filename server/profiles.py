@@ -0,0 +1,70 @@
+"""
+Config profiles registered by clients.
+
+A client sends its settings (backend, system prompt, extra_replace table, ...)
+once with POST /profiles and gets back their content hash. Each utterance then
+only carries that id, instead of every setting as a form field that has to be
+JSON-decoded again. Profiles are kept parsed, with the replacement table already
+compiled, and the least recently used ones are evicted. A request naming a
+profile the server does not have (evicted, or the server restarted) gets 409,
+and the client registers it again.
+"""
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+from backends.metrics import METRICS
+from postprocess import compile_replacements
+
+MAX_PROFILES = 256
+
+class UnknownProfile(Exception):
+    """The request names a profile that is not registered. Sent to clients as 409."""
+    status = 409
+
+def profile_id(settings):
+    canonical = json.dumps(settings, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+class Profile:
+    def __init__(self, settings):
+        self.id = profile_id(settings)
+        self.settings = settings
+        self.replacements = compile_replacements(settings.get("extra_replace"))
+
+class ProfileCache:
+    def __init__(self, max_profiles=MAX_PROFILES):
+        self.max_profiles = max_profiles
+        self.profiles = OrderedDict()
+        self.lock = threading.Lock()
+
+    def register(self, settings):
+        if not isinstance(settings, dict):
+            raise ValueError("Profile settings must be a JSON object")
+        profile = Profile(settings)
+        with self.lock:
+            if profile.id in self.profiles:
+                self.profiles.move_to_end(profile.id)
+                return self.profiles[profile.id]
+            self.profiles[profile.id] = profile
+            while len(self.profiles) > self.max_profiles:
+                self.profiles.popitem(last=False)
+                METRICS.incr("profiles.evicted")
+        METRICS.incr("profiles.registered")
+        return profile
+
+    def get(self, profile_id):
+        with self.lock:
+            profile = self.profiles.get(profile_id)
+            if profile is not None:
+                self.profiles.move_to_end(profile_id)
+        if profile is None:
+            METRICS.incr("profiles.unknown")
+            raise UnknownProfile(f"Unknown profile {profile_id}")
+        METRICS.incr("profiles.hits")
+        return profile
+
+    def __len__(self):
+        with self.lock:
+            return len(self.profiles)
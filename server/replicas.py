@@ -0,0 +1,337 @@
+"""
+Model replicas in worker processes.
+
+The front-end process owns the request queue. A dispatcher hands each request to
+the ready replica with the fewest requests in flight (then the lowest recent
+latency), so a slow or busy replica is not given more work than it can take.
+Every replica loads its own backend, optionally pinned to a device and a CPU set,
+and dead replicas are restarted with their in-flight requests queued again.
+The idle policy's offload() and restore() are run in every ready replica.
+Cancelled requests are dropped from the queue. One already sent to a replica
+still runs there, only its result is discarded.
+"""
+import os
+import time
+import threading
+import itertools
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, CancelledError
+
+from backends.metrics import METRICS, begin_trace, current_trace
+from backends.registry import REGISTERED
+from backends.cancellation import Cancelled, current_token
+
+# Requests lost with a crashed replica are retried this many times before failing
+MAX_ATTEMPTS = 2
+# A replica reports its memory again when it changed by more than this since the last report
+MEMORY_REPORT_MB = 16
+
+def parse_cpu_set(spec):
+    """"0-3,8" -> {0, 1, 2, 3, 8}"""
+    cpus = set()
+    for part in spec.split(","):
+        if "-" in part:
+            first, last = part.split("-")
+            cpus.update(range(int(first), int(last) + 1))
+        elif part:
+            cpus.add(int(part))
+    return cpus
+
+def _replica_main(index, backend_type, config, device, cpu_set, requests, results, registered):
+    if cpu_set:
+        os.sched_setaffinity(0, parse_cpu_set(cpu_set))
+    if device:
+        # Set before the backend imports torch, "cuda" in the backend config then means this GPU
+        os.environ["CUDA_VISIBLE_DEVICES"] = device.split(":")[1] if device.startswith("cuda:") else ("" if device == "cpu" else device)
+
+    from backends.registry import create_backend, register_backend
+    from model_manager import process_ram_mb, process_vram_mb
+    # A spawned process starts with only the built-in backends
+    for name, backend_class in registered.items():
+        register_backend(name, backend_class)
+    try:
+        backend = create_backend(backend_type, config=config)
+    except Exception as e:
+        results.put(("failed", index, None, None, str(e)))
+        return
+    # The front-end's RAM/VRAM budget counts replicas by what they report, not its own memory
+    reported = None
+    def report_memory(force=False):
+        nonlocal reported
+        memory = (process_ram_mb(), process_vram_mb())
+        if force or reported is None or max(abs(a - b) for a, b in zip(memory, reported)) > MEMORY_REPORT_MB:
+            reported = memory
+            results.put(("memory", index, None, memory, None))
+
+    report_memory()
+    results.put(("ready", index, os.getpid(), None, None))
+
+    while True:
+        item = requests.get()
+        if item is None:
+            break
+        if item[0] == "control":
+            # offload() / restore() from the idle policy
+            op = item[1]
+            try:
+                value = getattr(backend, op)()
+                report_memory(force=True)
+                results.put(("control", index, op, value, None))
+            except Exception as e:
+                results.put(("control", index, op, None, str(e)))
+            continue
+        request_id, audio_data, sample_rate, system_prompt, history, kwargs = item
+        trace = begin_trace()
+        trace.note(model=backend.model_id, replica=index)
+        try:
+            text = backend.transcribe(audio_data, sample_rate, system_prompt, history, **kwargs)
+            # The backend's own stages and notes go back to the front-end's trace
+            results.put(("done", index, request_id, (text, trace.stages, trace.info), None))
+        except Exception as e:
+            results.put(("done", index, request_id, None, str(e)))
+        report_memory()
+
+class Replica:
+    def __init__(self, index, device, cpu_set):
+        self.index = index
+        self.device = device
+        self.cpu_set = cpu_set
+        self.process = None
+        self.requests = None
+        self.ready = False
+        self.inflight = {}  # request id -> sent time
+        self.latencies = deque(maxlen=32)
+        self.served = 0
+        self.restarts = 0
+        self.failures = 0  # deaths since it was last ready, for the restart backoff
+        self.started = 0.0
+        self.next_start = 0.0
+        self.control = None  # Future of the offload() / restore() it is running
+        self.ram_mb = 0.0  # as last reported by the process, 0 while it is not running
+        self.vram_mb = 0.0
+
+    def mean_latency(self):
+        return sum(self.latencies) / len(self.latencies) if self.latencies else 0.0
+
+class ReplicaPool:
+    """
+    Backend-compatible front for `replicas` worker processes running backend_type.
+    transcribe() blocks the calling handler thread until a replica has answered.
+    """
+    concurrent = True
+
+    def __init__(self, backend_type, config, replicas, devices=None, cpu_sets=None, max_inflight=1):
+        self.backend_type = backend_type
+        self.config = config
+        self.max_inflight = max_inflight
+        self.slots = replicas * max_inflight
+        self.context = multiprocessing.get_context("spawn")
+        self.results = self.context.Queue()
+        self.pending = deque()  # request ids, oldest first
+        self.requests = {}  # request id -> [future, payload, enqueued time, attempts, queue wait]
+        self.ids = itertools.count()
+        self.condition = threading.Condition()
+        self.stopped = False
+
+        devices = devices or [None]
+        cpu_sets = cpu_sets or [None]
+        self.replicas = [Replica(i, devices[i % len(devices)], cpu_sets[i % len(cpu_sets)]) for i in range(replicas)]
+        for replica in self.replicas:
+            self._start(replica)
+
+        threading.Thread(target=self._collect, daemon=True).start()
+        threading.Thread(target=self._dispatch, daemon=True).start()
+
+    def _start(self, replica):
+        replica.requests = self.context.Queue()
+        replica.ready = False
+        replica.started = time.time()
+        replica.process = self.context.Process(
+            target=_replica_main,
+            args=(replica.index, self.backend_type, self.config, replica.device, replica.cpu_set, replica.requests, self.results,
+                  dict(REGISTERED)),
+            daemon=True,
+        )
+        replica.process.start()
+        print(f"Replica {replica.index}: started pid {replica.process.pid} (device {replica.device or 'default'}, cpus {replica.cpu_set or 'all'})")
+
+    def transcribe(self, audio_data, sample_rate, system_prompt=None, history=None, **kwargs):
+        future = Future()
+        with self.condition:
+            request_id = next(self.ids)
+            entry = [future, (audio_data, sample_rate, system_prompt, history, kwargs), time.time(), 0, 0.0]
+            self.requests[request_id] = entry
+            self.pending.append(request_id)
+            self.condition.notify_all()
+        token = current_token()
+        if token is not None:
+            token.on_cancel(future.cancel)
+        try:
+            text, stages, info = future.result()
+        except CancelledError:
+            raise Cancelled(f"Request cancelled: {token.reason}")
+        trace = current_trace()
+        trace.add("queue", entry[4])
+        for name, seconds in stages.items():
+            trace.add(name, seconds)
+        trace.note(**info)
+        return text
+
+    def memory_mb(self):
+        """(RAM, VRAM) in MB of all replica processes, as they last reported it."""
+        with self.condition:
+            return sum(r.ram_mb for r in self.replicas), sum(r.vram_mb for r in self.replicas)
+
+    def offload(self):
+        """Offloads the weights of every ready replica. Returns False if none had anything to offload."""
+        return any(self._control("offload"))
+
+    def restore(self):
+        self._control("restore")
+
+    def _control(self, op):
+        """Runs backend.op() in every ready replica, after the requests sent to it, and returns the results."""
+        with self.condition:
+            futures = []
+            for replica in self.replicas:
+                if replica.ready:
+                    replica.control = Future()
+                    replica.requests.put(("control", op))
+                    futures.append((replica.index, replica.control))
+        results = []
+        for index, future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"Replica {index}: {op} failed: {e}")
+        return results
+
+    def _collect(self):
+        while True:
+            kind, index, value, text, error = self.results.get()
+            replica = self.replicas[index]
+            with self.condition:
+                if kind == "ready":
+                    replica.ready = True
+                    replica.failures = 0
+                    print(f"Replica {index}: ready after {time.time() - replica.started:.1f}s "
+                          f"(RAM {replica.ram_mb:.0f} MB, VRAM {replica.vram_mb:.0f} MB)")
+                elif kind == "memory":
+                    replica.ram_mb, replica.vram_mb = text
+                elif kind == "failed":
+                    print(f"Replica {index}: backend failed to load: {error}")
+                elif kind == "control":
+                    if replica.control is not None:
+                        if error is None:
+                            replica.control.set_result(text)
+                        else:
+                            replica.control.set_exception(RuntimeError(error))
+                        replica.control = None
+                elif kind == "done":
+                    sent = replica.inflight.pop(value, None)
+                    entry = self.requests.pop(value, None)
+                    if sent is not None:
+                        replica.latencies.append(time.time() - sent)
+                        replica.served += 1
+                    if entry is not None and not entry[0].cancelled():
+                        if error is None:
+                            entry[0].set_result(text)
+                        else:
+                            entry[0].set_exception(RuntimeError(error))
+                self.condition.notify_all()
+
+    def _pick(self):
+        candidates = [r for r in self.replicas if r.ready and len(r.inflight) < self.max_inflight]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda r: (len(r.inflight), r.mean_latency()))
+
+    def _dispatch(self):
+        with self.condition:
+            while not self.stopped:
+                self._supervise()
+                replica = self._pick() if self.pending else None
+                if replica is None:
+                    self.condition.wait(timeout=1.0)
+                    continue
+                request_id = self.pending.popleft()
+                entry = self.requests.get(request_id)
+                if entry is None:
+                    # Answered by a replica that died right after, before the retry was sent
+                    continue
+                if entry[0].cancelled():
+                    del self.requests[request_id]
+                    continue
+                entry[3] += 1
+                entry[4] = time.time() - entry[2]
+                METRICS.observe("replicas.queue_wait", entry[4])
+                replica.inflight[request_id] = time.time()
+                replica.requests.put((request_id,) + entry[1])
+
+    def _supervise(self):
+        now = time.time()
+        for replica in self.replicas:
+            if replica.process is None:
+                if now >= replica.next_start:
+                    replica.restarts += 1
+                    METRICS.incr("replicas.restarts")
+                    self._start(replica)
+                continue
+            if replica.process.is_alive():
+                continue
+
+            replica.failures += 1
+            backoff = min(30, 2 ** (replica.failures - 1))
+            print(f"Replica {replica.index}: exited with code {replica.process.exitcode}, restarting in {backoff}s")
+            replica.process = None
+            replica.ready = False
+            replica.next_start = now + backoff
+            replica.ram_mb = replica.vram_mb = 0.0
+            if replica.control is not None:
+                replica.control.set_exception(RuntimeError("replica exited"))
+                replica.control = None
+            # Requests it was working on go back to the front of the queue
+            for request_id in reversed(list(replica.inflight)):
+                entry = self.requests.get(request_id)
+                if entry is None:
+                    continue
+                if entry[0].cancelled():
+                    del self.requests[request_id]
+                elif entry[3] >= MAX_ATTEMPTS:
+                    del self.requests[request_id]
+                    entry[0].set_exception(RuntimeError(f"Replica {replica.index} died while transcribing"))
+                else:
+                    self.pending.appendleft(request_id)
+            replica.inflight.clear()
+
+    def status(self):
+        with self.condition:
+            return {
+                "queued": len(self.pending),
+                "replicas": [{
+                    "index": r.index,
+                    "pid": r.process.pid if r.process else None,
+                    "ready": r.ready,
+                    "inflight": len(r.inflight),
+                    "served": r.served,
+                    "ram_mb": round(r.ram_mb),
+                    "vram_mb": round(r.vram_mb),
+                    "restarts": r.restarts,
+                    "mean_latency": r.mean_latency(),
+                    "device": r.device,
+                    "cpus": r.cpu_set,
+                } for r in self.replicas],
+            }
+
+    def close(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        replicas = [r for r in self.replicas if r.process is not None]
+        for replica in replicas:
+            replica.requests.put(None)
+        for replica in replicas:
+            replica.process.join(timeout=5)
+            if replica.process.is_alive():
+                replica.process.terminate()
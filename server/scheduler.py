@@ -0,0 +1,182 @@
+"""
+Admission control in front of each backend.
+
+A backend runs at most `slots` requests at a time (1 for backends that are not
+concurrent), the rest wait in a bounded queue. Each request can carry a
+deadline. A request whose expected finish (work ahead of it plus its own audio,
+at the backend's measured real-time factor) is past its deadline is rejected
+straight away, and one whose deadline passes while it waits is dropped, so
+clients get a fast 503 with Retry-After instead of stale text much later.
+
+Queued requests are started cheapest first (see Scheduler), so a few seconds
+of dictation does not wait behind a two-minute upload.
+"""
+import math
+import time
+import threading
+
+from backends.metrics import METRICS
+from backends.cancellation import Cancelled
+
+# Weight of the newest measurement in the real-time factor estimate
+RTF_SMOOTHING = 0.2
+
+class Overloaded(Exception):
+    """Request shed by admission control. Sent to clients as 503 with Retry-After."""
+    status = 503
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+# Priority hints and the seconds of expected cost they add to a request's score
+PRIORITIES = {"interactive": 0.0, "normal": 5.0, "batch": 30.0}
+
+class Ticket:
+    def __init__(self, audio_seconds, deadline, client=None, priority="normal"):
+        self.audio_seconds = audio_seconds
+        self.deadline = deadline
+        self.client = client
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        self.started = None
+        self.granted = False
+
+class Scheduler:
+    """
+    policy "cost" runs the queued request with the lowest score first:
+    expected cost (audio seconds x measured RTF), plus the expected cost of
+    the same client's requests running or queued before it, plus the priority
+    hint's offset, minus `aging` x seconds waited. Short dictation thus passes
+    long uploads, one client cannot crowd out the others, and long requests
+    still start once they have waited long enough. policy "fifo" runs requests
+    in arrival order.
+    """
+
+    def __init__(self, name, slots=1, max_queue=16, policy="cost", aging=1.0):
+        self.name = name
+        self.slots = max(1, slots)
+        self.max_queue = max_queue
+        self.policy = policy
+        self.aging = aging
+        self.queue = []
+        self.running = []
+        # Inference seconds per audio second, None until the first request finished
+        self.rtf = None
+        self.condition = threading.Condition()
+
+    def cost(self, audio_seconds):
+        """Expected inference seconds, 0 until the RTF was measured."""
+        return audio_seconds * (self.rtf or 0.0)
+
+    def weight(self, audio_seconds):
+        # Before the first measurement, the duration alone still orders requests
+        return audio_seconds * (self.rtf if self.rtf is not None else 1.0)
+
+    def order(self, now):
+        """Queued tickets in the order they would start."""
+        if self.policy == "fifo":
+            return list(self.queue)
+        client_load = {}
+        for t in self.running:
+            client_load[t.client] = client_load.get(t.client, 0.0) + max(0.0, self.weight(t.audio_seconds) - (now - t.started))
+        scores = {}
+        for t in self.queue:
+            weight = self.weight(t.audio_seconds)
+            scores[id(t)] = weight + client_load.get(t.client, 0.0) + PRIORITIES[t.priority] - self.aging * (now - t.enqueued)
+            client_load[t.client] = client_load.get(t.client, 0.0) + weight
+        return sorted(self.queue, key=lambda t: scores[id(t)])
+
+    def expected_wait(self, now, ticket=None):
+        """Seconds until ticket (or a request queued now) would start, assuming costs are right."""
+        running = sum(max(0.0, self.cost(t.audio_seconds) - (now - t.started)) for t in self.running)
+        ahead = self.order(now)
+        if ticket is not None and ticket in ahead:
+            ahead = ahead[:ahead.index(ticket)]
+        if len(self.running) < self.slots and not ahead:
+            return 0.0
+        return (running + sum(self.cost(t.audio_seconds) for t in ahead)) / self.slots
+
+    def dispatch(self):
+        """Grants free slots to the best queued tickets. Called with the condition held."""
+        now = time.monotonic()
+        while self.queue and len(self.running) < self.slots:
+            ticket = self.order(now)[0]
+            self.queue.remove(ticket)
+            ticket.granted = True
+            ticket.started = now
+            self.running.append(ticket)
+            METRICS.observe("scheduler.queue_wait", now - ticket.enqueued)
+            METRICS.observe(f"scheduler.queue_wait.{ticket.priority}", now - ticket.enqueued)
+        self.condition.notify_all()
+
+    def shed(self, reason, message, now, ticket=None):
+        METRICS.incr("scheduler.shed")
+        METRICS.incr(f"scheduler.shed.{reason}")
+        retry_after = max(1, math.ceil(self.expected_wait(now, ticket)))
+        raise Overloaded(f"{self.name}: {message}, retry after {retry_after}s", retry_after)
+
+    def wake(self):
+        with self.condition:
+            self.condition.notify_all()
+
+    def acquire(self, audio_seconds, deadline=None, token=None, client=None, priority="normal"):
+        """
+        Waits for a slot and returns a ticket to pass to release(). deadline is a
+        time.monotonic() value. Raises Overloaded when the request is shed, and
+        Cancelled when token is cancelled while it waits.
+        """
+        if priority not in PRIORITIES:
+            priority = "normal"
+        with self.condition:
+            now = time.monotonic()
+            if self.max_queue and len(self.queue) >= self.max_queue:
+                self.shed("queue_full", f"queue full ({len(self.queue)} waiting)", now)
+            ticket = Ticket(audio_seconds, deadline, client, priority)
+            self.queue.append(ticket)
+            if deadline is not None and now + self.expected_wait(now, ticket) + self.cost(audio_seconds) > deadline:
+                self.queue.remove(ticket)
+                self.shed("deadline", "cannot finish before the deadline", now)
+            if token is not None:
+                token.on_cancel(self.wake)
+
+            self.dispatch()
+            try:
+                while not ticket.granted:
+                    if token is not None:
+                        token.check()
+                    timeout = None if deadline is None else deadline - time.monotonic()
+                    if timeout is not None and timeout <= 0:
+                        self.shed("expired", "deadline passed while queued", time.monotonic(), ticket)
+                    self.condition.wait(timeout)
+            except (Overloaded, Cancelled):
+                self.queue.remove(ticket)
+                self.dispatch()
+                raise
+            return ticket
+
+    def release(self, ticket, inference_seconds=None):
+        with self.condition:
+            self.running.remove(ticket)
+            if inference_seconds is not None and ticket.audio_seconds > 0:
+                rtf = inference_seconds / ticket.audio_seconds
+                self.rtf = rtf if self.rtf is None else (1 - RTF_SMOOTHING) * self.rtf + RTF_SMOOTHING * rtf
+            self.dispatch()
+
+    def load(self):
+        """(queued requests, seconds a request arriving now would wait)."""
+        with self.condition:
+            return len(self.queue), self.expected_wait(time.monotonic())
+
+    def status(self):
+        with self.condition:
+            return {
+                "policy": self.policy,
+                "slots": self.slots,
+                "running": len(self.running),
+                "queued": len(self.queue),
+                "queued_by_priority": {p: sum(t.priority == p for t in self.queue) for p in PRIORITIES},
+                "max_queue": self.max_queue,
+                "rtf": round(self.rtf, 3) if self.rtf is not None else None,
+                "expected_wait_seconds": round(self.expected_wait(time.monotonic()), 2),
+            }
@@ -5,40 +5,303 @@ import numpy as np
 import io
 import wave
 import json
-import opencc
+import select
+import socket
+import threading
 from email.parser import BytesParser
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 import argparse
 
-from backends.glm_backend import GLMBackend
-from backends.sensevoice_backend import SenseVoiceBackend
-from backends.whisper_backend import WhisperBackend
-from backends.qwen_asr_backend import QwenASRBackend
+from backends.registry import BACKEND_TYPES, create_backend
+from backends.metrics import METRICS, begin_trace, current_trace
+from backends.cancellation import CancelToken, Cancelled, current_token, set_current_token
+import local_transport
+from replicas import ReplicaPool
+from model_manager import ModelManager
+from scheduler import Scheduler, Overloaded
+from profiles import ProfileCache, UnknownProfile
+from postprocess import Pipeline, compile_replacements
+
+# How often a running request checks whether its client is still connected
+DISCONNECT_POLL_SECONDS = 0.25
+
+def normalize_backend(name):
+    return "sensevoice" if name == "sherpa-onnx/sense-voice" else name
 
 class ASRServer:
-    def __init__(self, port, backend_type="glm", config=None, enable_opencc=False, enable_extra_replace=False):
+    def __init__(self, port, backend_type="glm", config=None, enable_opencc=False, enable_extra_replace=False, unix_socket=None,
+                 replicas=1, replica_devices=None, replica_cpus=None, ram_budget_mb=0, vram_budget_mb=0, pinned=None,
+                 remote_admin=False, idle_seconds=0, idle_action="offload", preload_at=None, max_queue=16,
+                 schedule="cost", aging=1.0, backends=None):
         self.port = port
+        self.unix_socket = unix_socket
         self.config = config or {}
-        self.enable_opencc = enable_opencc
-        self.enable_extra_replace = enable_extra_replace
-        if backend_type == "glm":
-            self.backend = GLMBackend(config=self.config)
-        elif backend_type == "sensevoice" or backend_type == "sherpa-onnx/sense-voice":
-            self.backend = SenseVoiceBackend(config=self.config)
-        elif backend_type == "whisper":
-            self.backend = WhisperBackend(config=self.config)
-        elif backend_type == "qwen":
-            self.backend = QwenASRBackend(config=self.config)
-        else:
-            raise ValueError(f"Unknown backend type: {backend_type}")
-
-    def transcribe(self, audio_data, sample_rate, system_prompt=None, history=None, **kwargs):
-        return self.backend.transcribe(audio_data, sample_rate, system_prompt, history, **kwargs)
+        # Post-processing stages run here, reported to clients so they skip them
+        self.pipeline = Pipeline([name for name, enabled in (("opencc", enable_opencc), ("extra_replace", enable_extra_replace)) if enabled],
+                                 label="Server ")
+        self.replicas = replicas
+        self.replica_devices = replica_devices
+        self.replica_cpus = replica_cpus
+        self.remote_admin = remote_admin
+        # Admission control per backend, kept across reloads so the measured RTF survives
+        self.max_queue = max_queue
+        self.schedule = schedule
+        self.aging = aging
+        self.schedulers = {}
+        self.schedulers_lock = threading.Lock()
+        # Request id -> CancelToken of requests being transcribed
+        self.inflight = {}
+        self.inflight_lock = threading.Lock()
+        # Client settings registered with POST /profiles, by content hash
+        self.profiles = ProfileCache()
+
+        # Requests may name another backend, it is then loaded next to this default one
+        self.default_backend = normalize_backend(backend_type)
+        # Only these may be loaded on request, any other name gets 400
+        self.backends = {self.default_backend} | {normalize_backend(name) for name in backends or []}
+        self.models = ModelManager(self.create_backend, ram_budget_mb, vram_budget_mb,
+                                   pinned=[normalize_backend(name) for name in pinned or []])
+        self.models.load(self.default_backend)
+        self.models.start_idle_policy(idle_seconds, idle_action, preload=[self.default_backend], preload_at=preload_at or [])
+
+    def create_backend(self, name):
+        if self.replicas > 1:
+            return ReplicaPool(name, self.config, self.replicas, devices=self.replica_devices, cpu_sets=self.replica_cpus)
+        return create_backend(name, config=self.config)
+
+    def check_backend(self, name):
+        """Normalized name of a backend this server may load, ValueError (400) otherwise."""
+        name = normalize_backend(name)
+        if name not in self.backends:
+            raise ValueError(f"Backend {name} is not enabled on this server (--backends {' '.join(sorted(self.backends))})")
+        return name
+
+    def scheduler(self, name, backend):
+        with self.schedulers_lock:
+            if name not in self.schedulers:
+                slots = backend.slots if backend.concurrent else 1
+                self.schedulers[name] = Scheduler(name, slots, self.max_queue, policy=self.schedule, aging=self.aging)
+            return self.schedulers[name]
+
+    def transcribe(self, audio_data, sample_rate, system_prompt=None, history=None, backend=None, deadline_ms=None,
+                   client_id=None, priority=None, **kwargs):
+        name = self.check_backend(backend or self.default_backend)
+        trace = current_trace()
+        audio_seconds = len(audio_data) / sample_rate
+        trace.note(backend=name, audio_seconds=round(audio_seconds, 3))
+        # Relative to when the request arrived, so client and server clocks need not agree
+        deadline = None
+        if deadline_ms:
+            deadline = time.monotonic() + float(deadline_ms) / 1000 - (time.perf_counter() - trace.start)
+
+        with trace.stage("acquire"):
+            model = self.models.acquire(name)
+        try:
+            if getattr(model.backend, "model_id", None):
+                trace.note(model=model.backend.model_id)
+            scheduler = self.scheduler(name, model.backend)
+            token = current_token()
+            try:
+                with trace.stage("queue"):
+                    ticket = scheduler.acquire(audio_seconds, deadline, token, client=client_id, priority=priority or "normal")
+            except Cancelled:
+                self.record_cancel("queued", scheduler.cost(audio_seconds))
+                raise
+            inference = None
+            queued = trace.stages.get("queue", 0.0)
+            start = time.perf_counter()
+            try:
+                text = model.backend.transcribe(audio_data, sample_rate, system_prompt, history, **kwargs)
+                if token is not None:
+                    # Decoding may have stopped early, the partial text is of no use
+                    token.check()
+                # Backends with their own request queue (workers, replicas) add the wait to "queue"
+                inference = time.perf_counter() - start - (trace.stages.get("queue", 0.0) - queued)
+                trace.add("inference", inference)
+                return text
+            except Cancelled:
+                self.record_cancel("running", scheduler.cost(audio_seconds) - (time.perf_counter() - start))
+                raise
+            finally:
+                scheduler.release(ticket, inference)
+                # Lets clients route around a busy server (hybrid routing)
+                depth, wait = scheduler.load()
+                trace.note(queue_depth=depth, expected_wait_ms=round(wait * 1000, 1))
+        finally:
+            self.models.release(model)
+
+    def record_cancel(self, stage, reclaimed_seconds):
+        """Counts a cancellation and the expected device time it saved."""
+        METRICS.incr("cancel.requests")
+        METRICS.incr(f"cancel.{stage}")
+        METRICS.incr("cancel.reclaimed_seconds", round(max(0.0, reclaimed_seconds), 3))
+        token = current_token()
+        print(f"Cancelled request {token.request_id if token else ''} while {stage}: {token.reason if token else ''}")
+
+    def cancel(self, request_id, reason="cancelled by client"):
+        """Cancels an in-flight request. Returns False if no such request is running."""
+        with self.inflight_lock:
+            token = self.inflight.get(request_id)
+        if token is None:
+            return False
+        token.cancel(reason)
+        return True
+
+    def handle_transcription(self, audio_data, sample_rate, system_prompt=None, request_id=None, token=None, profile=None, **kwargs):
+        """
+        Transcribes and applies the server-side post-processing. Shared by all transports.
+        Requests with a request_id can be cancelled with cancel(request_id). Requests
+        naming a profile get its settings, settings sent with the request take precedence.
+        """
+        replacements = None
+        if profile is not None:
+            profile = self.profiles.get(profile)
+            if "extra_replace" not in kwargs:
+                replacements = profile.replacements
+            kwargs = dict(profile.settings, **kwargs)
+            profile_prompt = kwargs.pop("system_prompt", None)
+            if system_prompt is None:
+                system_prompt = profile_prompt
+        token = token or CancelToken(request_id)
+        set_current_token(token)
+        if token.request_id:
+            with self.inflight_lock:
+                self.inflight[token.request_id] = token
+        try:
+            text = self.transcribe(audio_data, sample_rate, system_prompt=system_prompt, **kwargs)
+        finally:
+            set_current_token(None)
+            if token.request_id:
+                with self.inflight_lock:
+                    self.inflight.pop(token.request_id, None)
+        with current_trace().stage("postprocess"):
+            return self.postprocess(text, replacements=replacements, **kwargs)
+
+    def postprocess(self, text, replacements=None, **kwargs):
+        """
+        Runs the server's post-processing stages with the request's settings (its
+        opencc_convert and extra_replace table, compiled once per profile), falling
+        back to the server's own config for requests without them.
+        """
+        if replacements is None:
+            replacements = compile_replacements(kwargs.get("extra_replace"))
+        if replacements is None:
+            backend = normalize_backend(kwargs.get("backend") or self.config.get("asr_backend", "glm"))
+            replacements = compile_replacements(self.config.get(backend, {}).get("extra_replace"))
+        settings = {"opencc_convert": kwargs.get("opencc_convert", self.config.get("opencc_convert")), "replacements": replacements}
+        text, ran = self.pipeline.run(text, settings)
+        current_trace().note(postprocessed=ran)
+        return text
 
     def run(self):
         server_instance = self
         class ASRRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    snapshot = METRICS.snapshot()
+                    snapshot["models"] = server_instance.models.status()
+                    snapshot["schedulers"] = {name: s.status() for name, s in list(server_instance.schedulers.items())}
+                    snapshot["profiles"] = len(server_instance.profiles)
+                    body = json.dumps(snapshot, indent=2).encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-type', 'application/json')
+                elif self.path == '/models':
+                    body = json.dumps(server_instance.models.status(), indent=2).encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-type', 'application/json')
+                else:
+                    body = b"ASR server"
+                    self.send_response(200)
+                    self.send_header('Content-type', 'text/plain; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_json(self, status, payload):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def handle_admin(self):
+                """POST /models/load {"backend": ..., "pin": bool} and POST /models/unload {"backend": ...}"""
+                if not server_instance.remote_admin and self.client_address[0] not in ("127.0.0.1", "::1"):
+                    self.send_json(403, {"error": "Model admin is only allowed from localhost"})
+                    return
+                try:
+                    content_length = int(self.headers.get('Content-Length', 0))
+                    request = json.loads(self.rfile.read(content_length) or b"{}")
+                    name = server_instance.check_backend(request["backend"])
+                except Exception as e:
+                    self.send_json(400, {"error": str(e)})
+                    return
+
+                try:
+                    if self.path == '/models/load':
+                        server_instance.models.load(name, pin=request.get("pin"))
+                    elif not server_instance.models.unload(name):
+                        self.send_json(404, {"error": f"{name} is not loaded"})
+                        return
+                except Exception as e:
+                    self.send_json(500, {"error": str(e)})
+                    return
+                self.send_json(200, server_instance.models.status())
+
+            def handle_cancel(self):
+                """POST /cancel {"request_id": ...}"""
+                try:
+                    content_length = int(self.headers.get('Content-Length', 0))
+                    request_id = json.loads(self.rfile.read(content_length) or b"{}")["request_id"]
+                except Exception as e:
+                    self.send_json(400, {"error": str(e)})
+                    return
+                if server_instance.cancel(request_id):
+                    self.send_json(200, {"cancelled": request_id})
+                else:
+                    self.send_json(404, {"error": f"{request_id} is not in flight"})
+
+            def handle_profiles(self):
+                """POST /profiles {"settings": {...}} -> {"profile_id": ...}"""
+                try:
+                    content_length = int(self.headers.get('Content-Length', 0))
+                    settings = json.loads(self.rfile.read(content_length) or b"{}")["settings"]
+                    if isinstance(settings, dict):
+                        # Fair share is per client, by address unless the client names itself
+                        settings.setdefault("client_id", self.client_address[0])
+                    profile = server_instance.profiles.register(settings)
+                except Exception as e:
+                    self.send_json(400, {"error": str(e)})
+                    return
+                self.send_json(200, {"profile_id": profile.id})
+
+            def watch_disconnect(self, token, done):
+                """Cancels token if the client closes the connection before the answer is sent."""
+                while not done.wait(DISCONNECT_POLL_SECONDS):
+                    try:
+                        readable, _, _ = select.select([self.connection], [], [], 0)
+                        if readable and not self.connection.recv(1, socket.MSG_PEEK):
+                            token.cancel("client disconnected")
+                            return
+                    except (OSError, ValueError):
+                        # ValueError: closed meanwhile because the request has finished
+                        if not done.is_set():
+                            token.cancel("client disconnected")
+                        return
+
             def do_POST(self):
+                if self.path in ('/models/load', '/models/unload'):
+                    self.handle_admin()
+                    return
+                if self.path == '/cancel':
+                    self.handle_cancel()
+                    return
+                if self.path == '/profiles':
+                    self.handle_profiles()
+                    return
+
+                trace = begin_trace()
                 content_type = self.headers.get('Content-Type', '')
                 system_prompt = None
                 audio_np = None
@@ -96,8 +359,6 @@ class ASRServer:
                     self.wfile.write(b"No audio data found")
                     return
 
-                print(f"System Prompt: {system_prompt}")
-                
                 # Extract other potential settings from headers or multipart
                 # For now, let's check if there are any other form fields
                 extra_kwargs = {}
@@ -119,52 +380,107 @@ class ASRServer:
                     except Exception:
                         pass
 
-                text = server_instance.transcribe(audio_np, sample_rate, system_prompt=system_prompt, **extra_kwargs)
-
-                # Apply OpenCC if enabled
-                if server_instance.enable_opencc:
-                    opencc_mode = server_instance.config.get("opencc_convert")
-                    if opencc_mode:
-                        try:
-                            converter = opencc.OpenCC(opencc_mode)
-                            text = converter.convert(text)
-                            print(f"Server OpenCC converted ({opencc_mode}): {text}")
-                        except Exception as e:
-                            print(f"Server OpenCC conversion error: {e}")
-
-                # Apply extra_replace if enabled
-                if server_instance.enable_extra_replace:
-                    backend = server_instance.config.get("asr_backend", "glm")
-                    if backend == "sherpa-onnx/sense-voice":
-                        backend = "sensevoice"
-                    backend_config = server_instance.config.get(backend, {})
-                    extra_replace = backend_config.get("extra_replace")
-                    if extra_replace and isinstance(extra_replace, dict):
-                        for old, new in extra_replace.items():
-                            text = text.replace(old, new)
-                        print(f"Server Extra replace applied: {text}")
-                
+                if 'profile' in extra_kwargs and system_prompt is None:
+                    print(f"Profile: {extra_kwargs['profile']}")
+                else:
+                    print(f"System Prompt: {system_prompt}")
+
+                # Opt-in JSON body with the stage timings, plain text otherwise
+                want_json = extra_kwargs.pop('response_format', None) == 'json' or 'application/json' in self.headers.get('Accept', '')
+                trace.add("parse", time.perf_counter() - trace.start)
+
+                # Fair share is per client, by address unless the client names itself (a profile always does)
+                if 'profile' not in extra_kwargs:
+                    extra_kwargs.setdefault('client_id', self.client_address[0])
+                token = CancelToken(extra_kwargs.pop('request_id', None))
+                done = threading.Event()
+                threading.Thread(target=self.watch_disconnect, args=(token, done), daemon=True).start()
+                try:
+                    text = server_instance.handle_transcription(audio_np, sample_rate, system_prompt=system_prompt, token=token, **extra_kwargs)
+                except Cancelled as e:
+                    try:
+                        self.send_response(e.status)
+                        self.end_headers()
+                        self.wfile.write(str(e).encode('utf-8'))
+                    except (BrokenPipeError, ConnectionResetError):
+                        # Cancelled because the client went away
+                        pass
+                    return
+                except ValueError as e:
+                    self.send_response(400)
+                    self.end_headers()
+                    self.wfile.write(str(e).encode('utf-8'))
+                    return
+                except UnknownProfile as e:
+                    # Evicted or registered before a restart, the client registers it again
+                    self.send_response(e.status)
+                    self.end_headers()
+                    self.wfile.write(str(e).encode('utf-8'))
+                    return
+                except Overloaded as e:
+                    print(f"Shed request: {e}")
+                    self.send_response(503)
+                    self.send_header('Retry-After', str(e.retry_after))
+                    self.end_headers()
+                    self.wfile.write(str(e).encode('utf-8'))
+                    return
+                finally:
+                    done.set()
+
+                if want_json:
+                    body = json.dumps(trace.result(text), ensure_ascii=False).encode('utf-8')
+                else:
+                    body = text.encode('utf-8')
                 self.send_response(200)
-                self.send_header('Content-type', 'text/plain; charset=utf-8')
+                self.send_header('Content-type', 'application/json; charset=utf-8' if want_json else 'text/plain; charset=utf-8')
+                self.send_header('Server-Timing', trace.server_timing())
+                # Stages the client must not apply again
+                self.send_header('X-Postprocessed', ", ".join(trace.info.get("postprocessed", [])))
                 self.end_headers()
-                self.wfile.write(text.encode('utf-8'))
+                self.wfile.write(body)
 
-        httpd = HTTPServer(('0.0.0.0', self.port), ASRRequestHandler)
+        httpd = ThreadingHTTPServer(('0.0.0.0', self.port), ASRRequestHandler)
         print(f"HTTP ASR Server listening on port {self.port}...")
+
+        unix_server = None
+        if self.unix_socket:
+            unix_server = local_transport.make_server(self.unix_socket, self.handle_transcription)
+            threading.Thread(target=unix_server.serve_forever, daemon=True).start()
+            print(f"Local ASR transport listening on {self.unix_socket}...")
+
         try:
             httpd.serve_forever()
         except KeyboardInterrupt:
             print("\nServer stopping...")
             httpd.server_close()
+            if unix_server:
+                unix_server.server_close()
+                os.remove(self.unix_socket)
 
-if __name__ == "__main__":
+def main():
     parser = argparse.ArgumentParser(description="ASR Server")
     parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
-    parser.add_argument("--backend", type=str, default="glm", choices=["glm", "sensevoice", "sherpa-onnx/sense-voice", "whisper", "qwen"], help="ASR backend to use")
+    parser.add_argument("--backend", type=str, default="glm", choices=BACKEND_TYPES, help="ASR backend to use")
+    parser.add_argument("--backends", type=str, nargs="+", default=[], choices=BACKEND_TYPES, help="Other backends requests may load on demand (default: only --backend)")
     parser.add_argument("--config", type=str, help="Path to config.json")
     parser.add_argument("--config-json", type=str, help="JSON string of config")
     parser.add_argument("--enable-opencc", action="store_true", help="Enable OpenCC conversion on server side")
     parser.add_argument("--enable-extra-replace", action="store_true", help="Enable extra replace on server side")
+    parser.add_argument("--unix-socket", type=str, help="Also serve the raw float32 local transport on this Unix socket")
+    parser.add_argument("--replicas", type=int, default=1, help="Run the backend in this many worker processes")
+    parser.add_argument("--replica-devices", type=str, nargs="+", help="Device per replica, assigned round-robin (e.g. cuda:0 cuda:1 cpu)")
+    parser.add_argument("--replica-cpus", type=str, nargs="+", help="CPU set per replica, assigned round-robin (e.g. 0-7 8-15)")
+    parser.add_argument("--ram-budget-mb", type=float, default=0, help="Evict idle backends beyond this much RAM (0 = unlimited)")
+    parser.add_argument("--vram-budget-mb", type=float, default=0, help="Evict idle backends beyond this much GPU memory (0 = unlimited)")
+    parser.add_argument("--pin", type=str, nargs="+", default=[], help="Backends that are never evicted")
+    parser.add_argument("--remote-admin", action="store_true", help="Allow /models/load and /models/unload from other hosts")
+    parser.add_argument("--idle-seconds", type=float, default=0, help="Offload or unload backends unused for this long (0 = never)")
+    parser.add_argument("--idle-action", type=str, default="offload", choices=["offload", "unload"], help="Move idle weights to CPU, or drop them")
+    parser.add_argument("--max-queue", type=int, default=16, help="Requests waiting per backend before new ones get 503 (0 = unlimited)")
+    parser.add_argument("--schedule", type=str, default="cost", choices=["cost", "fifo"], help="Order of queued requests: cheapest first with aging and per-client fairness, or arrival")
+    parser.add_argument("--aging", type=float, default=1.0, help="Seconds of expected cost a queued request gains per second waited")
+    parser.add_argument("--model-cache", type=str, metavar="DIR", help="Save GLM/Whisper models in serving form under DIR for faster starts (several GB each)")
+    parser.add_argument("--preload-at", type=str, nargs="+", default=[], help="Times (HH:MM) to make the default backend resident again")
     args = parser.parse_args()
 
     config = {}
@@ -182,12 +498,32 @@ if __name__ == "__main__":
         if os.path.exists(default_config):
             with open(default_config, 'r') as f:
                 config = json.load(f)
+    if args.model_cache:
+        config["model_cache_dir"] = args.model_cache
 
     server = ASRServer(
         args.port, 
         backend_type=args.backend, 
         config=config, 
         enable_opencc=args.enable_opencc, 
-        enable_extra_replace=args.enable_extra_replace
+        enable_extra_replace=args.enable_extra_replace,
+        unix_socket=args.unix_socket,
+        replicas=args.replicas,
+        replica_devices=args.replica_devices,
+        replica_cpus=args.replica_cpus,
+        ram_budget_mb=args.ram_budget_mb,
+        vram_budget_mb=args.vram_budget_mb,
+        pinned=args.pin,
+        remote_admin=args.remote_admin,
+        idle_seconds=args.idle_seconds,
+        idle_action=args.idle_action,
+        preload_at=args.preload_at,
+        max_queue=args.max_queue,
+        schedule=args.schedule,
+        aging=args.aging,
+        backends=args.backends
     )
     server.run()
+
+if __name__ == "__main__":
+    main()